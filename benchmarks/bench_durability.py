@@ -0,0 +1,50 @@
+# benchmarks/bench_durability.py
+# author: nsarathy
+
+"""
+Measure single-document writes per second under each durability policy.
+Usage: python benchmarks/bench_durability.py [writes] [existing_docs]
+"""
+
+from coffy.nosql import db
+from coffy.nosql.atomicity import DURABILITY_LEVELS
+import os
+import sys
+import tempfile
+import time
+
+
+def bench(level, writes, existing, directory):
+    """
+    Add documents one at a time and return the number of writes per second.
+    level -- The durability policy to use.
+    writes -- Number of single-document adds to time.
+    existing -- Number of documents already in the collection.
+    directory -- Directory for the collection file.
+    """
+    col = db(
+        f"bench_{level}",
+        path=os.path.join(directory, f"{level}.json"),
+        durability=level,
+    )
+    col.add_many(
+        [{"id": i, "status": "active", "score": i % 100} for i in range(existing)]
+    )
+    start = time.perf_counter()
+    for i in range(writes):
+        col.add({"id": existing + i, "status": "new", "score": i % 100})
+    col.close()  # the final flush is part of the cost
+    return writes / (time.perf_counter() - start)
+
+
+def main():
+    writes = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    existing = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    print(f"{writes} single-document adds on top of {existing} documents")
+    with tempfile.TemporaryDirectory() as d:
+        for level in DURABILITY_LEVELS:
+            print(f"{level:>8}: {bench(level, writes, existing, d):10.1f} writes/sec")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+# benchmarks/bench_interning.py
+# author: nsarathy
+
+"""
+Measure the memory of a loaded collection with and without string interning.
+Usage: python benchmarks/bench_interning.py [documents]
+"""
+
+from coffy.nosql import db
+from coffy.nosql.memory import _deep_size
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+
+def make_docs(n):
+    """
+    Build documents shaped like a typical event log: unique ids and timestamps,
+    repeated categorical values and a nested object.
+    n -- Number of documents.
+    """
+    rng = random.Random(42)
+    statuses = ["active", "inactive", "pending", "banned"]
+    countries = ["US", "DE", "IN", "BR", "JP", "FR", "GB", "CA"]
+    plans = ["free", "pro", "team", "enterprise"]
+    return [
+        {
+            "id": f"user-{i:08d}",
+            "status": rng.choice(statuses),
+            "country": rng.choice(countries),
+            "plan": {"name": rng.choice(plans), "seats": rng.randint(1, 50)},
+            "tags": rng.sample(["beta", "vip", "churn-risk", "trial", "mobile"], 2),
+            "created": 1700000000 + i,
+        }
+        for i in range(n)
+    ]
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    with tempfile.TemporaryDirectory() as d:
+        path = os.path.join(d, "events.json")
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(make_docs(n), f)
+
+        start = time.perf_counter()
+        with open(path, "r", encoding="utf-8") as f:
+            plain = json.load(f)
+        plain_time = time.perf_counter() - start
+        plain_bytes, plain_dup = _deep_size(plain)
+        del plain
+
+        start = time.perf_counter()
+        col = db("bench_interning", path=path)
+        load_time = time.perf_counter() - start
+        stats = col.stats()
+
+    mib = 1024 * 1024
+    print(f"{n} documents")
+    print(
+        f"json.load:  {plain_bytes / mib:8.1f} MiB documents, "
+        f"{plain_dup / mib:6.1f} MiB duplicate strings, {plain_time:6.2f}s"
+    )
+    print(
+        f"collection: {stats['document_bytes'] / mib:8.1f} MiB documents, "
+        f"{stats['duplicate_string_bytes'] / mib:6.1f} MiB duplicate strings, "
+        f"{load_time:6.2f}s (including indexing)"
+    )
+    print(f"saved {1 - stats['document_bytes'] / plain_bytes:.0%} of document memory")
+
+
+if __name__ == "__main__":
+    main()
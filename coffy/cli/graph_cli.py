@@ -52,8 +52,8 @@ def _require_path(path: str) -> str:
         _die("missing --path FILE.json")
     if path.strip() in (":memory:", None):
         _die("in-memory graphs are not allowed in this CLI, provide a JSON file path")
-    if not path.endswith(".json"):
-        _die("path must end with .json")
+    if not path.endswith((".json", ".json.gz", ".json.zst", ".json.zf")):
+        _die("path must end with .json, .json.gz, .json.zst or .json.zf")
     return path
 
 
@@ -343,6 +343,8 @@ def cmd_match_node_path(args: argparse.Namespace) -> int:
         return_nodes=not args.return_ids,
         node_fields=args.node_fields,
         direction=args.direction,
+        limit=args.limit,
+        offset=args.offset,
     )
     if args.out:
         _ensure_parent(args.out)
@@ -373,6 +375,8 @@ def cmd_match_full_path(args: argparse.Namespace) -> int:
         node_fields=args.node_fields,
         rel_fields=args.rel_fields,
         direction=args.direction,
+        limit=args.limit,
+        offset=args.offset,
     )
     if args.out:
         _ensure_parent(args.out)
@@ -403,6 +407,8 @@ def cmd_match_structured(args: argparse.Namespace) -> int:
         node_fields=args.node_fields,
         rel_fields=args.rel_fields,
         direction=args.direction,
+        limit=args.limit,
+        offset=args.offset,
     )
     if args.out:
         _ensure_parent(args.out)
@@ -593,6 +599,8 @@ def build_parser() -> argparse.ArgumentParser:
         action="store_true",
         help="Return node id sequences instead of node dicts",
     )
+    sp.add_argument("--limit", type=int, help="Limit")
+    sp.add_argument("--offset", type=int, help="Offset")
     sp.add_argument("--out", help="Write results to JSON file")
     sp.add_argument("--pretty", action="store_true", help="Pretty-print JSON to stdout")
     sp.set_defaults(func=cmd_match_node_path)
@@ -614,6 +622,8 @@ def build_parser() -> argparse.ArgumentParser:
         "--rel-fields", nargs="+", help="Projection fields for relationships"
     )
     sp.add_argument("--direction", choices=["out", "in", "any"], default="out")
+    sp.add_argument("--limit", type=int, help="Limit")
+    sp.add_argument("--offset", type=int, help="Offset")
     sp.add_argument("--out", help="Write results to JSON file")
     sp.add_argument("--pretty", action="store_true", help="Pretty-print JSON to stdout")
     sp.set_defaults(func=cmd_match_full_path)
@@ -635,6 +645,8 @@ def build_parser() -> argparse.ArgumentParser:
         "--rel-fields", nargs="+", help="Projection fields for relationships"
     )
     sp.add_argument("--direction", choices=["out", "in", "any"], default="out")
+    sp.add_argument("--limit", type=int, help="Limit")
+    sp.add_argument("--offset", type=int, help="Offset")
     sp.add_argument("--out", help="Write results to JSON file")
     sp.add_argument("--pretty", action="store_true", help="Pretty-print JSON to stdout")
     sp.set_defaults(func=cmd_match_structured)
@@ -14,6 +14,7 @@ import sys
 from typing import List
 
 from coffy.nosql import db
+from coffy.nosql.atomicity import _iter_json_items
 
 OK = 0
 ERR = 1
@@ -47,8 +48,8 @@ def _require_path(path: str) -> str:
         _die("missing --path FILE.json")
     if path.strip() in (":memory:", None):
         _die("in-memory stores are not allowed in this CLI, provide a JSON file path")
-    if not path.endswith(".json"):
-        _die("path must end with .json")
+    if not path.endswith((".json", ".json.gz", ".json.zst", ".json.zf")):
+        _die("path must end with .json, .json.gz, .json.zst or .json.zf")
     return path
 
 
@@ -76,6 +77,31 @@ def _parse_scalar(s: str):
         return s
 
 
+def _dump_json_array(items, fp, indent=None) -> None:
+    """
+    Write an iterable as a JSON array without materializing it first.
+    The output is identical to json.dump of the equivalent list.
+    items -- The values to write.
+    fp -- The file object to write to.
+    indent -- Indentation as for json.dump.
+    """
+    first = True
+    for item in items:
+        text = json.dumps(item, indent=indent, ensure_ascii=False)
+        if indent is None:
+            fp.write("[" if first else ", ")
+        else:
+            pad = " " * indent
+            fp.write("[\n" if first else ",\n")
+            text = pad + text.replace("\n", "\n" + pad)
+        fp.write(text)
+        first = False
+    if first:
+        fp.write("[]")
+    else:
+        fp.write("]" if indent is None else "\n]")
+
+
 def cmd_init(args: argparse.Namespace) -> int:
     """
     Initialize a new NoSQL database.
@@ -182,16 +208,39 @@ def cmd_query(args: argparse.Namespace) -> int:
     elif args.first:
         print(json.dumps(q.first(), indent=2, ensure_ascii=False))
     else:
-        docs = q.run(fields=args.fields).as_list() if args.fields else q.run().as_list()
-        if args.out:
-            _ensure_parent(args.out)
-            with open(args.out, "w", encoding="utf-8") as f:
-                json.dump(docs, f, indent=2, ensure_ascii=False)
-            print(f"wrote {args.out}")
-        else:
-            print(
-                json.dumps(docs, indent=2 if args.pretty else None, ensure_ascii=False)
-            )
+        _write_docs(q.stream(fields=args.fields), args)
+    return OK
+
+
+def _write_docs(docs, args: argparse.Namespace) -> None:
+    """
+    Write documents as a JSON array to --out, or to stdout.
+    docs -- The documents to write.
+    args -- The command-line arguments.
+    """
+    if args.out:
+        _ensure_parent(args.out)
+        with open(args.out, "w", encoding="utf-8") as f:
+            _dump_json_array(docs, f, indent=2)
+        print(f"wrote {args.out}")
+    else:
+        _dump_json_array(docs, sys.stdout, indent=2 if args.pretty else None)
+        print()
+
+
+def cmd_read(args: argparse.Namespace) -> int:
+    """
+    Print a range of the stored documents without loading the collection.
+    Framed .json.zf files only decompress the frames holding the range.
+    args -- The command-line arguments.
+    """
+    path = _require_path(args.path)
+    if not os.path.exists(path):
+        _die(f"file not found: {path}")
+    if args.offset < 0 or (args.limit is not None and args.limit < 0):
+        _die("--offset and --limit must not be negative")
+    stop = None if args.limit is None else args.offset + args.limit
+    _write_docs(_iter_json_items(path, start=args.offset, stop=stop), args)
     return OK
 
 
@@ -290,6 +339,19 @@ def build_parser() -> argparse.ArgumentParser:
     )
     sp_query.set_defaults(func=cmd_query)
 
+    sp_read = sub.add_parser(
+        "read", help="Print stored documents by position, without loading them all"
+    )
+    sp_read.add_argument(
+        "--offset", type=int, default=0, help="Position of the first document"
+    )
+    sp_read.add_argument("--limit", type=int, help="Most documents to print")
+    sp_read.add_argument("--out", help="Write documents to JSON file")
+    sp_read.add_argument(
+        "--pretty", action="store_true", help="Pretty-print JSON to stdout"
+    )
+    sp_read.set_defaults(func=cmd_read)
+
     sp_agg = sub.add_parser("agg", help="Collection-level aggregation")
     sp_agg.add_argument(
         "agg",
@@ -0,0 +1,212 @@
+# coffy/graph/analytics.py
+# author: nsarathy
+
+"""
+Graph algorithms over the whole graph of a GraphDB, or the part of it with a
+label and relationship types.
+The part is a NetworkX subgraph view: nodes and relationships are filtered as
+they are read, so nothing is copied. PageRank and connected components use
+SciPy sparse matrices when SciPy is installed, and pure Python otherwise.
+"""
+
+import networkx as nx
+
+
+def _scipy():
+    """
+    Import the optional SciPy package.
+    Returns scipy.sparse.csgraph, or None if SciPy is not installed.
+    """
+    try:
+        import scipy.sparse.csgraph
+    except ImportError:
+        return None
+    return scipy.sparse.csgraph
+
+
+def subgraph_view(db, label=None, rel_types=None):
+    """
+    Get a read-only view of part of a graph.
+    db -- The GraphDB.
+    label -- Label of the nodes kept, or None for every node.
+    rel_types -- Type, or list of types, of the relationships kept, or None for
+        every relationship.
+    Returns a NetworkX graph view that follows later changes to the graph.
+    """
+    filter_node = nx.filters.no_filter
+    filter_edge = nx.filters.no_filter
+    if label is not None:
+        filter_node = db.index_manager.nodes_with_label(label).__contains__
+    if rel_types is not None:
+        types = {rel_types} if isinstance(rel_types, str) else set(rel_types)
+        adj = db.g.adj
+
+        def filter_edge(u, v):
+            return adj[u][v].get("_type") in types
+
+    return nx.subgraph_view(db.g, filter_node=filter_node, filter_edge=filter_edge)
+
+
+def _undirected(view):
+    """
+    Get an undirected view of a graph view, in which nodes are linked if a
+    relationship joins them either way.
+    view -- The graph view.
+    """
+    return view.to_undirected(as_view=True) if view.is_directed() else view
+
+
+def _groups(view, groups):
+    """
+    Order groups of nodes, largest first, each in graph order.
+    view -- The graph view the nodes belong to.
+    groups -- Iterable of sets of node ids.
+    Returns a list of lists of node ids.
+    """
+    order = {n: i for i, n in enumerate(view)}
+    ordered = [sorted(group, key=order.__getitem__) for group in groups]
+    ordered.sort(key=lambda group: (-len(group), order[group[0]]))
+    return ordered
+
+
+def pagerank(
+    db, label=None, rel_types=None, weight=None, alpha=0.85, max_iter=100, tol=1e-6
+):
+    """
+    Compute the PageRank of the nodes.
+    db -- The GraphDB.
+    label -- Label of the nodes ranked, or None for every node.
+    rel_types -- Type, or list of types, of the relationships followed, or None for any.
+    weight -- Optional relationship property holding its weight. Relationships
+        without it weigh 1.
+    alpha -- Damping factor.
+    max_iter -- Most power iterations.
+    tol -- Convergence tolerance.
+    Returns a dictionary of node id -> score, the scores adding up to 1.
+    """
+    view = subgraph_view(db, label, rel_types)
+    if len(view) == 0:
+        return {}
+    if _scipy() is not None:
+        return nx.pagerank(view, alpha=alpha, max_iter=max_iter, tol=tol, weight=weight)
+    nodes = list(view)
+    index = {n: i for i, n in enumerate(nodes)}
+    n = len(nodes)
+    links = []  # per node: [(index of a successor, share of the node's rank)]
+    for u in nodes:
+        out = [
+            (index[v], 1 if weight is None else rel.get(weight, 1))
+            for v, rel in view.adj[u].items()
+        ]
+        total = sum(w for _, w in out)
+        links.append([(j, w / total) for j, w in out] if total else [])
+    dangling = [i for i, out in enumerate(links) if not out]
+    x = [1.0 / n] * n
+    for _ in range(max_iter):
+        # Rank of nodes without successors is spread over every node.
+        base = (alpha * sum(x[i] for i in dangling) + 1 - alpha) / n
+        nxt = [base] * n
+        for i, out in enumerate(links):
+            rank = alpha * x[i]
+            for j, share in out:
+                nxt[j] += rank * share
+        err = sum(abs(a - b) for a, b in zip(nxt, x))
+        x = nxt
+        if err < n * tol:
+            return dict(zip(nodes, x))
+    raise nx.PowerIterationFailedConvergence(max_iter)
+
+
+def connected_components(db, label=None, rel_types=None):
+    """
+    Find the connected components, ignoring the direction of relationships.
+    db -- The GraphDB.
+    label -- Label of the nodes considered, or None for every node.
+    rel_types -- Type, or list of types, of the relationships followed, or None for any.
+    Returns a list of components, largest first, each a list of node ids.
+    """
+    view = subgraph_view(db, label, rel_types)
+    if len(view) == 0:
+        return []
+    csgraph = _scipy()
+    if csgraph is None:
+        if view.is_directed():
+            return _groups(view, nx.weakly_connected_components(view))
+        return _groups(view, nx.connected_components(view))
+    nodes = list(view)
+    matrix = nx.to_scipy_sparse_array(view, nodelist=nodes, weight=None)
+    _, labels = csgraph.connected_components(matrix, directed=True, connection="weak")
+    groups = {}
+    for node_id, component in zip(nodes, labels):
+        groups.setdefault(component, set()).add(node_id)
+    return _groups(view, groups.values())
+
+
+def betweenness(
+    db, k=None, label=None, rel_types=None, weight=None, normalized=True, seed=None
+):
+    """
+    Compute the betweenness centrality of the nodes.
+    db -- The GraphDB.
+    k -- Number of source nodes sampled to estimate it, or None for an exact
+        computation from every node.
+    label -- Label of the nodes considered, or None for every node.
+    rel_types -- Type, or list of types, of the relationships followed, or None for any.
+    weight -- Optional relationship property holding the cost of following it.
+    normalized -- Whether to scale the values by the number of node pairs.
+    seed -- Optional seed of the sampling, for repeatable estimates.
+    Returns a dictionary of node id -> centrality.
+    """
+    view = subgraph_view(db, label, rel_types)
+    if k is not None and k >= len(view):
+        k = None  # sampling every node is the exact computation
+    return nx.betweenness_centrality(
+        view, k=k, normalized=normalized, weight=weight, seed=seed
+    )
+
+
+def triangle_count(db, label=None, rel_types=None):
+    """
+    Count the triangles each node is part of, ignoring the direction of
+    relationships.
+    db -- The GraphDB.
+    label -- Label of the nodes considered, or None for every node.
+    rel_types -- Type, or list of types, of the relationships followed, or None for any.
+    Returns a dictionary of node id -> number of triangles.
+    """
+    return nx.triangles(_undirected(subgraph_view(db, label, rel_types)))
+
+
+def community_detection(
+    db,
+    method="louvain",
+    label=None,
+    rel_types=None,
+    weight=None,
+    resolution=1,
+    seed=None,
+):
+    """
+    Split the nodes into communities.
+    db -- The GraphDB.
+    method -- "louvain" for Louvain modularity optimization, or
+        "label_propagation" for label propagation, which ignores the direction
+        and weight of relationships.
+    label -- Label of the nodes considered, or None for every node.
+    rel_types -- Type, or list of types, of the relationships followed, or None for any.
+    weight -- Optional relationship property holding its weight, for "louvain".
+    resolution -- Above 1 favors smaller communities, below 1 larger ones, for
+        "louvain".
+    seed -- Optional seed, for repeatable "louvain" results.
+    Returns a list of communities, largest first, each a list of node ids.
+    """
+    view = subgraph_view(db, label, rel_types)
+    if method == "louvain":
+        groups = nx.community.louvain_communities(
+            view, weight=weight, resolution=resolution, seed=seed
+        )
+    elif method == "label_propagation":
+        groups = nx.community.label_propagation_communities(_undirected(view))
+    else:
+        raise ValueError("Method must be 'louvain' or 'label_propagation'")
+    return _groups(view, groups)
@@ -1,6 +1,8 @@
 # coffy/graph/graph_result.py
 # author: nsarathy
 
+from itertools import islice
+
 
 class GraphResult:
     """
@@ -9,34 +11,71 @@ class GraphResult:
 
     def __init__(self, docs):
         """
-        Initializes the GraphResult with a list of node/relationships.
-        docs -- List of dictionaries representing the node/relationships returned by the graph query.
-        """
-        self._docs = docs
+        Initializes the GraphResult with node/relationships.
+        docs -- List of dictionaries representing the node/relationships returned by the graph query,
+            or an iterable producing them. An iterable is consumed only as far as
+            the result is read: iterating or indexing stops early, while len(),
+            count(), as_list() and the aggregates read it to the end. Results
+            already produced are kept, so the result can be read more than once.
+        """
+        if isinstance(docs, list):
+            self._docs = docs
+            self._pending = None
+        else:
+            self._docs = []
+            self._pending = iter(docs)
+
+    def _fill(self, n=None):
+        """
+        Produce results from the pending iterable.
+        n -- Number of results to hold when done, or None for all of them.
+        """
+        if self._pending is None:
+            return
+        if n is None:
+            self._docs.extend(self._pending)
+            self._pending = None
+            return
+        missing = n - len(self._docs)
+        if missing > 0:
+            self._docs.extend(islice(self._pending, missing))
+            if len(self._docs) < n:
+                self._pending = None
 
     def __iter__(self):
         """
         Returns an iterator over the node/relationships in the result.
         """
-        return iter(self._docs)
+        i = 0
+        while i < len(self._docs) or self._pending is not None:
+            self._fill(i + 1)
+            if i < len(self._docs):
+                yield self._docs[i]
+            i += 1
 
     def __getitem__(self, index):
         """
         Returns the node/relationship at the specified index.
         index -- The index of the node/relationship to retrieve.
         """
+        if isinstance(index, int) and index >= 0:
+            self._fill(index + 1)
+        else:
+            self._fill()
         return self._docs[index]
 
     def __len__(self):
         """
         Returns the number of node/relationships in the result.
         """
+        self._fill()
         return len(self._docs)
 
     def as_list(self):
         """
         Returns the node/relationships as a list.
         """
+        self._fill()
         return self._docs
 
     def sum(self, field):
@@ -45,9 +84,7 @@ class GraphResult:
         field -- The field to sum across the node/relationships.
         """
         return sum(
-            d.get(field, 0)
-            for d in self._docs
-            if isinstance(d.get(field), (int, float))
+            d.get(field, 0) for d in self if isinstance(d.get(field), (int, float))
         )
 
     def avg(self, field):
@@ -55,9 +92,7 @@ class GraphResult:
         Returns the average of the specified field across all node/relationships.
         field -- The field to average across the node/relationships.
         """
-        values = [
-            d.get(field) for d in self._docs if isinstance(d.get(field), (int, float))
-        ]
+        values = [d.get(field) for d in self if isinstance(d.get(field), (int, float))]
         return sum(values) / len(values) if values else 0
 
     def min(self, field):
@@ -65,9 +100,7 @@ class GraphResult:
         Returns the minimum of the specified field across all node/relationships.
         field -- The field to find the minimum of across the node/relationships.
         """
-        values = [
-            d.get(field) for d in self._docs if isinstance(d.get(field), (int, float))
-        ]
+        values = [d.get(field) for d in self if isinstance(d.get(field), (int, float))]
         return min(values) if values else None
 
     def max(self, field):
@@ -75,19 +108,18 @@ class GraphResult:
         Returns the maximum of the specified field across all node/relationships.
         field -- The field to find the maximum of across the node/relationships.
         """
-        values = [
-            d.get(field) for d in self._docs if isinstance(d.get(field), (int, float))
-        ]
+        values = [d.get(field) for d in self if isinstance(d.get(field), (int, float))]
         return max(values) if values else None
 
     def count(self):
         """
         Returns the number of node/relationships in the result.
         """
-        return len(self._docs)
+        return len(self)
 
     def first(self):
         """
         Returns the first node/relationship in the result.
         """
+        self._fill(1)
         return self._docs[0] if self._docs else None
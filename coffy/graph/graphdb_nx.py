@@ -5,38 +5,99 @@
 A simple graph database using NetworkX.
 """
 
-from .atomicity import _atomic_save
+from . import analytics
+from .atomicity import _atomic_save, _DurableWriter, _file_format, _load_json
 from .graph_result import GraphResult
 from .graph_view import _view_graph
-import json
+from .index_engine import IndexManager
+from .journal import Journal
+from .pattern import CompiledPattern
+from .traversal import Traversal
+from contextlib import contextmanager
+from itertools import islice
 import networkx as nx
 import os
 
 
+def _page(items, limit, offset):
+    """
+    Lazily skip offset items and stop after limit more.
+    items -- Iterable to page through.
+    limit -- Optional limit on the number of items.
+    offset -- Optional number of items to skip.
+    """
+    start = offset or 0
+    return islice(items, start, None if limit is None else start + limit)
+
+
+def _project(node_id, attrs, fields):
+    """
+    Project a node's attributes, as project_node does.
+    node_id -- Unique identifier for the node.
+    attrs -- The node's attributes.
+    fields -- Optional list of fields to include in the projection.
+    """
+    node = attrs.copy()
+    node["id"] = node_id
+    if fields is None:
+        return node
+    return {k: node[k] for k in fields if k in node}
+
+
 class GraphDB:
     """
     A class to represent a graph database.
     """
 
-    def __init__(self, directed=False, path=None):
+    def __init__(
+        self,
+        directed=False,
+        path=None,
+        durability="always",
+        group_window=0.1,
+        journal=False,
+        compact_ratio=0.5,
+    ):
         """
         Initialize a GraphDB instance.
         directed -- Whether the graph is directed or not.
         path -- Path to the JSON file where the graph will be stored.
             If path is ":memory:" or None, the graph will be in-memory only.
-            If path is provided, it must end with ".json".
+            If path is provided, it must end with ".json", or with ".json.gz",
+            ".json.zst" or ".json.zf" to store it compressed.
+        durability -- When automatic saves reach the disk: "always", "group", "os"
+            or "never". See coffy.graph.atomicity for the crash semantics of each.
+        group_window -- Seconds between fsyncs under the "group" policy.
+        journal -- Whether to append mutations to a log file next to the snapshot
+            (path + ".log") instead of rewriting the snapshot after each one.
+            The log is replayed on load. See coffy.graph.journal.
+        compact_ratio -- With a journal, the snapshot is rewritten and the log
+            emptied once the log is larger than compact_ratio times the snapshot.
         """
         self.g = nx.DiGraph() if directed else nx.Graph()
         self.directed = directed
+        self.index_manager = IndexManager(directed)
+        self._batch_depth = 0
+        self._batch_dirty = False  # a batch made changes not yet persisted
         self.in_memory = path == ":memory:"
 
         if path and not self.in_memory:
-            if path.endswith(".json"):
+            if _file_format(path) is not None:
                 self.path = path
         else:
             self.in_memory = True
+        self._writer = _DurableWriter(
+            None if self.in_memory else self.path, durability, group_window
+        )
+        self._journal = None
+        self._journal_entries = []  # entries of changes not yet persisted
+        self._compact_ratio = compact_ratio
+        self._snapshot_bytes = 0
+        if journal and not self.in_memory:
+            self._journal = Journal(self.path + ".log", durability, group_window)
         if not self.in_memory and os.path.exists(self.path):
             self.load(self.path)
+            self._snapshot_bytes = os.path.getsize(self.path)
         elif not self.in_memory:
             os.makedirs(os.path.dirname(self.path), exist_ok=True)
             self.save(self.path)
@@ -54,23 +115,38 @@ class GraphDB:
             raise KeyError(
                 f"Node '{node_id}' already exists. Use update_node to modify it."
             )
+        self._insert_node(node_id, labels, attrs)
+        self._record("node", node_id, self.g.nodes[node_id])
+        self._persist()
+
+    def _insert_node(self, node_id, labels, attrs):
+        """
+        Add a node to the graph and the indexes, without persisting.
+        node_id -- Unique identifier for the node.
+        labels -- Optional list of labels for the node.
+        attrs -- Additional attributes for the node.
+        """
         if labels is not None:
             attrs["_labels"] = labels if isinstance(labels, list) else [labels]
         self.g.add_node(node_id, **attrs)
-        self._persist()
+        self.index_manager.index_node(node_id, attrs)
 
     def add_nodes(self, nodes):
         """
         Add multiple nodes to the graph.
         nodes -- List of dictionaries, each representing a node.
+        The graph is saved once, after all nodes are added.
         """
-        for node in nodes:
-            node_id = node["id"]
-            labels = node.get("labels") or node.get("_labels")  # Accept either form
-            attrs = {
-                k: v for k, v in node.items() if k not in ["id", "labels", "_labels"]
-            }
-            self.add_node(node_id, labels=labels, **attrs)
+        with self.batch():
+            for node in nodes:
+                node_id = node["id"]
+                labels = node.get("labels") or node.get("_labels")  # Either form
+                attrs = {
+                    k: v
+                    for k, v in node.items()
+                    if k not in ["id", "labels", "_labels"]
+                }
+                self.add_node(node_id, labels=labels, **attrs)
 
     def get_node(self, node_id):
         """
@@ -101,12 +177,27 @@ class GraphDB:
         else:
             return self.g.neighbors(node_id)
 
+    def _step_neighbors(self, node_id, rel_type, direction):
+        """
+        Get the neighbors reached by one step of a path pattern.
+        node_id -- Unique identifier for the node.
+        rel_type -- Type the relationship must have, or None for any relationship.
+        direction -- Direction of the search ('in', 'out', or 'any').
+        Returns an iterable of neighbor node IDs.
+        """
+        if rel_type:
+            return self.index_manager.neighbors(node_id, rel_type, direction)
+        return self._get_neighbors(node_id, direction)
+
     def remove_node(self, node_id):
         """
         Remove a node from the graph.
         node_id -- Unique identifier for the node.
         """
+        if self.has_node(node_id):
+            self._unindex_node(node_id)
         self.g.remove_node(node_id)
+        self._record("del_node", node_id)
         self._persist()
 
     def remove_nodes_by_label(self, label):
@@ -114,12 +205,30 @@ class GraphDB:
         Remove all nodes with a specific label.
         label -- The label of the nodes to remove.
         """
-        nodes_to_remove = [
-            n for n, a in self.g.nodes(data=True) if label in a.get("_labels", [])
-        ]
+        nodes_to_remove = list(self.index_manager.nodes_with_label(label))
+        for n in nodes_to_remove:
+            self._unindex_node(n)
+            self._record("del_node", n)
         self.g.remove_nodes_from(nodes_to_remove)
         self._persist()
 
+    def _unindex_node(self, node_id):
+        """
+        Remove a node and its relationships from the indexes, before the node is
+        removed from the graph.
+        node_id -- Unique identifier for the node.
+        """
+        self.index_manager.unindex_node(node_id, self.g.nodes[node_id])
+        if self.directed:
+            edges = [
+                *self.g.out_edges(node_id, data=True),
+                *self.g.in_edges(node_id, data=True),
+            ]
+        else:
+            edges = self.g.edges(node_id, data=True)
+        for u, v, a in edges:
+            self.index_manager.unindex_edge(u, v, a)
+
     # Relationship (edge) operations
     def add_relationship(self, source, target, rel_type=None, **attrs):
         """
@@ -129,26 +238,43 @@ class GraphDB:
         rel_type -- Optional type of the relationship.
         attrs -- Additional attributes for the relationship.
         """
+        self._insert_relationship(source, target, rel_type, attrs)
+        self._record("rel", source, target, self.g.edges[source, target])
+        self._persist()
+
+    def _insert_relationship(self, source, target, rel_type, attrs):
+        """
+        Add a relationship to the graph and the indexes, without persisting.
+        source -- Unique identifier for the source node.
+        target -- Unique identifier for the target node.
+        rel_type -- Optional type of the relationship.
+        attrs -- Additional attributes for the relationship.
+        """
         if rel_type:
             attrs["_type"] = rel_type
+        previous = self.g.get_edge_data(source, target)
+        if previous is not None:  # add_edge updates the existing relationship
+            self.index_manager.unindex_edge(source, target, previous)
         self.g.add_edge(source, target, **attrs)
-        self._persist()
+        self.index_manager.index_edge(source, target, self.g.edges[source, target])
 
     def add_relationships(self, relationships):
         """
         Add multiple relationships to the graph.
         relationships -- List of dictionaries, each representing a relationship.
-        """
-        for rel in relationships:
-            source = rel["source"]
-            target = rel["target"]
-            rel_type = rel.get("type") or rel.get("_type")
-            attrs = {
-                k: v
-                for k, v in rel.items()
-                if k not in ["source", "target", "type", "_type"]
-            }
-            self.add_relationship(source, target, rel_type=rel_type, **attrs)
+        The graph is saved once, after all relationships are added.
+        """
+        with self.batch():
+            for rel in relationships:
+                source = rel["source"]
+                target = rel["target"]
+                rel_type = rel.get("type") or rel.get("_type")
+                attrs = {
+                    k: v
+                    for k, v in rel.items()
+                    if k not in ["source", "target", "type", "_type"]
+                }
+                self.add_relationship(source, target, rel_type=rel_type, **attrs)
 
     def get_relationship(self, source, target):
         """
@@ -165,7 +291,10 @@ class GraphDB:
         source -- Unique identifier for the source node.
         target -- Unique identifier for the target node.
         """
+        attrs = self.g.get_edge_data(source, target)
         self.g.remove_edge(source, target)
+        self.index_manager.unindex_edge(source, target, attrs)
+        self._record("del_rel", source, target)
         self._persist()
 
     def remove_relationships_by_type(self, type):
@@ -173,9 +302,15 @@ class GraphDB:
         Remove all relationships of a specific type.
         type -- Type of the relationship to remove.
         """
-        edges_to_remove = [
-            (u, v) for u, v, a in self.g.edges(data=True) if a.get("_type") == type
-        ]
+        if type is None:
+            edges_to_remove = [
+                (u, v) for u, v, a in self.g.edges(data=True) if a.get("_type") is None
+            ]
+        else:
+            edges_to_remove = list(self.index_manager.edges_with_type(type))
+        for u, v in edges_to_remove:
+            self.index_manager.unindex_edge(u, v, self.g.edges[u, v])
+            self._record("del_rel", u, v)
         self.g.remove_edges_from(edges_to_remove)
         self._persist()
 
@@ -221,7 +356,14 @@ class GraphDB:
         """
         if not self.has_node(node_id):
             raise KeyError(f"Node '{node_id}' does not exist.")
-        self.g.nodes[node_id].update(attrs)
+        node = self.g.nodes[node_id]
+        if self.index_manager.node_affected(attrs):
+            self.index_manager.unindex_node(node_id, node)
+            node.update(attrs)
+            self.index_manager.index_node(node_id, node)
+        else:
+            node.update(attrs)
+        self._record("node", node_id, node)
         self._persist()
 
     def update_relationship(self, source, target, **attrs):
@@ -233,7 +375,14 @@ class GraphDB:
         """
         if not self.has_relationship(source, target):
             raise KeyError(f"Relationship '{source}->{target}' does not exist.")
-        self.g.edges[source, target].update(attrs)
+        rel = self.g.edges[source, target]
+        if self.index_manager.rel_affected(attrs):
+            self.index_manager.unindex_edge(source, target, rel)
+            rel.update(attrs)
+            self.index_manager.index_edge(source, target, rel)
+        else:
+            rel.update(attrs)
+        self._record("rel", source, target, rel)
         self._persist()
 
     def set_node(self, node_id, labels=None, **attrs):
@@ -247,7 +396,6 @@ class GraphDB:
             self.update_node(node_id, **attrs)
         else:
             self.add_node(node_id, labels=labels, **attrs)
-        self._persist()
 
     # Advanced node search
     def project_node(self, node_id, fields=None):
@@ -260,11 +408,7 @@ class GraphDB:
         """
         if not self.has_node(node_id):
             return None
-        node = self.get_node(node_id).copy()
-        node["id"] = node_id
-        if fields is None:
-            return node
-        return {k: node[k] for k in fields if k in node}
+        return _project(node_id, self.get_node(node_id), fields)
 
     def project_relationship(self, source, target, fields=None):
         """
@@ -291,16 +435,28 @@ class GraphDB:
         limit -- Optional limit on the number of results.
         offset -- Optional offset for pagination.
         conditions -- Conditions to filter nodes by.
-        Returns a list of nodes that match the conditions.
-            Each node is projected using the specified fields.
-        """
+        Returns a lazy GraphResult of the nodes that match the conditions.
+            Each node is projected using the specified fields when it is read,
+            and nodes before the offset or after the limit are never projected.
+        """
+        nodes = self.g.nodes
+        order = self.g if label is None else self.index_manager.nodes_with_label(label)
+        candidates = self.index_manager.node_candidates(label, conditions)
+        # Copy the candidate ids, so the graph can change while the result is read.
+        # Indexed candidates are put back in scan order, so an index never
+        # changes which nodes a page holds.
+        if candidates is None:
+            ids = list(order)
+        else:
+            candidates = set(candidates)
+            ids = [n for n in order if n in candidates]
+        matches = (
+            (n, nodes[n])
+            for n in ids
+            if n in nodes and self._match_conditions(nodes[n], conditions)
+        )
         return GraphResult(
-            [
-                self.project_node(n, fields)
-                for n, a in self.g.nodes(data=True)
-                if (label is None or label in a.get("_labels", []))
-                and self._match_conditions(a, conditions)
-            ][offset : offset + limit if limit is not None else None]
+            _project(n, a, fields) for n, a in _page(matches, limit, offset)
         )
 
     def find_by_label(self, label, fields=None, limit=None, offset=0):
@@ -310,15 +466,13 @@ class GraphDB:
         fields -- Optional list of fields to include in the projection.
         limit -- Optional limit on the number of results.
         offset -- Optional offset for pagination.
-        Returns a list of nodes that have the specified label.
-            Each node is projected using the specified fields.
+        Returns a lazy GraphResult of the nodes that have the specified label.
+            Each node is projected using the specified fields when it is read.
         """
+        ids = list(self.index_manager.nodes_with_label(label))
         return GraphResult(
-            [
-                self.project_node(n, fields)
-                for n, a in self.g.nodes(data=True)
-                if label in a.get("_labels", [])
-            ][offset : offset + limit if limit is not None else None]
+            self.project_node(n, fields)
+            for n in _page((n for n in ids if self.g.has_node(n)), limit, offset)
         )
 
     def find_relationships(
@@ -331,16 +485,37 @@ class GraphDB:
         limit -- Optional limit on the number of results.
         offset -- Optional offset for pagination.
         conditions -- Conditions to filter relationships by.
-        Returns a list of relationships that match the conditions.
-            Each relationship is projected using the specified fields.
+        Returns a lazy GraphResult of the relationships that match the conditions.
+            Each relationship is projected using the specified fields when it is
+            read, and relationships before the offset or after the limit are
+            never projected.
         """
+        if rel_type is None:
+            order = self.g.edges
+        else:
+            order = self.index_manager.edges_with_type(rel_type)
+        candidates = self.index_manager.rel_candidates(rel_type, conditions)
+        # Copy the candidate pairs, so the graph can change while the result is read.
+        # Indexed candidates are put back in scan order, as in find_nodes.
+        if candidates is None:
+            pairs = list(order)
+        else:
+            candidates = set(candidates)
+            if not self.directed:
+                candidates.update((v, u) for u, v in list(candidates))
+            pairs = [e for e in order if e in candidates]
+        adj = self.g.adj
+        matches = (
+            (u, v)
+            for u, v in pairs
+            for a in [adj.get(u, {}).get(v)]
+            if a is not None
+            and (rel_type is None or a.get("_type") == rel_type)
+            and self._match_conditions(a, conditions)
+        )
         return GraphResult(
-            [
-                self.project_relationship(u, v, fields)
-                for u, v, a in self.g.edges(data=True)
-                if (rel_type is None or a.get("_type") == rel_type)
-                and self._match_conditions(a, conditions)
-            ][offset : offset + limit if limit is not None else None]
+            self.project_relationship(u, v, fields)
+            for u, v in _page(matches, limit, offset)
         )
 
     def find_by_relationship_type(self, rel_type, fields=None, limit=None, offset=0):
@@ -350,15 +525,45 @@ class GraphDB:
         fields -- Optional list of fields to include in the projection.
         limit -- Optional limit on the number of results.
         offset -- Optional offset for pagination.
-        Returns a list of relationships that have the specified type.
-            Each relationship is projected using the specified fields.
+        Returns a lazy GraphResult of the relationships that have the specified
+            type. Each relationship is projected using the specified fields when
+            it is read.
         """
+        if rel_type is None:
+            edges = [
+                (u, v) for u, v, a in self.g.edges(data=True) if a.get("_type") is None
+            ]
+        else:
+            edges = list(self.index_manager.edges_with_type(rel_type))
         return GraphResult(
-            [
-                self.project_relationship(u, v, fields)
-                for u, v, a in self.g.edges(data=True)
-                if a.get("_type") == rel_type
-            ][offset : offset + limit if limit is not None else None]
+            self.project_relationship(u, v, fields)
+            for u, v in _page(
+                ((u, v) for u, v in edges if self.g.has_edge(u, v)), limit, offset
+            )
+        )
+
+    def create_node_index(self, label, prop, kind="hash"):
+        """
+        Index a node property. find_nodes, and the start conditions of the match_*
+        methods, then look up eq conditions on it (and gt/gte/lt/lte for a sorted
+        index) instead of checking every node.
+        label -- Label of the nodes to index, or None for every node.
+        prop -- The property to index.
+        kind -- "hash" for eq conditions, or "sorted" for eq and range conditions.
+        """
+        self.index_manager.create_node_index(label, prop, kind, self.g.nodes(data=True))
+
+    def create_rel_index(self, rel_type, prop, kind="hash"):
+        """
+        Index a relationship property. find_relationships then looks up eq
+        conditions on it (and gt/gte/lt/lte for a sorted index) instead of
+        checking every relationship.
+        rel_type -- Type of the relationships to index, or None for every one.
+        prop -- The property to index.
+        kind -- "hash" for eq conditions, or "sorted" for eq and range conditions.
+        """
+        self.index_manager.create_rel_index(
+            rel_type, prop, kind, self.g.edges(data=True)
         )
 
     def _match_conditions(self, attrs, conditions):
@@ -402,207 +607,306 @@ class GraphDB:
         return all(results)
 
     def match_node_path(
-        self, start, pattern, return_nodes=True, node_fields=None, direction="out"
+        self,
+        start,
+        pattern,
+        return_nodes=True,
+        node_fields=None,
+        direction="out",
+        limit=None,
+        offset=0,
     ):
         """
         Match a path in the graph starting from a node.
         start -- Starting node conditions (e.g., {"name": "Alice"}).
-        pattern -- Pattern to match, a list of dictionaries with "rel_type" and "node" keys.
+        pattern -- Pattern to match, a list of dictionaries with "rel_type" and "node" keys,
+            and optional "min" and "max" hops for a variable-length step.
         return_nodes -- Whether to return the nodes in the path.
         node_fields -- Optional list of fields to include in the projected nodes.
         direction -- Direction of the search ('in', 'out', or 'any').
+        limit -- Optional limit on the number of paths.
+        offset -- Optional offset for pagination.
         Returns a list of paths, where each path is a list of node IDs.
+            The search stops once limit paths are found.
         """
-        start_nodes = self.find_nodes(**start)
-        node_paths = []
-
-        for s in start_nodes:
-            self._match_node_path(
-                current_id=s["id"],
-                pattern=pattern,
-                node_path=[s["id"]],
-                node_paths=node_paths,
-                direction=direction,
-            )
-
-        unique_paths = list({tuple(p) for p in node_paths})
-
+        paths = (p for p, _ in self._match(start, pattern, direction, limit, offset))
         if return_nodes:
-            return [
-                [self.project_node(n, node_fields) for n in path]
-                for path in unique_paths
-            ]
-        return unique_paths
-
-    def _match_node_path(self, current_id, pattern, node_path, node_paths, direction):
-        """
-        Recursive helper function to match a node path.
-        current_id -- Current node ID.
-        pattern -- Pattern to match.
-        node_path -- Current path of node IDs.
-        node_paths -- List to collect all matching node paths.
-        direction -- Direction of the search ('in', 'out', or 'any').
-        """
-        if not pattern:
-            node_paths.append(node_path)
-            return
-
-        step = pattern[0]
-        rel_type = step.get("rel_type")
-        next_node_cond = step.get("node", {})
-
-        for neighbor in self._get_neighbors(current_id, direction):
-            rel = self.get_relationship(current_id, neighbor)
-            if rel_type and rel.get("_type") != rel_type:
-                continue
-            node_attrs = self.get_node(neighbor)
-            if not self._match_conditions(node_attrs, next_node_cond):
-                continue
-            if neighbor in node_path:  # avoid cycles
-                continue
-            self._match_node_path(
-                neighbor, pattern[1:], node_path + [neighbor], node_paths, direction
-            )
+            return [[self.project_node(n, node_fields) for n in path] for path in paths]
+        return list(paths)
 
     def match_full_path(
-        self, start, pattern, node_fields=None, rel_fields=None, direction="out"
+        self,
+        start,
+        pattern,
+        node_fields=None,
+        rel_fields=None,
+        direction="out",
+        limit=None,
+        offset=0,
     ):
         """
         Match a full path in the graph starting from a node.
         start -- Starting node conditions (e.g., {"name": "Alice"}).
-        pattern -- Pattern to match, a list of dictionaries with "rel_type" and "node" keys.
+        pattern -- Pattern to match, a list of dictionaries with "rel_type" and "node" keys,
+            and optional "min" and "max" hops for a variable-length step.
         node_fields -- Optional list of fields to include in the projected nodes.
         rel_fields -- Optional list of fields to include in the projected relationships.
         direction -- Direction of the search ('in', 'out', or 'any').
+        limit -- Optional limit on the number of paths.
+        offset -- Optional offset for pagination.
         """
-        start_nodes = self.find_nodes(**start)
-        matched_paths = []
-
-        for s in start_nodes:
-            self._match_full_path(
-                current_id=s["id"],
-                pattern=pattern,
-                relationship_path=[],
-                node_path=[s["id"]],
-                matched_paths=matched_paths,
-                direction=direction,
-            )
-
         return [
             {
                 "nodes": [self.project_node(n, node_fields) for n in nodes],
                 "relationships": [
-                    self.project_relationship(u, v, rel_fields) for u, v in path
+                    self.project_relationship(u, v, rel_fields) for u, v in edges
                 ],
             }
-            for path, nodes in matched_paths
+            for nodes, edges in self._match(start, pattern, direction, limit, offset)
         ]
 
-    def _match_full_path(
+    def match_path_structured(
         self,
-        current_id,
+        start,
         pattern,
-        relationship_path,
-        node_path,
-        matched_paths,
-        direction,
-    ):
-        """
-        Recursive helper function to match a full path.
-        current_id -- Current node ID.
-        pattern -- Pattern to match.
-        relationship_path -- Current path of relationships.
-        node_path -- Current path of node IDs.
-        matched_paths -- List to collect all matching paths.
-        direction -- Direction of the search ('in', 'out', or 'any').
-        """
-        if not pattern:
-            matched_paths.append((relationship_path, node_path))
-            return
-
-        step = pattern[0]
-        rel_type = step.get("rel_type")
-        next_node_cond = step.get("node", {})
-
-        for neighbor in self._get_neighbors(current_id, direction):
-            if neighbor in node_path:
-                continue
-            rel = self.get_relationship(current_id, neighbor)
-            if rel_type and rel.get("_type") != rel_type:
-                continue
-            if not self._match_conditions(self.get_node(neighbor), next_node_cond):
-                continue
-
-            self._match_full_path(
-                neighbor,
-                pattern[1:],
-                relationship_path + [(current_id, neighbor)],
-                node_path + [neighbor],
-                matched_paths,
-                direction,
-            )
-
-    def match_path_structured(
-        self, start, pattern, node_fields=None, rel_fields=None, direction="out"
+        node_fields=None,
+        rel_fields=None,
+        direction="out",
+        limit=None,
+        offset=0,
     ):
         """
         Match a structured path in the graph starting from a node.
         start -- Starting node conditions (e.g., {"name": "Alice"}).
-        pattern -- Pattern to match, a list of dictionaries with "rel_type" and "node" keys.
+        pattern -- Pattern to match, a list of dictionaries with "rel_type" and "node" keys,
+            and optional "min" and "max" hops for a variable-length step.
         node_fields -- Optional list of fields to include in the projected nodes.
         rel_fields -- Optional list of fields to include in the projected relationships.
         direction -- Direction of the search ('in', 'out', or 'any').
+        limit -- Optional limit on the number of paths.
+        offset -- Optional offset for pagination.
         """
-        start_nodes = self.find_nodes(**start)
         structured_paths = []
+        for nodes, edges in self._match(start, pattern, direction, limit, offset):
+            path = [{"node": self.project_node(nodes[0], node_fields)}]
+            for (u, v), n in zip(edges, nodes[1:]):
+                path.append({"relationship": self.project_relationship(u, v)})
+                path.append({"node": self.project_node(n)})
+            structured_paths.append({"path": path})
+        return structured_paths
 
-        for s in start_nodes:
-            self._match_structured_path(
-                current_id=s["id"],
-                pattern=pattern,
-                path=[{"node": self.project_node(s["id"], node_fields)}],
-                structured_paths=structured_paths,
-                direction=direction,
-            )
+    def _match(self, start, pattern, direction, limit, offset):
+        """
+        Lazily match a pattern, stopping after the requested page.
+        start -- Starting node conditions.
+        pattern -- Pattern to match.
+        direction -- Direction of the search.
+        limit -- Optional limit on the number of paths.
+        offset -- Optional offset for pagination.
+        Returns an iterator of (node ids, relationships) per path, as
+            CompiledPattern.run() yields them.
+        """
+        return _page(
+            CompiledPattern(self, start, pattern, direction).run(), limit, offset
+        )
 
-        return structured_paths
+    # Traversal methods
 
-    def _match_structured_path(
-        self, current_id, pattern, path, structured_paths, direction
+    def shortest_path(
+        self, source, target, rel_types=None, weight=None, direction="out", fields=None
     ):
         """
-        Recursive helper function to match a structured path.
-        current_id -- Current node ID.
-        pattern -- Pattern to match.
-        path -- Current structured path.
-        structured_paths -- List to collect all matching structured paths.
+        Find a shortest path between two nodes.
+        source -- Unique identifier for the node to start from.
+        target -- Unique identifier for the node to reach.
+        rel_types -- Type, or list of types, of the relationships followed, or None for any.
+        weight -- Optional relationship property holding the cost of following it.
+            Without it, the path with the fewest relationships is found.
+            Relationships without the property cost 1.
         direction -- Direction of the search ('in', 'out', or 'any').
+        fields -- Optional list of fields to include in the projected nodes.
+        Returns a GraphResult of the nodes along the path, source first.
+            It is empty if either node is missing or target cannot be reached.
+        """
+        traversal = Traversal(self, rel_types, direction)
+        if not (self.has_node(source) and self.has_node(target)):
+            return GraphResult([])
+        path = traversal.shortest_path(source, target, weight) or []
+        return GraphResult([self.project_node(n, fields) for n in path])
+
+    def reachable(
+        self, source, max_depth=None, rel_types=None, direction="out", fields=None
+    ):
         """
-        if not pattern:
-            structured_paths.append({"path": path})
-            return
+        Find the nodes reachable from a node.
+        source -- Unique identifier for the node to start from.
+        max_depth -- Optional limit on the number of relationships followed.
+        rel_types -- Type, or list of types, of the relationships followed, or None for any.
+        direction -- Direction of the search ('in', 'out', or 'any').
+        fields -- Optional list of fields to include in the projected nodes.
+        Returns a lazy GraphResult of the nodes reached, nearest first, without
+            the source. Reading only part of it stops the search early.
+        """
+        traversal = Traversal(self, rel_types, direction)
+        if not self.has_node(source):
+            return GraphResult([])
+        return GraphResult(
+            self.project_node(n, fields) for n, _ in traversal.levels(source, max_depth)
+        )
+
+    def k_hop_neighbors(self, node_id, k, rel_types=None, direction="out", fields=None):
+        """
+        Find the nodes exactly k relationships away from a node, following
+        shortest paths.
+        node_id -- Unique identifier for the node.
+        k -- Number of relationships.
+        rel_types -- Type, or list of types, of the relationships followed, or None for any.
+        direction -- Direction of the search ('in', 'out', or 'any').
+        fields -- Optional list of fields to include in the projected nodes.
+        Returns a lazy GraphResult of the nodes whose shortest distance from
+            node_id is k.
+        """
+        traversal = Traversal(self, rel_types, direction)
+        if not self.has_node(node_id):
+            return GraphResult([])
+        if k == 0:
+            return GraphResult([self.project_node(node_id, fields)])
+        return GraphResult(
+            self.project_node(n, fields)
+            for n, depth in traversal.levels(node_id, k)
+            if depth == k
+        )
 
-        step = pattern[0]
-        rel_type = step.get("rel_type")
-        next_node_cond = step.get("node", {})
+    # Graph analytics
 
-        for neighbor in self._get_neighbors(current_id, direction):
-            if any(e.get("node", {}).get("id") == neighbor for e in path):
-                continue  # Avoid cycles
+    def pagerank(
+        self,
+        label=None,
+        rel_types=None,
+        weight=None,
+        alpha=0.85,
+        max_iter=100,
+        tol=1e-06,
+        write=None,
+    ):
+        """
+        Compute the PageRank of the nodes.
+        label -- Label of the nodes ranked, or None for every node.
+        rel_types -- Type, or list of types, of the relationships followed, or None for any.
+        weight -- Optional relationship property holding its weight.
+        alpha -- Damping factor.
+        max_iter -- Most power iterations.
+        tol -- Convergence tolerance.
+        write -- Optional node property to store each node's score in.
+        Returns a dictionary of node id -> score.
+        """
+        scores = analytics.pagerank(
+            self, label, rel_types, weight, alpha, max_iter, tol
+        )
+        self._write_property(write, scores)
+        return scores
+
+    def connected_components(self, label=None, rel_types=None, write=None):
+        """
+        Find the connected components, ignoring the direction of relationships.
+        label -- Label of the nodes considered, or None for every node.
+        rel_types -- Type, or list of types, of the relationships followed, or None for any.
+        write -- Optional node property to store each node's component number in.
+        Returns a list of components, largest first, each a list of node ids.
+        """
+        components = analytics.connected_components(self, label, rel_types)
+        self._write_groups(write, components)
+        return components
 
-            rel = self.get_relationship(current_id, neighbor)
-            if rel_type and rel.get("_type") != rel_type:
-                continue
-            if not self._match_conditions(self.get_node(neighbor), next_node_cond):
-                continue
+    def betweenness(
+        self,
+        k=None,
+        label=None,
+        rel_types=None,
+        weight=None,
+        normalized=True,
+        seed=None,
+        write=None,
+    ):
+        """
+        Compute the betweenness centrality of the nodes.
+        k -- Number of source nodes sampled to estimate it, or None for an exact
+            computation.
+        label -- Label of the nodes considered, or None for every node.
+        rel_types -- Type, or list of types, of the relationships followed, or None for any.
+        weight -- Optional relationship property holding the cost of following it.
+        normalized -- Whether to scale the values by the number of node pairs.
+        seed -- Optional seed of the sampling.
+        write -- Optional node property to store each node's centrality in.
+        Returns a dictionary of node id -> centrality.
+        """
+        values = analytics.betweenness(
+            self, k, label, rel_types, weight, normalized, seed
+        )
+        self._write_property(write, values)
+        return values
 
-            extended_path = path + [
-                {"relationship": self.project_relationship(current_id, neighbor)},
-                {"node": self.project_node(neighbor)},
-            ]
+    def triangle_count(self, label=None, rel_types=None, write=None):
+        """
+        Count the triangles each node is part of, ignoring the direction of
+        relationships.
+        label -- Label of the nodes considered, or None for every node.
+        rel_types -- Type, or list of types, of the relationships followed, or None for any.
+        write -- Optional node property to store each node's count in.
+        Returns a dictionary of node id -> number of triangles.
+        """
+        counts = analytics.triangle_count(self, label, rel_types)
+        self._write_property(write, counts)
+        return counts
+
+    def community_detection(
+        self,
+        method="louvain",
+        label=None,
+        rel_types=None,
+        weight=None,
+        resolution=1,
+        seed=None,
+        write=None,
+    ):
+        """
+        Split the nodes into communities.
+        method -- "louvain" or "label_propagation".
+        label -- Label of the nodes considered, or None for every node.
+        rel_types -- Type, or list of types, of the relationships followed, or None for any.
+        weight -- Optional relationship property holding its weight, for "louvain".
+        resolution -- Above 1 favors smaller communities, for "louvain".
+        seed -- Optional seed, for "louvain".
+        write -- Optional node property to store each node's community number in.
+        Returns a list of communities, largest first, each a list of node ids.
+        """
+        communities = analytics.community_detection(
+            self, method, label, rel_types, weight, resolution, seed
+        )
+        self._write_groups(write, communities)
+        return communities
+
+    def _write_property(self, prop, values):
+        """
+        Store computed values as a node property, saving the graph once.
+        prop -- The property name, or None to store nothing.
+        values -- Dictionary of node id -> value.
+        """
+        if prop is None:
+            return
+        with self.batch():
+            for node_id, value in values.items():
+                self.update_node(node_id, **{prop: value})
 
-            self._match_structured_path(
-                neighbor, pattern[1:], extended_path, structured_paths, direction
+    def _write_groups(self, prop, groups):
+        """
+        Store the position of each node's group as a node property.
+        prop -- The property name, or None to store nothing.
+        groups -- List of lists of node ids.
+        """
+        if prop is not None:
+            self._write_property(
+                prop, {n: i for i, group in enumerate(groups) for n in group}
             )
 
     # Aggregation methods
@@ -618,9 +922,7 @@ class GraphDB:
         Count the number of nodes with a specific label.
         label -- The label to count.
         """
-        return sum(
-            1 for n, a in self.g.nodes(data=True) if label in a.get("_labels", [])
-        )
+        return self.index_manager.count_label(label)
 
     def count_relationships(self):
         """
@@ -633,7 +935,11 @@ class GraphDB:
         Count the number of relationships of a specific type.
         type -- Type of the relationship to count.
         """
-        return sum(1 for _, _, a in self.g.edges(data=True) if a.get("_type") == type)
+        if type is None:
+            return sum(
+                1 for _, _, a in self.g.edges(data=True) if a.get("_type") is None
+            )
+        return self.index_manager.count_type(type)
 
     def avg_degree(self):
         """
@@ -784,6 +1090,11 @@ class GraphDB:
         if not path:
             raise ValueError("No path specified to save the graph.")
         _atomic_save(self.to_dict(), path)
+        if self._journal is not None and path == self.path:
+            # The snapshot now holds every journaled change.
+            self._journal_entries = []
+            self._journal.truncate()
+            self._snapshot_bytes = os.path.getsize(path)
 
     def load(self, path=None):
         """
@@ -795,19 +1106,33 @@ class GraphDB:
         path = path or self.path
         if not path:
             raise ValueError("No path specified to load the graph.")
-        if os.path.getsize(path) == 0:
-            return
-        with open(path, "r", encoding="utf-8") as f:
-            data = json.load(f)
+        if os.path.getsize(path) > 0:
+            self._load_snapshot(path)
+        if self._journal is not None and path == self.path:
+            for entry in self._journal.replay():
+                self._apply(entry)
+
+    def _load_snapshot(self, path):
+        """
+        Replace the graph by the one saved in a file, without persisting, as the
+        file already holds it.
+        path -- Path to the file.
+        """
+        data = _load_json(path)
         self.g.clear()
+        self.index_manager.clear()
         for node in data.get("nodes", []):
-            self.add_node(node["id"], **{k: v for k, v in node.items() if k != "id"})
+            self._insert_node(
+                node["id"],
+                node.get("labels"),
+                {k: v for k, v in node.items() if k not in ["id", "labels"]},
+            )
         for rel in data.get("relationships", []):
-            self.add_relationship(
+            self._insert_relationship(
                 rel["source"],
                 rel["target"],
-                rel_type=rel.get("type") or rel.get("_type"),
-                **{
+                rel.get("type") or rel.get("_type"),
+                {
                     k: v
                     for k, v in rel.items()
                     if k not in ["source", "target", "type", "_type"]
@@ -826,18 +1151,145 @@ class GraphDB:
             raise ValueError("No path specified to save the query result.")
         _atomic_save(result, path)
 
+    @contextmanager
+    def batch(self):
+        """
+        Group mutations so the graph is saved once, when the outermost batch
+        exits, instead of after each mutation. The save also happens if the
+        block raises, as the changes made before the error are kept in memory.
+        """
+        self._batch_depth += 1
+        try:
+            yield self
+        finally:
+            self._batch_depth -= 1
+            if not self._batch_depth and self._batch_dirty:
+                self._batch_dirty = False
+                self._persist()
+
     def _persist(self):
         """
         Persist changes to the graph to the file if not in memory.
+        Inside a batch, only record that there are changes to persist.
+        """
+        if self.in_memory:
+            return
+        if self._batch_depth:
+            self._batch_dirty = True
+        elif self._journal is not None:
+            entries, self._journal_entries = self._journal_entries, []
+            self._journal.append(entries)
+            if (
+                self._writer.durability != "never"
+                and self._journal.size > self._compact_ratio * self._snapshot_bytes
+            ):
+                self.compact()
+        elif self._writer.durability == "never":
+            self._writer.dirty = True
+        else:
+            self._writer.save(self.to_dict())
+
+    @property
+    def durability(self):
+        """
+        The durability policy used for automatic saves.
+        """
+        return self._writer.durability
+
+    def flush(self):
+        """
+        Make every change to the graph durable on disk, whatever the
+        durability policy. Does nothing for in-memory graphs.
+        """
+        if self.in_memory:
+            return
+        if self._journal is not None:
+            self._batch_dirty = False
+            entries, self._journal_entries = self._journal_entries, []
+            self._journal.append(entries)
+            self._journal.flush()
+            if self._journal.size > self._compact_ratio * self._snapshot_bytes:
+                self.compact()
+            return
+        if self._batch_dirty:
+            self._batch_dirty = False
+            self._writer.dirty = True
+        self._writer.flush(self.to_dict() if self._writer.dirty else None)
+
+    def close(self):
+        """
+        Flush pending changes and stop any scheduled background fsync.
         """
-        if not self.in_memory:
+        self.flush()
+        self._writer.close()
+        if self._journal is not None:
+            self._journal.close()
+
+    def compact(self):
+        """
+        Rewrite the snapshot and empty the journal. Journaled graphs do this
+        automatically once the journal outgrows compact_ratio times the snapshot.
+        Without a journal, this is the same as flush().
+        """
+        if self._journal is None:
+            self.flush()
+        else:
             self.save(self.path)
 
+    def _record(self, *entry):
+        """
+        Queue a journal entry for the next persist, if journaling.
+        entry -- The entry, see coffy.graph.journal.
+        """
+        if self._journal is not None:
+            self._journal_entries.append(entry)
+
+    def _apply(self, entry):
+        """
+        Replay a journal entry on the graph, without persisting.
+        entry -- The entry, see coffy.graph.journal.
+        """
+        op = entry[0]
+        if op == "node":
+            _, node_id, attrs = entry
+            if self.has_node(node_id):
+                node = self.g.nodes[node_id]
+                self.index_manager.unindex_node(node_id, node)
+                node.clear()
+                node.update(attrs)
+                self.index_manager.index_node(node_id, node)
+            else:
+                self._insert_node(node_id, None, attrs)
+        elif op == "rel":
+            _, source, target, attrs = entry
+            rel = self.g.get_edge_data(source, target)
+            if rel is not None:
+                self.index_manager.unindex_edge(source, target, rel)
+                rel.clear()
+            self._insert_relationship(source, target, None, attrs)
+        elif op == "del_node":
+            if self.has_node(entry[1]):
+                self._unindex_node(entry[1])
+                self.g.remove_node(entry[1])
+        elif op == "del_rel":
+            _, source, target = entry
+            rel = self.g.get_edge_data(source, target)
+            if rel is not None:
+                self.index_manager.unindex_edge(source, target, rel)
+                self.g.remove_edge(source, target)
+        elif op == "clear":
+            self.g.clear()
+            self.index_manager.clear()
+        else:
+            raise ValueError(f"Unknown journal entry: {entry!r}")
+
     def clear(self):
         """
         Clear the graph, removing all nodes and relationships.
         """
         self.g.clear()
+        self.index_manager.clear()
+        self._record("clear")
         self._persist()
 
     def view(self):
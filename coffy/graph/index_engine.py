@@ -0,0 +1,429 @@
+# coffy/graph/index_engine.py
+# author: nsarathy
+
+"""
+Secondary indexes for GraphDB, updated by every mutation so lookups by label,
+relationship type or indexed property cost O(matches) instead of a scan of the
+whole graph.
+"""
+
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+
+_RANGE_OPS = ("gt", "gte", "lt", "lte")
+
+
+def _node_labels(attrs):
+    """
+    Get the labels stored in a node's attributes.
+    attrs -- The node's attribute dictionary.
+    Returns a list of labels, empty if the node has none.
+    """
+    labels = attrs.get("_labels")
+    if labels is None:
+        return []
+    return labels if isinstance(labels, list) else [labels]
+
+
+def _link(adjacency, node_id, rel_type, neighbor):
+    """
+    Record a typed neighbor in an adjacency map.
+    adjacency -- Map of node id -> type -> {neighbor id: None}.
+    node_id -- The node.
+    rel_type -- The relationship type.
+    neighbor -- The neighbor.
+    """
+    adjacency.setdefault(node_id, {}).setdefault(rel_type, {})[neighbor] = None
+
+
+def _unlink(adjacency, node_id, rel_type, neighbor):
+    """
+    Forget a typed neighbor, dropping maps left empty.
+    adjacency -- Map of node id -> type -> {neighbor id: None}.
+    node_id -- The node.
+    rel_type -- The relationship type.
+    neighbor -- The neighbor.
+    """
+    by_type = adjacency.get(node_id)
+    if by_type is None or rel_type not in by_type:
+        return
+    by_type[rel_type].pop(neighbor, None)
+    if not by_type[rel_type]:
+        del by_type[rel_type]
+        if not by_type:
+            del adjacency[node_id]
+
+
+class PropertyIndex:
+    """
+    Index of one property: value -> ids of the nodes or relationships holding it.
+    A "sorted" index also answers gt/gte/lt/lte through a sorted view of its
+    distinct values, numbers and strings apart, built lazily after changes.
+    """
+
+    def __init__(self, kind="hash"):
+        """
+        Initialize an empty index.
+        kind -- "hash" for equality only, or "sorted" for equality and ranges.
+        """
+        if kind not in ("hash", "sorted"):
+            raise ValueError("Index kind must be 'hash' or 'sorted'")
+        self.kind = kind
+        self.postings = {}  # value -> {id: None}
+        self._sorted = None  # (sorted numbers, sorted strings), built lazily
+
+    def add(self, key, value):
+        """
+        Index the value of a node or relationship.
+        key -- The node id, or (source, target) of the relationship.
+        value -- The property value.
+        """
+        try:
+            ids = self.postings.get(value)
+        except TypeError:
+            return  # unhashable values are never equal to a condition value
+        if ids is None:
+            ids = self.postings[value] = {}
+            self._sorted = None
+        ids[key] = None
+
+    def remove(self, key, value):
+        """
+        Stop indexing the value of a node or relationship.
+        key -- The node id, or (source, target) of the relationship.
+        value -- The indexed property value.
+        Returns True if the key was indexed under the value.
+        """
+        try:
+            ids = self.postings.get(value)
+        except TypeError:
+            return False
+        if ids is None or key not in ids:
+            return False
+        del ids[key]
+        if not ids:
+            del self.postings[value]
+            self._sorted = None
+        return True
+
+    def lookup(self, op, value):
+        """
+        Get the ids whose value satisfies a condition.
+        op -- "eq", "gt", "gte", "lt" or "lte".
+        value -- The value of the condition.
+        Returns a list of ids, or None if the index cannot answer the condition.
+        """
+        if op == "eq":
+            if value is None:
+                return None  # a missing property also equals None
+            try:
+                return list(self.postings.get(value, ()))
+            except TypeError:
+                return None
+        if op not in _RANGE_OPS or self.kind != "sorted":
+            return None
+        if isinstance(value, str):
+            values = self._sorted_values()[1]
+        elif isinstance(value, (int, float)) and value == value:
+            values = self._sorted_values()[0]
+        else:
+            return None
+        if op == "gt":
+            selected = values[bisect_right(values, value) :]
+        elif op == "gte":
+            selected = values[bisect_left(values, value) :]
+        elif op == "lt":
+            selected = values[: bisect_left(values, value)]
+        else:
+            selected = values[: bisect_right(values, value)]
+        return [key for v in selected for key in self.postings[v]]
+
+    def _sorted_values(self):
+        """
+        Get the sorted distinct values of the index.
+        Returns (numbers, strings).
+        """
+        if self._sorted is None:
+            self._sorted = (
+                sorted(
+                    v
+                    for v in self.postings
+                    if isinstance(v, (int, float)) and v == v  # skip NaN
+                ),
+                sorted(v for v in self.postings if isinstance(v, str)),
+            )
+        return self._sorted
+
+    def clear(self):
+        """
+        Remove every id from the index.
+        """
+        self.postings.clear()
+        self._sorted = None
+
+
+def _plan(indexes, scope, conditions):
+    """
+    Pick the most selective indexed condition of a query.
+    indexes -- Map of (scope, property) -> PropertyIndex.
+    scope -- Label or relationship type the query is restricted to, or None.
+    conditions -- Conditions of the query, as for GraphDB._match_conditions.
+    Returns (candidate ids, whether they all belong to the scope), or None if no
+    index applies. Candidates still have to be checked against the conditions.
+    """
+    if not indexes or conditions.get("_logic", "and") != "and":
+        return None
+    best = None
+    for prop, expected in conditions.items():
+        if prop == "_logic":
+            continue
+        index = indexes.get((scope, prop)) if scope is not None else None
+        covered = index is not None
+        if index is None:
+            index = indexes.get((None, prop))
+            if index is None:
+                continue
+        if isinstance(expected, dict):
+            checks = expected.items()
+        else:
+            checks = [("eq", expected)]
+        for op, value in checks:
+            ids = index.lookup(op, value)
+            if ids is not None and (best is None or len(ids) < len(best[0])):
+                best = (ids, covered)
+    return best
+
+
+class IndexManager:
+    """
+    Indexes of the nodes and relationships of a graph.
+    Ids are kept in dictionaries used as ordered sets, so results come out in
+    the order the label or type was given to each node or relationship.
+    Only relationships with a "_type" are indexed; untyped ones are found by
+    scanning.
+    """
+
+    def __init__(self, directed=False):
+        """
+        Initialize empty indexes.
+        directed -- Whether the graph is directed.
+        """
+        self.directed = directed
+        self.labels = defaultdict(dict)  # label -> {node id: None}
+        self.rel_types = defaultdict(dict)  # type -> {(source, target): None}
+        self.out = {}  # node id -> type -> {neighbor id: None}
+        self.inc = {}  # directed only: node id -> type -> {predecessor id: None}
+        self.node_props = {}  # (label or None, property) -> PropertyIndex
+        self.rel_props = {}  # (type or None, property) -> PropertyIndex
+
+    def index_node(self, node_id, attrs):
+        """
+        Add a node to the indexes.
+        node_id -- The node's id.
+        attrs -- The node's attribute dictionary.
+        """
+        labels = _node_labels(attrs)
+        for label in labels:
+            self.labels[label][node_id] = None
+        for (label, prop), index in self.node_props.items():
+            if prop in attrs and (label is None or label in labels):
+                index.add(node_id, attrs[prop])
+
+    def unindex_node(self, node_id, attrs):
+        """
+        Remove a node from the indexes.
+        node_id -- The node's id.
+        attrs -- The node's attribute dictionary, as it was indexed.
+        """
+        labels = _node_labels(attrs)
+        for label in labels:
+            ids = self.labels.get(label)
+            if ids is not None:
+                ids.pop(node_id, None)
+                if not ids:
+                    del self.labels[label]
+        for (label, prop), index in self.node_props.items():
+            if prop in attrs and (label is None or label in labels):
+                index.remove(node_id, attrs[prop])
+
+    def index_edge(self, source, target, attrs):
+        """
+        Add a relationship to the indexes.
+        source -- The source node id.
+        target -- The target node id.
+        attrs -- The relationship's attribute dictionary.
+        """
+        rel_type = attrs.get("_type")
+        for (scope, prop), index in self.rel_props.items():
+            if prop in attrs and (scope is None or scope == rel_type):
+                index.add((source, target), attrs[prop])
+        if rel_type is None:
+            return
+        self.rel_types[rel_type][(source, target)] = None
+        _link(self.out, source, rel_type, target)
+        if self.directed:
+            _link(self.inc, target, rel_type, source)
+        else:
+            _link(self.out, target, rel_type, source)
+
+    def unindex_edge(self, source, target, attrs):
+        """
+        Remove a relationship from the indexes.
+        source -- The source node id.
+        target -- The target node id.
+        attrs -- The relationship's attribute dictionary, as it was indexed.
+        """
+        rel_type = attrs.get("_type")
+        for (scope, prop), index in self.rel_props.items():
+            if prop in attrs and (scope is None or scope == rel_type):
+                if (
+                    not index.remove((source, target), attrs[prop])
+                    and not self.directed
+                ):
+                    index.remove((target, source), attrs[prop])
+        if rel_type is None:
+            return
+        edges = self.rel_types.get(rel_type)
+        if edges is not None:
+            if edges.pop((source, target), False) is False and not self.directed:
+                edges.pop((target, source), None)
+            if not edges:
+                del self.rel_types[rel_type]
+        _unlink(self.out, source, rel_type, target)
+        if self.directed:
+            _unlink(self.inc, target, rel_type, source)
+        else:
+            _unlink(self.out, target, rel_type, source)
+
+    def create_node_index(self, label, prop, kind, nodes):
+        """
+        Index a property of the nodes with a label.
+        label -- The label, or None for every node.
+        prop -- The property.
+        kind -- "hash" or "sorted", see PropertyIndex.
+        nodes -- Iterable of (node id, attributes) of the graph's nodes.
+        """
+        index = PropertyIndex(kind)
+        for node_id, attrs in nodes:
+            if prop in attrs and (label is None or label in _node_labels(attrs)):
+                index.add(node_id, attrs[prop])
+        self.node_props[(label, prop)] = index
+
+    def create_rel_index(self, rel_type, prop, kind, edges):
+        """
+        Index a property of the relationships of a type.
+        rel_type -- The type, or None for every relationship.
+        prop -- The property.
+        kind -- "hash" or "sorted", see PropertyIndex.
+        edges -- Iterable of (source, target, attributes) of the graph's edges.
+        """
+        index = PropertyIndex(kind)
+        for source, target, attrs in edges:
+            if prop in attrs and (rel_type is None or attrs.get("_type") == rel_type):
+                index.add((source, target), attrs[prop])
+        self.rel_props[(rel_type, prop)] = index
+
+    def node_affected(self, attrs):
+        """
+        Check whether an update touches labels or indexed node properties.
+        attrs -- The updated attributes.
+        """
+        return "_labels" in attrs or any(p in attrs for _, p in self.node_props)
+
+    def rel_affected(self, attrs):
+        """
+        Check whether an update touches the type or indexed relationship properties.
+        attrs -- The updated attributes.
+        """
+        return "_type" in attrs or any(p in attrs for _, p in self.rel_props)
+
+    def node_candidates(self, label, conditions):
+        """
+        Use the property indexes to narrow the nodes a query has to check.
+        label -- Label the query is restricted to, or None.
+        conditions -- Conditions of the query.
+        Returns a list of node ids, or None if no index applies.
+        """
+        plan = _plan(self.node_props, label, conditions)
+        if plan is None:
+            return None
+        ids, covered = plan
+        if label is not None and not covered:
+            labelled = self.labels.get(label, {})
+            ids = [n for n in ids if n in labelled]
+        return ids
+
+    def rel_candidates(self, rel_type, conditions):
+        """
+        Use the property indexes to narrow the relationships a query has to check.
+        rel_type -- Type the query is restricted to, or None.
+        conditions -- Conditions of the query.
+        Returns a list of (source, target) pairs, or None if no index applies.
+        The type of the candidates still has to be checked.
+        """
+        plan = _plan(self.rel_props, rel_type, conditions)
+        return None if plan is None else plan[0]
+
+    def nodes_with_label(self, label):
+        """
+        Get the ids of the nodes with a label.
+        label -- The label.
+        Returns a view of the node ids, empty if no node has the label.
+        """
+        ids = self.labels.get(label)
+        return ids.keys() if ids is not None else {}.keys()
+
+    def count_label(self, label):
+        """
+        Count the nodes with a label.
+        label -- The label.
+        """
+        return len(self.labels.get(label, ()))
+
+    def edges_with_type(self, rel_type):
+        """
+        Get the relationships of a type.
+        rel_type -- The relationship type.
+        Returns a view of (source, target) pairs, empty if there are none.
+        """
+        edges = self.rel_types.get(rel_type)
+        return edges.keys() if edges is not None else {}.keys()
+
+    def count_type(self, rel_type):
+        """
+        Count the relationships of a type.
+        rel_type -- The relationship type.
+        """
+        return len(self.rel_types.get(rel_type, ()))
+
+    def neighbors(self, node_id, rel_type, direction="out"):
+        """
+        Get the neighbors of a node through relationships of one type.
+        node_id -- The node's id.
+        rel_type -- The relationship type.
+        direction -- 'out' for targets, 'in' for sources or 'any' for both.
+            Ignored for undirected graphs.
+        Returns an iterable of neighbor ids.
+        """
+        if not self.directed or direction == "out":
+            return self.out.get(node_id, {}).get(rel_type, {}).keys()
+        if direction == "in":
+            return self.inc.get(node_id, {}).get(rel_type, {}).keys()
+        if direction == "any":
+            return {
+                **self.out.get(node_id, {}).get(rel_type, {}),
+                **self.inc.get(node_id, {}).get(rel_type, {}),
+            }.keys()
+        raise ValueError("Direction must be 'in', 'out', or 'any'")
+
+    def clear(self):
+        """
+        Remove every node and relationship from the indexes, keeping the
+        property index definitions.
+        """
+        for index in (*self.node_props.values(), *self.rel_props.values()):
+            index.clear()
+        self.labels.clear()
+        self.rel_types.clear()
+        self.out.clear()
+        self.inc.clear()
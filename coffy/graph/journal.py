@@ -0,0 +1,175 @@
+# coffy/graph/journal.py
+# author: nsarathy
+
+"""
+Append-only mutation log for file-backed graphs.
+Each line is one JSON entry describing the state a node or relationship was
+left in, so replaying the log over the snapshot it was written against (or
+over a newer snapshot) gives the same graph:
+
+    ["node", id, attrs]          -- the node exists with exactly these attributes
+    ["rel", source, target, attrs] -- the relationship exists with these attributes
+    ["del_node", id]             -- the node and its relationships are gone
+    ["del_rel", source, target]  -- the relationship is gone
+    ["clear"]                    -- the graph is empty
+
+Appends follow the durability policies of coffy.graph.atomicity. A crash in the
+middle of an append leaves a partial last line, which replay ignores.
+"""
+
+import json
+import os
+import threading
+import time
+
+
+class Journal:
+    """
+    A log file that entries are appended to and replayed from.
+    """
+
+    def __init__(self, path, durability="always", group_window=0.1):
+        """
+        Initialize the journal. The file is created on the first append.
+        path -- Path of the log file.
+        durability -- One of "always", "group", "os" or "never".
+        group_window -- Seconds between fsyncs under the "group" policy.
+        """
+        self.path = path
+        self.durability = durability
+        self.group_window = group_window
+        self.size = os.path.getsize(path) if os.path.exists(path) else 0
+        self._pending = []  # encoded entries not yet written, only under "never"
+        self._file = None
+        self._unsynced = False
+        self._last_sync = 0.0
+        self._timer = None
+        self._lock = threading.Lock()
+
+    def append(self, entries):
+        """
+        Append entries according to the durability policy.
+        entries -- List of entries.
+        """
+        if not entries:
+            return
+        data = "".join(
+            json.dumps(e, separators=(",", ":"), ensure_ascii=False) + "\n"
+            for e in entries
+        ).encode("utf-8")
+        self.size += len(data)
+        if self.durability == "never":
+            self._pending.append(data)
+            return
+        with self._lock:
+            self._write_locked(data)
+            if self.durability == "always":
+                self._sync_locked()
+            elif self.durability == "group":
+                self._unsynced = True
+                wait = self._last_sync + self.group_window - time.monotonic()
+                if wait <= 0:
+                    self._sync_locked()
+                elif self._timer is None:
+                    self._timer = threading.Timer(wait, self._sync_from_timer)
+                    self._timer.daemon = True
+                    self._timer.start()
+
+    def replay(self):
+        """
+        Read the entries of the log, oldest first.
+        Returns a list of entries, empty if there is no log.
+        """
+        self.flush()
+        if not os.path.exists(self.path):
+            return []
+        entries = []
+        end = 0  # offset after the last complete entry
+        with open(self.path, "rb") as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                entries.append(json.loads(line))
+                end += len(line)
+        if end < self.size:
+            # Drop a torn final append, so later entries are not written after it.
+            with self._lock:
+                self._close_locked()
+                os.truncate(self.path, end)
+            self.size = end
+        return entries
+
+    def flush(self):
+        """
+        Write pending entries and fsync the log, whatever the policy.
+        """
+        with self._lock:
+            if self._pending:
+                self._write_locked(b"".join(self._pending))
+                self._pending = []
+                self._unsynced = True
+            if self._unsynced or (self.durability == "os" and self._file is not None):
+                self._sync_locked()
+
+    def truncate(self):
+        """
+        Empty the log, once its entries are part of the snapshot.
+        """
+        with self._lock:
+            self._pending = []
+            self._close_locked()
+            with open(self.path, "wb") as f:
+                f.flush()
+                os.fsync(f.fileno())
+            self.size = 0
+            self._unsynced = False
+
+    def close(self):
+        """
+        Cancel any scheduled fsync and close the file. Call flush() first to keep
+        pending entries.
+        """
+        with self._lock:
+            self._close_locked()
+
+    def _write_locked(self, data):
+        """
+        Write encoded entries at the end of the log. The caller must hold the lock.
+        data -- The encoded entries.
+        """
+        if self._file is None:
+            self._file = open(self.path, "ab")
+        self._file.write(data)
+        self._file.flush()
+
+    def _sync_locked(self):
+        """
+        fsync the log. The caller must hold the lock.
+        """
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self._file is not None:
+            os.fsync(self._file.fileno())
+        self._unsynced = False
+        self._last_sync = time.monotonic()
+
+    def _sync_from_timer(self):
+        """
+        fsync the log from the group timer, if writes are still unsynced.
+        """
+        with self._lock:
+            self._timer = None
+            if self._unsynced:
+                self._sync_locked()
+
+    def _close_locked(self):
+        """
+        Cancel the timer and close the file. The caller must hold the lock.
+        """
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
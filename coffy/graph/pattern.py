@@ -0,0 +1,507 @@
+# coffy/graph/pattern.py
+# author: nsarathy
+
+"""
+Compiled execution of GraphDB path patterns.
+A pattern is compiled once into steps with precompiled node conditions, then
+run as a depth-first search with an explicit stack:
+
+- the anchor is chosen by selectivity: when the last step's node conditions
+  select fewer nodes (through a property index) than the start conditions,
+  the pattern is matched backwards from those nodes;
+- the current path is tracked with a set, so cycle checks are O(1);
+- the filtered neighbors of a node at a step are computed once and shared by
+  every path, and every start node, reaching that node at that step;
+- a (step, node) pair that led to no match for a reason other than the
+  current path is remembered and never expanded again;
+- matches are yielded one at a time.
+
+A variable-length step ({"rel_type": ..., "min": 1, "max": 4}) matches every
+node whose shortest distance through relationships of the step's type, without
+crossing the current path, is between min and max hops. It is reached along one
+shortest path, found by a breadth-first search that visits each node once, so
+the search never enumerates every path between two nodes. When the step's node
+conditions select at most _BIDIRECTIONAL_TARGETS nodes through a property
+index, each of them is searched for with a bidirectional breadth-first search,
+which expands the smaller frontier of the two ends.
+"""
+
+import operator
+
+_OPS = {
+    "gt": operator.gt,
+    "lt": operator.lt,
+    "gte": operator.ge,
+    "lte": operator.le,
+    "ne": operator.ne,
+    "eq": operator.eq,
+}
+_FLIP = {"out": "in", "in": "out", "any": "any"}
+_START_OPTIONS = ("label", "fields", "limit", "offset")
+_BIDIRECTIONAL_TARGETS = 16  # most end nodes searched for one by one
+
+
+def compile_conditions(conditions):
+    """
+    Compile conditions into a predicate with the semantics of
+    GraphDB._match_conditions.
+    conditions -- Conditions to match against.
+    Returns a function taking an attribute dictionary, or None if there are no
+    conditions (everything matches).
+    """
+    if not conditions:
+        return None
+    logic = conditions.get("_logic", "and")
+    checks = []  # (key, comparison or None for an unknown operator, value)
+    for key, expected in conditions.items():
+        if key == "_logic":
+            continue
+        if isinstance(expected, dict):
+            for op, val in expected.items():
+                checks.append((key, _OPS.get(op), val))
+        else:
+            checks.append((key, operator.eq, expected))
+
+    def results(attrs):
+        for key, compare, val in checks:
+            yield compare is not None and compare(attrs.get(key), val)
+
+    if logic == "or":
+        return lambda attrs: any(results(attrs))
+    if logic == "not":
+        return lambda attrs: not all(results(attrs))
+    return lambda attrs: all(results(attrs))
+
+
+def _bounds(step):
+    """
+    Get the hop bounds of a pattern step.
+    step -- The step.
+    Returns (min, max) for a variable-length step, with max None for no limit,
+    or None for a single hop.
+    """
+    if "min" not in step and "max" not in step:
+        return None
+    lo = step.get("min", 1)
+    hi = step.get("max")
+    if not isinstance(lo, int) or lo < 0:
+        raise ValueError(f"Step 'min' must be a non-negative integer: {step!r}")
+    if hi is not None and (not isinstance(hi, int) or hi < lo):
+        raise ValueError(f"Step 'max' must be an integer >= 'min': {step!r}")
+    return lo, hi
+
+
+def _trace(parents, node_id):
+    """
+    Follow breadth-first search parents back to the search's origin.
+    parents -- Map of node id -> (previous node id, relationship), None at the origin.
+    node_id -- The node reached.
+    Returns (node ids after the origin, relationships), in search order.
+    """
+    nodes = []
+    edges = []
+    while parents[node_id] is not None:
+        prev, edge = parents[node_id]
+        nodes.append(node_id)
+        edges.append(edge)
+        node_id = prev
+    return tuple(reversed(nodes)), tuple(reversed(edges))
+
+
+class CompiledPattern:
+    """
+    A path pattern compiled against a graph.
+    """
+
+    def __init__(self, db, start, pattern, direction="out"):
+        """
+        Compile a pattern.
+        db -- The GraphDB to match in.
+        start -- Starting node conditions, as keyword arguments of find_nodes.
+        pattern -- List of steps, dictionaries with optional "rel_type", "node",
+            "min" and "max" keys.
+        direction -- Direction of the search ('in', 'out', or 'any').
+        """
+        if db.directed and direction not in _FLIP:
+            raise ValueError("Direction must be 'in', 'out', or 'any'")
+        self.db = db
+        self.start = start
+        self.direction = direction
+        self.rel_types = [step.get("rel_type") for step in pattern]
+        self.conditions = [step.get("node", {}) for step in pattern]
+        self.bounds = [_bounds(step) for step in pattern]
+        self.reverse = self._plan()
+
+    def _plan(self):
+        """
+        Decide whether to anchor the search at the end of the pattern.
+        Returns True to match backwards from the nodes selected by the last step.
+        """
+        if not self.conditions or any(
+            k in self.start for k in ("fields", "limit", "offset")
+        ):
+            return False  # the start set depends on find_nodes paging
+        if any(bounds is not None for bounds in self.bounds):
+            # A variable-length step avoids the nodes matched before it, so the
+            # order the steps are taken in decides which paths are found.
+            return False
+        im = self.db.index_manager
+        end = im.node_candidates(None, self.conditions[-1])
+        if end is None:
+            return False
+        label = self.start.get("label")
+        conditions = {k: v for k, v in self.start.items() if k != "label"}
+        start = im.node_candidates(label, conditions)
+        if start is not None:
+            start_size = len(start)
+        elif label is not None:
+            start_size = im.count_label(label)
+        else:
+            start_size = self.db.g.number_of_nodes()
+        return len(end) < start_size
+
+    def _step(self, rel_type, conditions, bounds, match=None):
+        """
+        Prepare a step for the search.
+        rel_type -- Type of the relationships followed, or None for any.
+        conditions -- Conditions on the node reached.
+        bounds -- (min, max) hops of a variable-length step, or None.
+        match -- The compiled conditions, if already compiled.
+        Returns (relationship type, node predicate or None, bounds, target node
+        ids for a bidirectional search or None).
+        """
+        if match is None:
+            match = compile_conditions(conditions)
+        targets = None
+        if bounds is not None and conditions:
+            ids = self.db.index_manager.node_candidates(None, conditions)
+            if ids is not None and len(ids) <= _BIDIRECTIONAL_TARGETS:
+                nodes = self.db.g.nodes
+                targets = [n for n in ids if match is None or match(nodes[n])]
+        return rel_type, match, bounds, targets
+
+    def run(self):
+        """
+        Match the pattern.
+        Yields (node ids, relationships) per match: the tuple of the ids of the
+        path's nodes, and the tuple of its relationships as (source, target)
+        pairs oriented as they are stored.
+        """
+        if not self.reverse:
+            steps = [
+                self._step(*spec)
+                for spec in zip(self.rel_types, self.conditions, self.bounds)
+            ]
+            anchors = [n["id"] for n in self.db.find_nodes(**self.start)]
+            yield from self._search(anchors, steps, self.direction)
+            return
+        # Backwards: start from the last step's nodes, follow the steps in
+        # reverse with the opposite direction, and check the start conditions on
+        # the last node reached.
+        nodes = self.db.g.nodes
+        end_match = compile_conditions(self.conditions[-1])
+        anchors = [
+            n
+            for n in self.db.index_manager.node_candidates(None, self.conditions[-1])
+            if end_match is None or end_match(nodes[n])
+        ]
+        label = self.start.get("label")
+        start_conditions = {
+            k: v for k, v in self.start.items() if k not in _START_OPTIONS
+        }
+        start_match = compile_conditions(start_conditions)
+
+        def is_start(attrs):
+            labels = attrs.get("_labels", [])
+            if label is not None and label not in labels:
+                return False
+            return start_match is None or start_match(attrs)
+
+        steps = [
+            self._step(rel_type, conditions, None)
+            for rel_type, conditions in zip(
+                self.rel_types[:0:-1], self.conditions[-2::-1]
+            )
+        ]
+        steps.append(self._step(self.rel_types[0], start_conditions, None, is_start))
+        directed = self.db.directed
+        matches = []
+        for path, edges in self._search(
+            anchors, steps, _FLIP[self.direction], backwards=True
+        ):
+            if directed:
+                matches.append((path[::-1], edges[::-1]))
+            else:  # keep undirected relationships in pattern order
+                matches.append((path[::-1], tuple((v, u) for u, v in reversed(edges))))
+        # An index only speeds the search up: results, and so their pages, come
+        # in the order a forward search finds them.
+        yield from sorted(matches, key=self._forward_key())
+
+    def _forward_key(self):
+        """
+        Get the sort key putting matches in the order of a forward search.
+        Returns a function of a match, as run() yields them.
+        """
+        label = self.start.get("label")
+        db = self.db
+        starts = db.g if label is None else db.index_manager.nodes_with_label(label)
+        start_pos = {n: i for i, n in enumerate(starts)}
+        hop_pos = {}  # (step, node) -> {neighbor: position among the hops}
+
+        def key(match):
+            path = match[0]
+            positions = [start_pos[path[0]]]
+            for i in range(len(path) - 1):
+                pos = hop_pos.get((i, path[i]))
+                if pos is None:
+                    pos = {}
+                    hops = self._hops(path[i], self.rel_types[i], self.direction, False)
+                    for j, (nb, _) in enumerate(hops):
+                        pos.setdefault(nb, j)
+                    hop_pos[(i, path[i])] = pos
+                positions.append(pos[path[i + 1]])
+            return positions
+
+        return key
+
+    def _hops(self, node_id, rel_type, direction, backwards):
+        """
+        Get the relationships one hop away from a node.
+        node_id -- The node.
+        rel_type -- Type of the relationships followed, or None for any.
+        direction -- Direction of the search.
+        backwards -- Whether the search runs against the pattern. When
+            relationships both ways fit an "any" step, the one pointing along
+            the pattern is reported.
+        Returns a list of (neighbor id, relationship) pairs.
+        """
+        db = self.db
+        g = db.g
+        hops = []
+        for nb in db._step_neighbors(node_id, rel_type, direction):
+            if not db.directed or direction == "out":
+                edge = (node_id, nb)
+            elif direction == "in":
+                edge = (nb, node_id)
+            else:  # "any": prefer the relationship along the pattern
+                edge = (nb, node_id) if backwards else (node_id, nb)
+                rel = g.get_edge_data(*edge)
+                if rel is None or (rel_type and rel.get("_type") != rel_type):
+                    edge = edge[::-1]
+            hops.append((nb, edge))
+        return hops
+
+    def _search(self, anchors, steps, direction, backwards=False):
+        """
+        Depth-first search of the simple paths following the steps.
+        anchors -- Ids of the nodes the paths start at.
+        steps -- List of steps prepared by _step.
+        direction -- Direction of the search.
+        backwards -- Whether the steps are those of a pattern in reverse.
+        Yields (node ids, relationships) as for run().
+        """
+        nodes = self.db.g.nodes
+        depth = len(steps)
+        expansions = {}  # (step, node) -> [(end, added nodes, added edges), ...]
+        dead = set()  # (step, node) pairs that cannot complete whatever the path
+
+        def expand(i, node_id, on_path):
+            """
+            Get the ways to take step i from a node.
+            Returns (iterable of (end node, nodes added, relationships added),
+            whether they depend on the current path).
+            """
+            rel_type, match, bounds, targets = steps[i]
+            if bounds is not None:
+                blocked = frozenset(on_path)
+                if targets is not None:
+                    found = self._toward(
+                        node_id, steps[i], direction, backwards, blocked
+                    )
+                else:
+                    found = self._reach(
+                        node_id, steps[i], direction, backwards, blocked
+                    )
+                return found, True
+            found = expansions.get((i, node_id))
+            if found is None:
+                found = [
+                    (nb, (nb,), (edge,))
+                    for nb, edge in self._hops(node_id, rel_type, direction, backwards)
+                    if match is None or match(nodes[nb])
+                ]
+                expansions[(i, node_id)] = found
+            return found, False
+
+        for anchor in anchors:
+            if depth == 0:
+                yield (anchor,), ()
+                continue
+            path = [anchor]
+            edges = []
+            on_path = {anchor}
+            # Frames: [step, iterator over expansions, found a match, depends on
+            # the current path, number of nodes added to reach the frame].
+            found, varies = expand(0, anchor, on_path)
+            stack = [[0, iter(found), False, varies, 0]]
+            while stack:
+                frame = stack[-1]
+                i = frame[0]
+                for end, added, added_edges in frame[1]:
+                    if added and added[-1] in on_path:
+                        frame[3] = True
+                        continue
+                    if i + 1 == depth:
+                        frame[2] = True
+                        yield (*path, *added), (*edges, *added_edges)
+                        continue
+                    if (i + 1, end) in dead:
+                        continue
+                    path.extend(added)
+                    edges.extend(added_edges)
+                    on_path.update(added)
+                    found, varies = expand(i + 1, end, on_path)
+                    stack.append([i + 1, iter(found), False, varies, len(added)])
+                    break
+                else:
+                    stack.pop()
+                    if not frame[2] and not frame[3]:
+                        dead.add((i, path[-1]))
+                    if stack:
+                        stack[-1][2] = stack[-1][2] or frame[2]
+                        stack[-1][3] = stack[-1][3] or frame[3]
+                        for _ in range(frame[4]):
+                            on_path.discard(path.pop())
+                            edges.pop()
+
+    def _reach(self, source, step, direction, backwards, blocked):
+        """
+        Bounded breadth-first search for the nodes a variable-length step reaches.
+        source -- The node the step starts from.
+        step -- The step, as prepared by _step.
+        direction -- Direction of the search.
+        backwards -- Whether the search runs against the pattern.
+        blocked -- Nodes of the current path, which are not crossed.
+        Yields (end node, nodes added, relationships added), nearest first.
+        """
+        rel_type, match, (lo, hi), _ = step
+        nodes = self.db.g.nodes
+        if lo == 0 and (match is None or match(nodes[source])):
+            yield source, (), ()
+        parents = {source: None}
+        frontier = [source]
+        hops = 0
+        while frontier and (hi is None or hops < hi):
+            hops += 1
+            next_frontier = []
+            for u in frontier:
+                for nb, edge in self._hops(u, rel_type, direction, backwards):
+                    if nb in parents or nb in blocked:
+                        continue
+                    parents[nb] = (u, edge)
+                    next_frontier.append(nb)
+                    if hops >= lo and (match is None or match(nodes[nb])):
+                        yield (nb, *_trace(parents, nb))
+            frontier = next_frontier
+
+    def _toward(self, source, step, direction, backwards, blocked):
+        """
+        Search for each target node of a variable-length step with a
+        bidirectional breadth-first search.
+        source -- The node the step starts from.
+        step -- The step, as prepared by _step.
+        direction -- Direction of the search.
+        backwards -- Whether the search runs against the pattern.
+        blocked -- Nodes of the current path, which are not crossed.
+        Yields (end node, nodes added, relationships added).
+        """
+        rel_type, _, (lo, hi), targets = step
+        for target in targets:
+            if target == source:
+                if lo == 0:
+                    yield source, (), ()
+                continue
+            if target in blocked:
+                continue
+            found = self._meet(
+                source, target, rel_type, direction, backwards, hi, blocked
+            )
+            if found is not None and len(found[1]) >= lo:
+                yield (target, *found)
+
+    def _meet(self, source, target, rel_type, direction, backwards, hi, blocked):
+        """
+        Find a shortest path between two nodes by growing breadth-first searches
+        from both ends, always extending the smaller frontier by one level.
+        source -- The start of the path.
+        target -- The end of the path.
+        rel_type -- Type of the relationships followed, or None for any.
+        direction -- Direction of the search from the source.
+        backwards -- Whether the search runs against the pattern.
+        hi -- Most hops allowed, or None for no limit.
+        blocked -- Nodes that are not crossed.
+        Returns (nodes after the source, relationships), or None if there is no
+        path of at most hi hops.
+        """
+        ahead = {source: None}  # parents of the search from the source
+        behind = {target: None}  # parents of the search from the target
+        ahead_frontier = [source]
+        behind_frontier = [target]
+        hops = 0
+        while ahead_frontier and behind_frontier and (hi is None or hops < hi):
+            hops += 1
+            if len(ahead_frontier) <= len(behind_frontier):
+                ahead_frontier, meet = self._grow(
+                    ahead_frontier,
+                    ahead,
+                    behind,
+                    rel_type,
+                    direction,
+                    backwards,
+                    blocked,
+                )
+            else:
+                behind_frontier, meet = self._grow(
+                    behind_frontier,
+                    behind,
+                    ahead,
+                    rel_type,
+                    _FLIP[direction],
+                    not backwards,
+                    blocked,
+                )
+            if meet is None:
+                continue
+            # Any meeting is a shortest path: before this level, no node was
+            # within reach of both searches.
+            nodes, edges = _trace(ahead, meet)
+            rest_nodes, rest_edges = _trace(behind, meet)
+            rest_nodes = (*reversed(rest_nodes[:-1]), target) if rest_nodes else ()
+            rest_edges = tuple(reversed(rest_edges))
+            if not self.db.directed:  # searched from the target: flip the pairs
+                rest_edges = tuple((v, u) for u, v in rest_edges)
+            return (*nodes, *rest_nodes), (*edges, *rest_edges)
+        return None
+
+    def _grow(self, frontier, seen, other, rel_type, direction, backwards, blocked):
+        """
+        Extend one side of a bidirectional search by one level.
+        frontier -- Nodes found at the previous level.
+        seen -- Parents of the nodes found by this side.
+        other -- Parents of the nodes found by the other side.
+        rel_type -- Type of the relationships followed, or None for any.
+        direction -- Direction of this side's search.
+        backwards -- Whether this side runs against the pattern.
+        blocked -- Nodes that are not crossed.
+        Returns (the next frontier, a node found by both sides or None).
+        """
+        next_frontier = []
+        for u in frontier:
+            for nb, edge in self._hops(u, rel_type, direction, backwards):
+                if nb in seen or (nb in blocked and nb not in other):
+                    continue
+                seen[nb] = (u, edge)
+                if nb in other:
+                    return next_frontier, nb
+                next_frontier.append(nb)
+        return next_frontier, None
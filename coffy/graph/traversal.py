@@ -0,0 +1,236 @@
+# coffy/graph/traversal.py
+# author: nsarathy
+
+"""
+Shortest paths and reachability over the relationships of a GraphDB.
+A traversal follows the relationships of some types in one direction. Typed
+traversals read the typed adjacency index, so they only touch relationships of
+those types.
+
+- unweighted shortest paths use a bidirectional breadth-first search, which
+  grows the smaller frontier of the two ends one level at a time and stops at
+  the first node both searches reach;
+- weighted shortest paths use a bidirectional Dijkstra search, which settles
+  nodes from both ends in turn and stops once a node is settled by both;
+- reachability is a breadth-first search bounded by a depth, producing nodes
+  nearest first, one at a time.
+"""
+
+import heapq
+
+_FLIP = {"out": "in", "in": "out", "any": "any"}
+
+
+class Traversal:
+    """
+    The relationships of a graph followed by a search.
+    """
+
+    def __init__(self, db, rel_types=None, direction="out"):
+        """
+        Prepare a traversal.
+        db -- The GraphDB to search.
+        rel_types -- Type, or list of types, of the relationships followed, or
+            None for every relationship.
+        direction -- Direction of the search ('in', 'out', or 'any'). Ignored for
+            undirected graphs.
+        """
+        if db.directed and direction not in _FLIP:
+            raise ValueError("Direction must be 'in', 'out', or 'any'")
+        if isinstance(rel_types, str):
+            rel_types = [rel_types]
+        self.db = db
+        self.rel_types = None if rel_types is None else list(dict.fromkeys(rel_types))
+        self.direction = direction if db.directed else "out"
+
+    def neighbors(self, node_id, direction=None):
+        """
+        Get the nodes one relationship away from a node.
+        node_id -- The node.
+        direction -- Direction to follow, the traversal's direction if None.
+        Returns a list of neighbor ids.
+        """
+        direction = direction or self.direction
+        if self.rel_types is None:
+            return list(self.db._get_neighbors(node_id, direction))
+        im = self.db.index_manager
+        if len(self.rel_types) == 1:
+            return list(im.neighbors(node_id, self.rel_types[0], direction))
+        found = {}
+        for rel_type in self.rel_types:
+            found.update(dict.fromkeys(im.neighbors(node_id, rel_type, direction)))
+        return list(found)
+
+    def levels(self, source, max_depth=None):
+        """
+        Breadth-first search from a node.
+        source -- The node to start from.
+        max_depth -- Most relationships followed, or None for no limit.
+        Yields (node id, depth) for every node reached, except the source,
+        nearest first.
+        """
+        seen = {source}
+        frontier = [source]
+        depth = 0
+        while frontier and (max_depth is None or depth < max_depth):
+            depth += 1
+            next_frontier = []
+            for u in frontier:
+                for nb in self.neighbors(u):
+                    if nb in seen:
+                        continue
+                    seen.add(nb)
+                    next_frontier.append(nb)
+                    yield nb, depth
+            frontier = next_frontier
+
+    def shortest_path(self, source, target, weight=None):
+        """
+        Find a shortest path between two nodes.
+        source -- The node to start from.
+        target -- The node to reach.
+        weight -- Relationship property holding the cost of following it, or None
+            to count relationships. A relationship without it costs 1.
+        Returns the list of node ids along the path, or None if there is none.
+        """
+        if source == target:
+            return [source]
+        if weight is None:
+            return self._meet(source, target)
+        return self._dijkstra(source, target, weight)
+
+    def _meet(self, source, target):
+        """
+        Bidirectional breadth-first search between two different nodes.
+        source -- The node to start from.
+        target -- The node to reach.
+        Returns the list of node ids along a shortest path, or None.
+        """
+        ahead = {source: None}  # parents of the search from the source
+        behind = {target: None}  # parents of the search from the target
+        ahead_frontier = [source]
+        behind_frontier = [target]
+        while ahead_frontier and behind_frontier:
+            if len(ahead_frontier) <= len(behind_frontier):
+                ahead_frontier, meet = self._grow(
+                    ahead_frontier, ahead, behind, self.direction
+                )
+            else:
+                behind_frontier, meet = self._grow(
+                    behind_frontier, behind, ahead, _FLIP[self.direction]
+                )
+            if meet is not None:
+                # Any meeting is a shortest path: before this level, no node was
+                # within reach of both searches.
+                return _trace(ahead, meet)[::-1] + _trace(behind, meet)[1:]
+        return None
+
+    def _grow(self, frontier, seen, other, direction):
+        """
+        Extend one side of a bidirectional search by one level.
+        frontier -- Nodes found at the previous level.
+        seen -- Parents of the nodes found by this side.
+        other -- Parents of the nodes found by the other side.
+        direction -- Direction of this side's search.
+        Returns (the next frontier, a node found by both sides or None).
+        """
+        next_frontier = []
+        for u in frontier:
+            for nb in self.neighbors(u, direction):
+                if nb in seen:
+                    continue
+                seen[nb] = u
+                if nb in other:
+                    return next_frontier, nb
+                next_frontier.append(nb)
+        return next_frontier, None
+
+    def _dijkstra(self, source, target, weight):
+        """
+        Bidirectional Dijkstra search between two different nodes. Both ends are
+        searched in turn, and the search stops once a node is settled by both.
+        source -- The node to start from.
+        target -- The node to reach.
+        weight -- Relationship property holding the cost of following it.
+        Returns the list of node ids along a cheapest path, or None.
+        """
+        directions = (self.direction, _FLIP[self.direction])
+        parents = ({source: None}, {target: None})
+        dist = ({source: 0}, {target: 0})  # best cost found so far, per side
+        done = (set(), set())
+        heaps = ([(0, 0, source)], [(0, 0, target)])
+        pushed = 1  # tie breaker, so node ids are never compared
+        best = None  # (cost, meeting node) of the cheapest path found
+        side = 1
+        while heaps[0] and heaps[1]:
+            side = 1 - side
+            d, _, u = heapq.heappop(heaps[side])
+            if u in done[side]:
+                continue
+            done[side].add(u)
+            if u in done[1 - side]:
+                break  # no path through unsettled nodes can be cheaper
+            for nb, rel in self._relationships(u, directions[side]):
+                if nb in done[side]:
+                    continue
+                cost = rel.get(weight, 1)
+                if not isinstance(cost, (int, float)) or cost < 0:
+                    raise ValueError(
+                        f"Relationship '{weight}' must be a non-negative number: "
+                        f"{u}-{nb}"
+                    )
+                nd = d + cost
+                if nb not in dist[side] or nd < dist[side][nb]:
+                    dist[side][nb] = nd
+                    parents[side][nb] = u
+                    heapq.heappush(heaps[side], (nd, pushed, nb))
+                    pushed += 1
+                    if nb in dist[1 - side]:
+                        total = nd + dist[1 - side][nb]
+                        if best is None or total < best[0]:
+                            best = (total, nb)
+        if best is None:
+            return None
+        meet = best[1]
+        return _trace(parents[0], meet)[::-1] + _trace(parents[1], meet)[1:]
+
+    def _relationships(self, node_id, direction):
+        """
+        Get the relationships followed from a node.
+        node_id -- The node.
+        direction -- Direction to follow.
+        Returns a list of (neighbor id, relationship attributes) pairs. In the
+        "any" direction, a neighbor linked both ways appears twice.
+        """
+        g = self.db.g
+        if not self.db.directed:
+            adjs = [g.adj[node_id]]
+        elif direction == "out":
+            adjs = [g.succ[node_id]]
+        elif direction == "in":
+            adjs = [g.pred[node_id]]
+        else:
+            adjs = [g.succ[node_id], g.pred[node_id]]
+        if self.rel_types is None:
+            return [item for adj in adjs for item in adj.items()]
+        types = self.rel_types
+        return [
+            (nb, rel)
+            for adj in adjs
+            for nb, rel in adj.items()
+            if rel.get("_type") in types
+        ]
+
+
+def _trace(parents, node_id):
+    """
+    Follow search parents back to the search's origin.
+    parents -- Map of node id -> previous node id, None at the origin.
+    node_id -- The node reached.
+    Returns the list of node ids from node_id back to the origin.
+    """
+    path = [node_id]
+    while parents[node_id] is not None:
+        node_id = parents[node_id]
+        path.append(node_id)
+    return path
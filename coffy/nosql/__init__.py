@@ -1,11 +1,46 @@
 # coffy/nosql/__init__.py
 # author: nsarathy
 
+from .async_engine import AsyncCollectionManager
 from .engine import CollectionManager
 
 
-def db(collection_name: str, path: str = None):
-    return CollectionManager(collection_name, path=path)
+def db(
+    collection_name: str,
+    path: str = None,
+    durability: str = "always",
+    group_window: float = 0.1,
+    max_docs: int = None,
+    max_bytes: int = None,
+):
+    return CollectionManager(
+        collection_name,
+        path=path,
+        durability=durability,
+        group_window=group_window,
+        max_docs=max_docs,
+        max_bytes=max_bytes,
+    )
 
 
-__all__ = ["db", "CollectionManager"]
+def adb(
+    collection_name: str,
+    path: str = None,
+    commit_window: float = 0.0,
+    durability: str = "always",
+    group_window: float = 0.1,
+    max_docs: int = None,
+    max_bytes: int = None,
+):
+    return AsyncCollectionManager(
+        collection_name,
+        path=path,
+        commit_window=commit_window,
+        durability=durability,
+        group_window=group_window,
+        max_docs=max_docs,
+        max_bytes=max_bytes,
+    )
+
+
+__all__ = ["db", "adb", "CollectionManager", "AsyncCollectionManager"]
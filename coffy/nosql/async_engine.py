@@ -0,0 +1,586 @@
+# coffy/nosql/async_engine.py
+# author: nsarathy
+
+"""
+An asyncio front-end for the NoSQL engine.
+Every operation on a collection runs on a single worker thread, so the event loop
+never blocks on serialization or fsync. Writers that finish close together are
+made durable by one shared save (group commit).
+"""
+
+from .engine import CollectionManager
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import functools
+
+# QueryBuilder methods that only build up the query and can be replayed later.
+_CHAIN_METHODS = {
+    "where",
+    "eq",
+    "ne",
+    "gt",
+    "gte",
+    "lt",
+    "lte",
+    "between",
+    "in_",
+    "nin",
+    "matches",
+    "exists",
+    "search",
+    "sort",
+    "limit",
+    "offset",
+    "parallel",
+    "lookup",
+    "merge",
+    "_and",
+    "_or",
+    "_not",
+}
+
+
+class AsyncQueryBuilder:
+    """
+    An awaitable counterpart of QueryBuilder.
+    Chained calls are recorded and replayed on the collection's worker thread when
+    a terminal method (run, count, update, ...) is awaited.
+    """
+
+    def __init__(self, manager, steps):
+        """
+        Initialize the AsyncQueryBuilder.
+        manager -- The AsyncCollectionManager the query belongs to.
+        steps -- List of (method, args, kwargs) calls to replay, in order.
+        """
+        self._manager = manager
+        self._steps = steps
+
+    def __getattr__(self, name):
+        """
+        Record a chainable QueryBuilder call.
+        name -- The name of the QueryBuilder method.
+        Returns a function that returns a new AsyncQueryBuilder with the call appended.
+        """
+        if name not in _CHAIN_METHODS:
+            raise AttributeError(
+                f"'AsyncQueryBuilder' object has no attribute '{name}'"
+            )
+
+        def step(*args, **kwargs):
+            return AsyncQueryBuilder(
+                self._manager, self._steps + [(name, args, kwargs)]
+            )
+
+        return step
+
+    def _build(self):
+        """
+        Replay the recorded calls against the underlying collection.
+        Must only be called on the worker thread.
+        Returns the resulting QueryBuilder.
+        """
+        q = self._manager._collection
+        for name, args, kwargs in self._steps:
+            q = getattr(q, name)(*args, **kwargs)
+        return q
+
+    def _read(self, method, *args):
+        """
+        Build the query on the worker thread and call a read-only method on it.
+        method -- Name of the QueryBuilder method to call.
+        Returns an awaitable with the method's result.
+        """
+        return self._manager._read(lambda: getattr(self._build(), method)(*args))
+
+    def _write(self, method, *args):
+        """
+        Build the query on the worker thread and call a mutating method on it.
+        method -- Name of the QueryBuilder method to call.
+        Returns an awaitable that resolves once the change is persisted.
+        """
+        return self._manager._write(lambda: getattr(self._build(), method)(*args))
+
+    async def run(self, fields=None):
+        """
+        Execute the query.
+        fields -- Optional list of fields to project in the results.
+        Returns a DocList containing the matching documents.
+        """
+        return await self._read("run", fields)
+
+    async def stream(self, fields=None):
+        """
+        Execute the query and iterate over its results with async for.
+        The results are collected on the worker thread first, as documents must
+        not be read while another operation may change them.
+        fields -- Optional list of fields to project in the results.
+        Yields matching documents, or their projections if fields is given.
+        """
+        docs = await self._manager._read(lambda: list(self._build().stream(fields)))
+        for doc in docs:
+            yield doc
+
+    async def count(self):
+        """
+        Count the number of documents that match the query.
+        """
+        return await self._read("count")
+
+    async def first(self):
+        """
+        Get the first document that matches the query, or None.
+        """
+        return await self._read("first")
+
+    async def distinct(self, field):
+        """
+        Get a sorted list of unique values for a field across matching documents.
+        field -- The field to get distinct values for.
+        """
+        return await self._read("distinct", field)
+
+    async def sum(self, field):
+        """
+        Calculate the sum of a numeric field across matching documents.
+        field -- The field to sum.
+        """
+        return await self._read("sum", field)
+
+    async def avg(self, field):
+        """
+        Calculate the average of a numeric field across matching documents.
+        field -- The field to average.
+        """
+        return await self._read("avg", field)
+
+    async def min(self, field):
+        """
+        Find the minimum of a numeric field across matching documents.
+        field -- The field to find the minimum of.
+        """
+        return await self._read("min", field)
+
+    async def max(self, field):
+        """
+        Find the maximum of a numeric field across matching documents.
+        field -- The field to find the maximum of.
+        """
+        return await self._read("max", field)
+
+    async def update(self, changes):
+        """
+        Update matching documents with the given changes.
+        changes -- A dictionary of fields to update.
+        Returns a dictionary with the count of updated documents.
+        """
+        return await self._write("update", changes)
+
+    async def delete(self):
+        """
+        Delete matching documents.
+        Returns a dictionary with the count of deleted documents.
+        """
+        return await self._write("delete")
+
+    async def replace(self, new_doc):
+        """
+        Replace matching documents with a new document.
+        new_doc -- The document to replace matches with.
+        Returns a dictionary with the count of replaced documents.
+        """
+        return await self._write("replace", new_doc)
+
+    async def remove_field(self, field):
+        """
+        Remove a field from matching documents.
+        field -- The field to remove, can be a dotted path like "a.b.c".
+        Returns a dictionary with the count of documents actually modified.
+        """
+        return await self._write("remove_field", field)
+
+
+class AsyncCollectionManager:
+    """
+    Manage a NoSQL collection from asyncio code.
+    Mutations return once their change is on disk. Concurrent mutations are
+    coalesced so that many awaiters are satisfied by a single atomic save.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        path: str = None,
+        commit_window: float = 0.0,
+        durability: str = "always",
+        group_window: float = 0.1,
+        max_docs: int = None,
+        max_bytes: int = None,
+    ):
+        """
+        Initialize an async collection manager.
+        name -- The name of the collection.
+        path -- Optional path to a JSON file where the collection data is stored.
+        commit_window -- Seconds to wait before saving, so that more writers can
+            join the same save. 0 saves as soon as the worker is free.
+        durability -- Durability policy of each save, see CollectionManager.
+        group_window -- Seconds between fsyncs under the "group" policy.
+        max_docs -- Optional maximum number of documents, see CollectionManager.
+        max_bytes -- Optional maximum total JSON size, see CollectionManager.
+        """
+        self._collection = CollectionManager(
+            name,
+            path=path,
+            durability=durability,
+            group_window=group_window,
+            max_docs=max_docs,
+            max_bytes=max_bytes,
+        )
+        self._collection._autosave = False
+        self._executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix=f"coffy-{name}"
+        )
+        self.commit_window = commit_window
+        self._seq = 0  # mutations applied, only touched on the worker thread
+        self._durable_seq = 0  # mutations known to be on disk
+        self._waiters = []  # (seq, future) pairs waiting for a save
+        self._flusher = None
+        self._closed = False
+
+    @property
+    def name(self):
+        """
+        The name of the collection.
+        """
+        return self._collection.name
+
+    @property
+    def path(self):
+        """
+        The path of the backing JSON file, or None when in memory.
+        """
+        return None if self._collection.in_memory else self._collection.path
+
+    def _submit(self, fn):
+        """
+        Run a function on the collection's worker thread.
+        fn -- A function taking no arguments.
+        Returns an awaitable with the function's result.
+        """
+        if self._closed:
+            raise RuntimeError("Collection has been closed.")
+        loop = asyncio.get_running_loop()
+        return loop.run_in_executor(self._executor, fn)
+
+    async def _read(self, fn):
+        """
+        Run a read-only function on the worker thread.
+        Reads of a collection with a TTL index can delete expired documents; such
+        deletions count as a mutation, saved by the next commit, flush() or close().
+        fn -- A function taking no arguments.
+        Returns the function's result.
+        """
+
+        def apply():
+            result = fn()
+            if self._collection._unsaved:
+                self._collection._unsaved = False
+                self._seq += 1
+            return result
+
+        return await self._submit(apply)
+
+    async def _write(self, fn):
+        """
+        Run a mutating function on the worker thread and wait until it is persisted.
+        fn -- A function taking no arguments.
+        Returns the function's result.
+        """
+
+        def apply():
+            result = fn()
+            self._collection._unsaved = False
+            self._seq += 1
+            return result, self._seq
+
+        result, seq = await self._submit(apply)
+        await self._commit(seq)
+        return result
+
+    def _save_snapshot(self):
+        """
+        Save the current documents under the collection's durability policy.
+        Runs on the worker thread.
+        Returns the sequence number covered by the save.
+        """
+        seq = self._seq
+        self._collection._writer.save(self._collection._snapshot())
+        return seq
+
+    async def _commit(self, seq):
+        """
+        Wait until the mutation with the given sequence number is on disk.
+        seq -- The sequence number returned by the worker for the mutation.
+        """
+        if self._collection.in_memory or seq <= self._durable_seq:
+            return
+        fut = asyncio.get_running_loop().create_future()
+        self._waiters.append((seq, fut))
+        if self._flusher is None:
+            self._flusher = asyncio.ensure_future(self._flush_waiters())
+        await fut
+
+    async def _flush_waiters(self):
+        """
+        Save once for every group of pending writers until none are left waiting.
+        """
+        try:
+            while self._waiters:
+                if self.commit_window:
+                    await asyncio.sleep(self.commit_window)
+                try:
+                    seq = await self._submit(self._save_snapshot)
+                except Exception as e:
+                    waiters, self._waiters = self._waiters, []
+                    for _, fut in waiters:
+                        if not fut.done():
+                            fut.set_exception(e)
+                    return
+                self._durable_seq = max(self._durable_seq, seq)
+                pending = []
+                for s, fut in self._waiters:
+                    if s <= seq:
+                        if not fut.done():
+                            fut.set_result(None)
+                    else:
+                        pending.append((s, fut))
+                self._waiters = pending
+        finally:
+            self._flusher = None
+
+    # Insertion
+
+    async def add(self, document: dict):
+        """
+        Add a document to the collection.
+        document -- The document to add, must be a dictionary.
+        Returns a dictionary with the count of inserted documents.
+        """
+        return await self._write(functools.partial(self._collection.add, document))
+
+    async def add_many(self, docs: list[dict]):
+        """
+        Add multiple documents to the collection.
+        docs -- A list of documents to add, each must be a dictionary.
+        Returns a dictionary with the count of inserted documents.
+        """
+        return await self._write(functools.partial(self._collection.add_many, docs))
+
+    # Query entrypoints
+
+    def where(self, field):
+        """
+        Start a query to filter documents based on a field.
+        field -- The field to filter on.
+        Returns an AsyncQueryBuilder.
+        """
+        return AsyncQueryBuilder(self, [("where", (field,), {})])
+
+    def match_any(self, *conditions):
+        """
+        Start a query to match any of the specified conditions.
+        conditions -- Functions that take a QueryBuilder instance and modify its filters.
+        Returns an AsyncQueryBuilder.
+        """
+        return AsyncQueryBuilder(self, [("match_any", conditions, {})])
+
+    def match_all(self, *conditions):
+        """
+        Start a query to match all of the specified conditions.
+        conditions -- Functions that take a QueryBuilder instance and modify its filters.
+        Returns an AsyncQueryBuilder.
+        """
+        return AsyncQueryBuilder(self, [("match_all", conditions, {})])
+
+    def not_any(self, *conditions):
+        """
+        Start a query to negate any of the specified conditions.
+        conditions -- Functions that take a QueryBuilder instance and modify its filters.
+        Returns an AsyncQueryBuilder.
+        """
+        return AsyncQueryBuilder(self, [("not_any", conditions, {})])
+
+    def search(self, text):
+        """
+        Start a query for documents matching a full-text query, ranked by BM25.
+        text -- The search query.
+        Returns an AsyncQueryBuilder.
+        """
+        return AsyncQueryBuilder(self, [("search", (text,), {})])
+
+    def lookup(self, *args, **kwargs):
+        """
+        Start a query that enriches documents with data from another collection.
+        Returns an AsyncQueryBuilder.
+        """
+        return AsyncQueryBuilder(self, [("lookup", args, kwargs)])
+
+    def merge(self, *args, **kwargs):
+        """
+        Start a query that merges computed fields into the documents.
+        Returns an AsyncQueryBuilder.
+        """
+        return AsyncQueryBuilder(self, [("merge", args, kwargs)])
+
+    def watch(self, filter=None, callback=None, resume_after=None, maxsize=1000):
+        """
+        Subscribe to the changes made to the collection, see CollectionManager.watch.
+        Read the stream with async for; events are delivered as soon as a change
+        is applied, before its group commit has reached the disk.
+        Returns a ChangeStream.
+        """
+        return self._collection.watch(filter, callback, resume_after, maxsize)
+
+    # Collection-level helpers
+
+    async def sum(self, field):
+        """
+        Calculate the sum of a numeric field across all documents.
+        field -- The field to sum.
+        """
+        return await self._read(functools.partial(self._collection.sum, field))
+
+    async def avg(self, field):
+        """
+        Calculate the average of a numeric field across all documents.
+        field -- The field to average.
+        """
+        return await self._read(functools.partial(self._collection.avg, field))
+
+    async def min(self, field):
+        """
+        Calculate the minimum of a numeric field across all documents.
+        field -- The field to find the minimum.
+        """
+        return await self._read(functools.partial(self._collection.min, field))
+
+    async def max(self, field):
+        """
+        Calculate the maximum of a numeric field across all documents.
+        field -- The field to find the maximum.
+        """
+        return await self._read(functools.partial(self._collection.max, field))
+
+    async def count(self):
+        """
+        Count the number of documents in the collection.
+        """
+        return await self._read(self._collection.count)
+
+    async def distinct(self, field):
+        """
+        Get a sorted list of unique values for a field across all documents.
+        field -- The field to get distinct values for.
+        """
+        return await self._read(functools.partial(self._collection.distinct, field))
+
+    async def first(self):
+        """
+        Get the first document in the collection, or None if it is empty.
+        """
+        return await self._read(self._collection.first)
+
+    async def all(self):
+        """
+        Get a copy of the list of all documents in the collection.
+        """
+        return await self._read(lambda: list(self._collection.all()))
+
+    async def clear(self):
+        """
+        Clear all documents from the collection.
+        Returns a dictionary with the count of cleared documents.
+        """
+        return await self._write(self._collection.clear)
+
+    async def remove_field(self, field):
+        """
+        Remove the specified field from all documents in the collection.
+        field -- The field to remove, can be a dotted path like "a.b.c".
+        Returns a dictionary with the count of documents actually modified.
+        """
+        return await self._write(
+            functools.partial(self._collection.remove_field, field)
+        )
+
+    async def create_ttl_index(self, field, expire_after=0, batch_size=1000):
+        """
+        Expire documents a number of seconds after the timestamp in a field.
+        Expired documents are deleted lazily when the collection is next read,
+        and those deletions are saved by the next commit, flush() or close().
+        field -- Top-level timestamp field, see CollectionManager.create_ttl_index.
+        expire_after -- Seconds after the timestamp at which a document expires.
+        batch_size -- Maximum number of documents deleted per access.
+        """
+        return await self._read(
+            functools.partial(
+                self._collection.create_ttl_index, field, expire_after, batch_size
+            )
+        )
+
+    async def expire(self):
+        """
+        Delete every expired document now, instead of on the next accesses.
+        Returns a dictionary with the count of expired documents.
+        """
+        return await self._write(self._collection.expire)
+
+    async def import_(self, path):
+        """
+        Import documents from a JSON file into the collection.
+        path -- The file path to import the collection from.
+        """
+        return await self._write(functools.partial(self._collection.import_, path))
+
+    async def export(self, path):
+        """
+        Export the collection to a JSON file.
+        path -- The file path to export the collection.
+        """
+        return await self._read(functools.partial(self._collection.export, path))
+
+    async def save(self, path: str):
+        """
+        Save the current state of the collection to a JSON file.
+        path -- The file path to save the collection.
+        """
+        return await self._read(functools.partial(self._collection.save, path))
+
+    # Lifecycle
+
+    async def flush(self):
+        """
+        Wait until every mutation issued so far is durable on disk,
+        whatever the durability policy.
+        """
+        seq = await self._read(lambda: self._seq)
+        await self._commit(seq)
+        await self._read(self._collection.flush)
+
+    async def close(self):
+        """
+        Flush pending writes and stop the worker thread.
+        The manager cannot be used after it is closed.
+        """
+        if self._closed:
+            return
+        await self.flush()
+        self._closed = True
+        self._collection._writer.close()
+        self._executor.shutdown(wait=False)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
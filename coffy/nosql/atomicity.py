@@ -1,37 +1,395 @@
+import gzip
+import io
 import json
 import os
+import struct
 import tempfile
+import threading
+import time
+import zlib
 
 """
 A module for atomic file saving operations.
 This module provides a function to save data to a file atomically,
 ensuring that the file is not left in a corrupted state in case of an error.
+
+It also provides _DurableWriter, which applies a durability policy to the
+automatic saves made after every mutation:
+
+    "always" -- write a temp file, fsync it, atomically replace the target, then
+                fsync the directory. A save that has returned survives a process
+                crash and a power loss.
+    "group"  -- atomically replace the target on every save, but fsync at most once
+                per group window. A process crash loses nothing; a power loss in
+                the last window can lose its saves or leave a truncated file.
+    "os"     -- atomically replace the target on every save and never fsync.
+                A process crash loses nothing; a power loss can lose whatever the
+                operating system had not yet written back, or leave a truncated file.
+    "never"  -- do not save automatically. Only explicit save() / flush() calls
+                write to disk; a crash loses every change since the last one.
+
+After a process crash, under every policy, the file on disk is either the
+previous or the new snapshot, never a partial write. After a power loss that
+holds for "always" only: "group" and "os" rename files whose data may not have
+reached the disk yet, and the file system can keep the rename without the data.
+
+The file format is selected by the path's extension:
+
+    ".json"     -- indented JSON text.
+    ".json.gz"  -- compact JSON, gzip-compressed.
+    ".json.zst" -- compact JSON, zstd-compressed (requires the zstandard package).
+    ".json.zf"  -- framed: lists are split into frames of 1000 items, each
+                   compressed on its own with zlib, followed by a compressed index
+                   of the frames. Loading decompresses one frame at a time, and
+                   _iter_json_items (used by the "read" command of the NoSQL CLI)
+                   only decompresses the frames holding the items it reads.
 """
 
+DURABILITY_LEVELS = ("always", "group", "os", "never")
+
+# Storage format of each supported extension.
+_FORMATS = {
+    ".json": "json",
+    ".json.gz": "gzip",
+    ".json.zst": "zstd",
+    ".json.zf": "framed",
+}
+_FRAME_MAGIC = b"COFFYZF1"
+_FRAME_ITEMS = 1000
+
+
+def _file_format(path: str):
+    """
+    Get the storage format selected by the extension of a path.
+    path -- The file path.
+    Returns "json", "gzip", "zstd" or "framed", or None for other extensions.
+    """
+    for suffix, fmt in _FORMATS.items():
+        if path.endswith(suffix):
+            return fmt
+    return None
+
+
+def _zstd():
+    """
+    Import the optional zstandard package.
+    """
+    try:
+        import zstandard
+    except ImportError:
+        raise ImportError(
+            "Install the zstandard package to use .json.zst files."
+        ) from None
+    return zstandard
+
+
+def _compact_json(data) -> bytes:
+    """
+    Encode data as compact UTF-8 JSON.
+    data -- The data to encode.
+    """
+    return json.dumps(data, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+
+def _encode_frames(data) -> bytes:
+    """
+    Encode data in the framed format. Top-level lists, and list values of a
+    top-level dictionary, are split into independently compressed frames.
+    data -- The data to encode, a list or a dictionary.
+    """
+    out = io.BytesIO()
+    out.write(_FRAME_MAGIC)
+    frames = []  # [offset, length, number of items]
+
+    def write_items(items):
+        ids = []
+        for start in range(0, len(items), _FRAME_ITEMS):
+            chunk = items[start : start + _FRAME_ITEMS]
+            blob = zlib.compress(_compact_json(chunk), 6)
+            ids.append(len(frames))
+            frames.append([out.tell(), len(blob), len(chunk)])
+            out.write(blob)
+        return ids
+
+    if isinstance(data, dict):
+        layout = {"dict": []}  # [key, frame ids] for lists, [key, None, value] else
+        for key, value in data.items():
+            if isinstance(value, list):
+                layout["dict"].append([key, write_items(value)])
+            else:
+                layout["dict"].append([key, None, value])
+    else:
+        layout = {"list": write_items(list(data))}
+
+    footer_offset = out.tell()
+    out.write(zlib.compress(_compact_json({"frames": frames, "layout": layout})))
+    out.write(struct.pack(">Q", footer_offset))
+    return out.getvalue()
+
+
+def _read_footer(f):
+    """
+    Read the frame index of an open framed file.
+    f -- The file, opened in binary mode.
+    Returns (frames, layout).
+    """
+    f.seek(0)
+    if f.read(len(_FRAME_MAGIC)) != _FRAME_MAGIC:
+        raise ValueError("Not a framed .json.zf file.")
+    end = f.seek(-8, os.SEEK_END)
+    footer_offset = struct.unpack(">Q", f.read(8))[0]
+    f.seek(footer_offset)
+    footer = json.loads(zlib.decompress(f.read(end - footer_offset)))
+    return footer["frames"], footer["layout"]
+
+
+def _read_frame(f, frame):
+    """
+    Decompress one frame of an open framed file.
+    f -- The file, opened in binary mode.
+    frame -- The [offset, length, number of items] entry of the frame.
+    Returns the list of items in the frame.
+    """
+    offset, length, _ = frame
+    f.seek(offset)
+    return json.loads(zlib.decompress(f.read(length)))
+
+
+def _load_json(path: str):
+    """
+    Load data saved by _atomic_save, in the format selected by the extension.
+    path -- The file path.
+    """
+    fmt = _file_format(path)
+    if fmt == "gzip":
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            return json.load(f)
+    if fmt == "zstd":
+        with open(path, "rb") as raw:
+            reader = _zstd().ZstdDecompressor().stream_reader(raw)
+            return json.load(io.TextIOWrapper(reader, encoding="utf-8"))
+    if fmt == "framed":
+        with open(path, "rb") as f:
+            frames, layout = _read_footer(f)
 
-def _atomic_save(data: dict, path: str):
+            def read_items(ids):
+                items = []
+                for i in ids:
+                    items.extend(_read_frame(f, frames[i]))
+                return items
+
+            if "list" in layout:
+                return read_items(layout["list"])
+            data = {}
+            for entry in layout["dict"]:
+                data[entry[0]] = entry[2] if entry[1] is None else read_items(entry[1])
+            return data
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _iter_json_items(path: str, key=None, start=0, stop=None):
+    """
+    Iterate over a range of items of a saved list without loading the rest.
+    Framed files only decompress the frames holding the requested items; other
+    formats are loaded whole.
+    path -- The file path.
+    key -- For a saved dictionary, the key of the list to read.
+    start -- Position of the first item.
+    stop -- Position after the last item, or None for the end of the list.
+    """
+    if _file_format(path) != "framed":
+        data = _load_json(path)
+        items = data if key is None else data.get(key, [])
+        yield from items[start:stop]
+        return
+    with open(path, "rb") as f:
+        frames, layout = _read_footer(f)
+        if key is None:
+            ids = layout.get("list", [])
+        else:
+            ids = next((e[1] or [] for e in layout.get("dict", []) if e[0] == key), [])
+        first = 0  # position of the first item of the current frame
+        for i in ids:
+            count = frames[i][2]
+            if stop is not None and first >= stop:
+                return
+            if first + count > start:
+                items = _read_frame(f, frames[i])
+                lo = max(start - first, 0)
+                hi = count if stop is None else min(stop - first, count)
+                yield from items[lo:hi]
+            first += count
+
+
+def _atomic_save(data: dict, path: str, fsync: bool = True):
     """
     Save data to a file atomically.
     data -- The data to save (must be a dictionary).
-    path -- The file path where the data should be saved.
+    path -- The file path where the data should be saved. Its extension selects
+        the format, see the module docstring.
+    fsync -- Whether to force the data to disk before replacing the target file,
+        and the replacement to disk after.
     """
     dir_name = os.path.dirname(path)
     base_name = os.path.basename(path)
+    fmt = _file_format(path)
+    if fmt == "gzip":
+        payload = gzip.compress(_compact_json(data), compresslevel=6, mtime=0)
+    elif fmt == "zstd":
+        payload = _zstd().ZstdCompressor(level=3).compress(_compact_json(data))
+    elif fmt == "framed":
+        payload = _encode_frames(data)
+    else:
+        payload = None  # plain JSON text
 
     try:
         # 1. Create a temp file in the same directory
         with tempfile.NamedTemporaryFile(
-            "w", delete=False, dir=dir_name, prefix=base_name + ".", suffix=".tmp"
+            "w" if payload is None else "wb",
+            delete=False,
+            dir=dir_name,
+            prefix=base_name + ".",
+            suffix=".tmp",
         ) as tf:
             temp_path = tf.name
-            json.dump(data, tf, indent=2)
-            tf.flush()
-            os.fsync(tf.fileno())  # ensure data is flushed to disk
+            if payload is None:
+                json.dump(data, tf, indent=2)
+            else:
+                tf.write(payload)
+            if fsync:
+                tf.flush()
+                os.fsync(tf.fileno())  # ensure data is flushed to disk
 
         # 2. Atomically replace the target file
         os.replace(temp_path, path)  # atomic on POSIX and modern Windows
+        if fsync:
+            _fsync_dir(path)  # ensure the rename itself reaches the disk
     except Exception as e:
         # 3. Clean up temp file if something goes wrong
         if os.path.exists(temp_path):
             os.remove(temp_path)
         raise e  # re-raise the exception for the caller to handle
+
+
+def _fsync_path(path: str):
+    """
+    Force an already written file, and the directory entry pointing to it, to disk.
+    path -- The file path to sync.
+    """
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+    _fsync_dir(path)
+
+
+def _fsync_dir(path: str):
+    """
+    Force the directory entry pointing to a file to disk.
+    path -- The file path whose directory is synced.
+    """
+    try:
+        dir_fd = os.open(os.path.dirname(path) or ".", os.O_RDONLY)
+    except OSError:
+        return  # directories cannot be opened on Windows
+    try:
+        os.fsync(dir_fd)
+    except OSError:
+        pass
+    finally:
+        os.close(dir_fd)
+
+
+class _DurableWriter:
+    """
+    Save snapshots of a collection or graph to one path under a durability policy.
+    """
+
+    def __init__(self, path: str, durability: str = "always", group_window=0.1):
+        """
+        Initialize the writer.
+        path -- The file path snapshots are saved to.
+        durability -- One of "always", "group", "os" or "never".
+        group_window -- Seconds between fsyncs under the "group" policy.
+        """
+        if durability not in DURABILITY_LEVELS:
+            raise ValueError(
+                f"durability must be one of {', '.join(DURABILITY_LEVELS)}"
+            )
+        self.path = path
+        self.durability = durability
+        self.group_window = group_window
+        self.dirty = False  # changes not yet written, only under "never"
+        self._unsynced = False  # written but not yet fsynced
+        self._last_sync = 0.0
+        self._timer = None
+        self._lock = threading.Lock()
+
+    def save(self, data):
+        """
+        Save a snapshot according to the durability policy.
+        data -- The data to save.
+        """
+        if self.durability == "never":
+            self.dirty = True
+            return
+        if self.durability == "always":
+            _atomic_save(data, self.path)
+            return
+        with self._lock:
+            _atomic_save(data, self.path, fsync=False)
+            if self.durability == "os":
+                return
+            self._unsynced = True
+            wait = self._last_sync + self.group_window - time.monotonic()
+            if wait <= 0:
+                self._sync_locked()
+            elif self._timer is None:
+                self._timer = threading.Timer(wait, self._sync_from_timer)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def flush(self, data):
+        """
+        Make every change saved so far durable, whatever the policy.
+        data -- The current data, written if there are unsaved changes.
+        """
+        if self.dirty:
+            _atomic_save(data, self.path)
+            self.dirty = False
+            return
+        with self._lock:
+            if self._unsynced or self.durability == "os":
+                if os.path.exists(self.path):
+                    self._sync_locked()
+
+    def close(self):
+        """
+        Cancel any scheduled fsync. Call flush() first to keep pending changes.
+        """
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+
+    def _sync_locked(self):
+        """
+        fsync the target file. The caller must hold the lock.
+        """
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        _fsync_path(self.path)
+        self._unsynced = False
+        self._last_sync = time.monotonic()
+
+    def _sync_from_timer(self):
+        """
+        fsync the target file at the end of a group window.
+        """
+        with self._lock:
+            self._timer = None
+            if self._unsynced:
+                self._sync_locked()
@@ -0,0 +1,172 @@
+# coffy/nosql/capped.py
+# author: nsarathy
+
+"""
+Ring-buffer storage for capped NoSQL collections.
+Inserting into a full buffer overwrites the oldest slot, so inserts and
+evictions are O(1) and the oldest document is always at position 0.
+"""
+
+import json
+
+
+def _doc_size(doc):
+    """
+    Estimate the size of a document as saved, in bytes of its JSON encoding.
+    doc -- The document to measure.
+    """
+    return len(json.dumps(doc, ensure_ascii=False).encode("utf-8"))
+
+
+class CappedDocuments:
+    """
+    A sequence of documents holding at most max_docs documents and, if max_bytes
+    is set, at most max_bytes of JSON. Supports the list operations the engine
+    uses: len, iteration, indexing, item assignment, full-slice assignment,
+    append and extend.
+    """
+
+    def __init__(self, max_docs=None, max_bytes=None):
+        """
+        Initialize an empty buffer.
+        max_docs -- Maximum number of documents, or None for no count limit.
+        max_bytes -- Maximum total JSON size of the documents, or None for no limit.
+            Sizes are measured when documents are inserted or replaced.
+        """
+        if max_docs is None and max_bytes is None:
+            raise ValueError("A capped collection needs max_docs or max_bytes.")
+        if max_docs is not None and max_docs < 1:
+            raise ValueError("max_docs must be at least 1")
+        if max_bytes is not None and max_bytes < 1:
+            raise ValueError("max_bytes must be at least 1")
+        self.max_docs = max_docs
+        self.max_bytes = max_bytes
+        self._slots = [None] * min(max_docs or 16, 16)
+        self._sizes = [0] * len(self._slots) if max_bytes is not None else None
+        self._head = 0  # slot of the oldest document
+        self._len = 0
+        self.nbytes = 0
+
+    def __len__(self):
+        return self._len
+
+    def _slot(self, i):
+        """
+        Get the slot of the document at a position.
+        i -- The position, negative positions count from the newest document.
+        """
+        if i < 0:
+            i += self._len
+        if not 0 <= i < self._len:
+            raise IndexError("capped collection index out of range")
+        return (self._head + i) % len(self._slots)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(self._len))]
+        return self._slots[self._slot(i)]
+
+    def __setitem__(self, i, value):
+        if isinstance(i, slice):
+            if i != slice(None):
+                raise TypeError("capped collections only support [:] assignment")
+            known = {}
+            if self._sizes is not None:
+                known = {
+                    id(self[j]): self._sizes[self._slot(j)] for j in range(self._len)
+                }
+            self.clear()
+            for doc in value:
+                self.append(doc, known.get(id(doc)))
+            return
+        slot = self._slot(i)
+        self._slots[slot] = value
+        if self._sizes is not None:
+            size = _doc_size(value)
+            self.nbytes += size - self._sizes[slot]
+            self._sizes[slot] = size
+
+    def __iter__(self):
+        slots, cap, head = self._slots, len(self._slots), self._head
+        for i in range(self._len):
+            yield slots[(head + i) % cap]
+
+    def __repr__(self):
+        return f"CappedDocuments({list(self)!r})"
+
+    def _popleft(self):
+        """
+        Remove and return the oldest document.
+        """
+        slot = self._head
+        doc = self._slots[slot]
+        self._slots[slot] = None
+        if self._sizes is not None:
+            self.nbytes -= self._sizes[slot]
+            self._sizes[slot] = 0
+        self._head = (slot + 1) % len(self._slots)
+        self._len -= 1
+        return doc
+
+    def _grow(self):
+        """
+        Double the number of slots, up to max_docs. Slots are allocated as the
+        buffer fills, so a large max_docs costs nothing up front.
+        """
+        cap = len(self._slots) * 2
+        if self.max_docs is not None:
+            cap = min(cap, self.max_docs)
+        if self._sizes is not None:
+            sizes = [self._sizes[self._slot(i)] for i in range(self._len)]
+            self._sizes = sizes + [0] * (cap - len(sizes))
+        docs = list(self)
+        self._slots = docs + [None] * (cap - len(docs))
+        self._head = 0
+
+    def append(self, doc, size=None):
+        """
+        Insert a document as the newest, evicting the oldest ones if over a limit.
+        A document larger than max_bytes on its own is kept, alone.
+        doc -- The document to insert.
+        size -- Its JSON size if already known, only used with max_bytes.
+        Returns the list of evicted documents, oldest first.
+        """
+        evicted = []
+        if self._len == self.max_docs:
+            evicted.append(self._popleft())
+        elif self._len == len(self._slots):
+            self._grow()
+        slot = (self._head + self._len) % len(self._slots)
+        self._slots[slot] = doc
+        self._len += 1
+        if self._sizes is not None:
+            if size is None:
+                size = _doc_size(doc)
+            self._sizes[slot] = size
+            self.nbytes += size
+            while self.nbytes > self.max_bytes and self._len > 1:
+                evicted.append(self._popleft())
+        return evicted
+
+    def extend(self, docs):
+        """
+        Insert documents in order, see append.
+        docs -- The documents to insert.
+        Returns the list of evicted documents, oldest first. Documents of the
+            batch itself are included if later ones pushed them out.
+        """
+        evicted = []
+        for doc in docs:
+            evicted.extend(self.append(doc))
+        return evicted
+
+    def clear(self):
+        """
+        Remove every document, keeping the limits.
+        """
+        self._slots = [None] * min(self.max_docs or 16, 16)
+        if self._sizes is not None:
+            self._sizes = [0] * len(self._slots)
+        self._head = 0
+        self._len = 0
+        self.nbytes = 0
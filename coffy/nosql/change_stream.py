@@ -0,0 +1,243 @@
+# coffy/nosql/change_stream.py
+# author: nsarathy
+
+"""
+Change streams for NoSQL collections.
+Every mutation publishes insert, update, replace and delete events numbered by a
+monotonic sequence; watchers receive the ones matching their filter instead of
+rescanning the collection.
+"""
+
+from collections import deque
+import asyncio
+import copy
+import threading
+
+
+def _wake(future):
+    """
+    Resolve a pending async read, unless it was cancelled meanwhile.
+    future -- The asyncio future to resolve.
+    """
+    if not future.done():
+        future.set_result(None)
+
+
+class ChangeHub:
+    """
+    Publish the changes of one collection to its watchers.
+    Nothing is recorded until the first watch(), so unwatched collections pay
+    a single attribute check per mutation.
+    """
+
+    def __init__(self, history=1024):
+        """
+        Initialize the hub.
+        history -- Number of recent events kept for resuming streams.
+        """
+        self.seq = 0
+        self.history_size = history
+        self.history = None  # deque of recent events, started by the first watch()
+        self.streams = []
+        self._lock = threading.RLock()
+
+    @property
+    def active(self):
+        """
+        Whether changes are being recorded.
+        """
+        return self.history is not None
+
+    def publish(self, op, doc, fields=None):
+        """
+        Record a change and deliver it to every stream.
+        op -- "insert", "update", "replace" or "delete".
+        doc -- The document after the change, or the deleted document.
+        fields -- For updates, the changed fields.
+        """
+        if self.history is None:
+            return
+        with self._lock:
+            self.seq += 1
+            event = {"seq": self.seq, "op": op, "document": copy.deepcopy(doc)}
+            if fields is not None:
+                event["fields"] = sorted(fields)
+            self.history.append(event)
+            for stream in list(self.streams):
+                stream._offer(event)
+
+    def watch(self, predicate=None, callback=None, resume_after=None, maxsize=1000):
+        """
+        Open a stream of the changes made from now on.
+        predicate -- Optional function taking a document, True for events to deliver.
+        callback -- Optional function called with each event instead of buffering it.
+        resume_after -- Optional sequence number; events after it are replayed first.
+        maxsize -- Maximum number of undelivered events buffered by the stream.
+        Returns a ChangeStream.
+        """
+        if maxsize < 1:
+            raise ValueError("maxsize must be at least 1")
+        with self._lock:
+            if self.history is None:
+                self.history = deque(maxlen=self.history_size)
+            backlog = []
+            if resume_after is not None:
+                if resume_after > self.seq:
+                    raise ValueError(f"Unknown resume token: {resume_after}")
+                oldest = self.history[0]["seq"] if self.history else self.seq + 1
+                if resume_after < oldest - 1:
+                    raise ValueError(
+                        f"Resume token {resume_after} is too old, "
+                        "its events are no longer kept."
+                    )
+                backlog = [e for e in self.history if e["seq"] > resume_after]
+            stream = ChangeStream(self, predicate, callback, maxsize)
+            stream.resume_token = resume_after
+            self.streams.append(stream)
+            for event in backlog:
+                stream._offer(event)
+        return stream
+
+    def _detach(self, stream):
+        """
+        Stop delivering events to a stream.
+        stream -- The stream to detach.
+        """
+        with self._lock:
+            if stream in self.streams:
+                self.streams.remove(stream)
+
+
+class ChangeStream:
+    """
+    A bounded buffer of change events, readable as an iterator or async iterator.
+    Each event is a dictionary with "seq", "op" and "document" keys, plus "fields"
+    for updates. resume_token holds the seq of the last event read, to be passed
+    as resume_after to watch() after a restart or an overflow.
+    """
+
+    def __init__(self, hub, predicate=None, callback=None, maxsize=1000):
+        """
+        Initialize the stream. Use CollectionManager.watch() instead.
+        hub -- The ChangeHub the stream reads from.
+        predicate -- Optional function taking a document, True for events to deliver.
+        callback -- Optional function called with each event instead of buffering it.
+        maxsize -- Maximum number of undelivered events.
+        """
+        self._hub = hub
+        self._predicate = predicate
+        self._callback = callback
+        self._maxsize = maxsize
+        self._events = deque()
+        self._cond = threading.Condition()
+        self._waiters = []  # (loop, future) of pending async reads
+        self._overflowed = False
+        self.closed = False
+        self.resume_token = None
+
+    def _offer(self, event):
+        """
+        Deliver an event if it matches the filter. Called with the hub locked.
+        event -- The event to deliver.
+        """
+        if self.closed or self._overflowed:
+            return
+        if self._predicate is not None and not self._predicate(event["document"]):
+            return
+        if self._callback is not None:
+            self.resume_token = event["seq"]
+            self._callback(event)
+            return
+        with self._cond:
+            if len(self._events) >= self._maxsize:
+                # A slow reader must not grow memory without bound: drop the
+                # buffer and make the reader resume from its last token.
+                self._overflowed = True
+                self._events.clear()
+                self._hub.streams.remove(self)
+            else:
+                self._events.append(event)
+            self._notify_locked()
+
+    def _notify_locked(self):
+        """
+        Wake blocked and awaiting readers. The caller must hold the condition.
+        """
+        self._cond.notify_all()
+        waiters, self._waiters = self._waiters, []
+        for loop, future in waiters:
+            loop.call_soon_threadsafe(_wake, future)
+
+    def _take_locked(self):
+        """
+        Pop the next event. The caller must hold the condition.
+        Returns the event, or None if none is buffered.
+        """
+        if self._overflowed:
+            self.closed = True
+            raise RuntimeError(
+                "Change stream overflowed; reopen it with "
+                f"watch(resume_after={self.resume_token})."
+            )
+        if not self._events:
+            return None
+        event = self._events.popleft()
+        self.resume_token = event["seq"]
+        return event
+
+    def try_next(self):
+        """
+        Get the next event without waiting.
+        Returns the event, or None if none is buffered.
+        """
+        with self._cond:
+            return self._take_locked()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        """
+        Wait for the next event. Iteration ends when the stream is closed.
+        """
+        with self._cond:
+            while not self._events and not self._overflowed and not self.closed:
+                self._cond.wait()
+            event = self._take_locked()
+        if event is None:
+            raise StopIteration
+        return event
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        """
+        Await the next event without blocking the event loop.
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            with self._cond:
+                event = self._take_locked()
+                if event is not None:
+                    return event
+                if self.closed:
+                    raise StopAsyncIteration
+                future = loop.create_future()
+                self._waiters.append((loop, future))
+            await future
+
+    def close(self):
+        """
+        Stop the stream. Buffered events can still be read.
+        """
+        self._hub._detach(self)
+        with self._cond:
+            self.closed = True
+            self._notify_locked()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
@@ -6,12 +6,15 @@ A simple NoSQL database engine.
 This engine supports basic CRUD operations, querying with filters, and aggregation functions.
 """
 
-from .atomicity import _atomic_save
+from .atomicity import _atomic_save, _DurableWriter, _file_format, _load_json
+from .capped import CappedDocuments
+from .change_stream import ChangeHub
 from .index_engine import IndexManager
+from .memory import _deep_size, InternTable
 from .nosql_view import _view_nosql_collection
 from .query_builder import QueryBuilder
-import json
 import os
+import time
 
 
 _collection_registry = {}
@@ -22,11 +25,28 @@ class CollectionManager:
     Manage a NoSQL collection, providing methods for querying and manipulating documents.
     """
 
-    def __init__(self, name: str, path: str = None):
+    def __init__(
+        self,
+        name: str,
+        path: str = None,
+        durability: str = "always",
+        group_window: float = 0.1,
+        max_docs: int = None,
+        max_bytes: int = None,
+    ):
         """
         Initialize a collection manager for a NoSQL collection.
         name -- The name of the collection.
         path -- Optional path to a JSON file where the collection data is stored.
+            Paths ending in .json.gz, .json.zst or .json.zf are stored compressed,
+            see coffy.nosql.atomicity.
+        durability -- When automatic saves reach the disk: "always", "group", "os"
+            or "never". See coffy.nosql.atomicity for the crash semantics of each.
+        group_window -- Seconds between fsyncs under the "group" policy.
+        max_docs -- Optional maximum number of documents. Inserting into a full
+            collection evicts the oldest documents (a capped collection).
+        max_bytes -- Optional maximum total size of the documents' JSON, measured
+            when they are inserted, enforced the same way.
         """
         self.name = name
         self.in_memory = False
@@ -35,18 +55,30 @@ class CollectionManager:
             if path == ":memory:":
                 self.in_memory = True
                 self.path = None
-            elif not path.endswith(".json"):
-                raise ValueError("Path must be to a .json file")
+            elif _file_format(path) is None:
+                raise ValueError(
+                    "Path must be to a .json, .json.gz, .json.zst or .json.zf file"
+                )
             self.path = path
         else:
             self.in_memory = True
 
+        self._capped = max_docs is not None or max_bytes is not None
+        if self._capped:
+            CappedDocuments(max_docs, max_bytes)  # validate the limits early
+        self._max_docs = max_docs
+        self._max_bytes = max_bytes
         self.documents = []
+        self._strings = InternTable()  # shares keys and repeated values
         self.index_manager = IndexManager()
-        self._load()
-
-        for doc in self.documents:
-            self.index_manager.index(doc)
+        self._changes = ChangeHub()
+        self._ttl_batch = None  # expired documents removed per access, if TTL is on
+        self._autosave = True
+        self._unsaved = False  # a change was not saved because autosave is off
+        self._writer = _DurableWriter(
+            None if self.in_memory else self.path, durability, group_window
+        )
+        self._load()  # also indexes the loaded documents
 
         _collection_registry[name] = self
 
@@ -57,25 +89,82 @@ class CollectionManager:
         If in_memory is True, initialize an empty collection.
         """
         if self.in_memory:
-            self.documents = []
+            self.documents = self._wrap([])
         else:
             try:
-                with open(self.path, "r", encoding="utf-8") as f:
-                    self.documents = json.load(f)
+                self.documents = self._wrap(self._intern(_load_json(self.path)))
                 self.index_manager.clear()
                 for doc in self.documents:
                     self.index_manager.index(doc)
             except FileNotFoundError:
                 os.makedirs(os.path.dirname(self.path), exist_ok=True)
-                self.documents = []
+                self.documents = self._wrap([])
+
+    def _wrap(self, docs):
+        """
+        Store a list of documents the way this collection keeps them.
+        docs -- The documents, oldest first.
+        Returns the list itself, or a ring buffer holding the newest documents
+            that fit if the collection is capped.
+        """
+        if not self._capped:
+            return docs
+        capped = CappedDocuments(self._max_docs, self._max_bytes)
+        capped.extend(docs)
+        return capped
+
+    def _intern(self, docs):
+        """
+        Make documents share the collection's copies of keys and repeated strings.
+        docs -- The documents, updated in place.
+        Returns docs.
+        """
+        for doc in docs:
+            self._strings.intern_value(doc)
+        return docs
+
+    def _snapshot(self):
+        """
+        Get the documents as a plain list, as saved to disk.
+        """
+        docs = self.documents
+        return docs if isinstance(docs, list) else list(docs)
 
     def _save(self):
         """
         Save the collection data to the JSON file.
-        If in_memory is True, this method does nothing.
+        If in_memory is True, this method does nothing. If autosave has been
+        turned off by a front-end that persists on its own schedule, it only
+        sets _unsaved, which the front-end clears once it has taken the change.
+        """
+        if self.in_memory:
+            return
+        if self._autosave:
+            self._writer.save(self._snapshot())
+        else:
+            self._unsaved = True  # for the front-end to save on its schedule
+
+    @property
+    def durability(self):
+        """
+        The durability policy used for automatic saves.
+        """
+        return self._writer.durability
+
+    def flush(self):
+        """
+        Make every change to the collection durable on disk, whatever the
+        durability policy. Does nothing for in-memory collections.
         """
         if not self.in_memory:
-            _atomic_save(self.documents, self.path)
+            self._writer.flush(self._snapshot())
+
+    def close(self):
+        """
+        Flush pending changes and stop any scheduled background fsync.
+        """
+        self.flush()
+        self._writer.close()
 
     def add(self, document: dict):
         """
@@ -83,9 +172,19 @@ class CollectionManager:
         document -- The document to add, must be a dictionary.
         Returns a dictionary with the count of inserted documents.
         """
-        self.documents.append(document)
+        self._strings.intern_value(document)
+        evicted = ()
+        if self._capped:
+            evicted = self.documents.append(document)
+        else:
+            self.documents.append(document)
+        for doc in evicted:
+            self.index_manager.remove(doc)
         self.index_manager.index(document)
         self._save()
+        self._changes.publish("insert", document)
+        for doc in evicted:
+            self._changes.publish("delete", doc)
         return {"inserted": 1}
 
     def add_many(self, docs: list[dict]):
@@ -94,18 +193,193 @@ class CollectionManager:
         docs -- A list of documents to add, each must be a dictionary.
         Returns a dictionary with the count of inserted documents.
         """
-        self.documents.extend(docs)
+        self._intern(docs)
+        evicted = ()
+        if self._capped:
+            evicted = self.documents.extend(docs)
+        else:
+            self.documents.extend(docs)
         for doc in docs:
             self.index_manager.index(doc)
+        for doc in evicted:
+            self.index_manager.remove(doc)
         self._save()
+        if self._changes.active:
+            for doc in docs:
+                self._changes.publish("insert", doc)
+            for doc in evicted:
+                self._changes.publish("delete", doc)
         return {"inserted": len(docs)}
 
+    def stats(self):
+        """
+        Estimate the memory used by the collection and its indexes.
+        Returns a dictionary with:
+            documents -- number of documents
+            document_bytes -- memory held by the documents
+            indexes -- field -> {"keys": distinct values, "bytes": memory}
+                for the automatic index, plus n-gram indexes as "field (ngram)"
+            text_index_bytes -- memory of the full-text index
+            index_bytes -- total memory of all indexes
+            duplicate_string_bytes -- memory of strings equal to another one,
+                reclaimable by compact()
+            fragmentation -- duplicate_string_bytes / document_bytes
+        """
+        self._expire()
+        document_bytes, duplicate = _deep_size(self.documents)
+        index_stats = self.index_manager.stats()
+        indexes = dict(index_stats["fields"])
+        for field, info in index_stats["ngram"].items():
+            indexes[f"{field} (ngram)"] = {
+                "keys": info["grams"],
+                "bytes": info["bytes"],
+            }
+        index_bytes = (
+            sum(info["bytes"] for info in indexes.values())
+            + index_stats["text"]
+            + index_stats["other"]
+        )
+        return {
+            "documents": len(self.documents),
+            "document_bytes": document_bytes,
+            "indexes": indexes,
+            "text_index_bytes": index_stats["text"],
+            "index_bytes": index_bytes,
+            "duplicate_string_bytes": duplicate,
+            "fragmentation": duplicate / document_bytes if document_bytes else 0.0,
+        }
+
+    def compact(self):
+        """
+        Reclaim memory: share one copy of every repeated string (keys and values)
+        across documents, and rebuild the indexes from scratch.
+        Documents are updated in place, so existing references stay valid.
+        Returns a dictionary with the count of strings replaced by a shared copy.
+        """
+        self._expire()
+        table = InternTable(max_values=None, max_length=None)
+        interned = 0
+        for doc in self.documents:
+            interned += table.intern_value(doc)[1]
+        self.index_manager.rebuild(self.documents)
+        return {"interned": interned}
+
+    def schema(self):
+        """
+        Get the schema inferred from the documents, kept up to date on every write.
+        Returns a dictionary of dotted path -> {type name: number of documents},
+            with type names "string", "int", "float", "bool", "null", "object"
+            and "array". Values inside arrays are not described.
+        """
+        return self.index_manager.schema.snapshot()
+
+    def create_ngram_index(self, field, n=3):
+        """
+        Index a top-level field by n-grams so that matches() with a literal
+        substring of at least n characters only scans candidate documents.
+        field -- The field to index.
+        n -- Length of the grams, 3 (trigrams) by default.
+        """
+        self.index_manager.create_ngram_index(field, n)
+
+    def create_ttl_index(self, field, expire_after=0, batch_size=1000):
+        """
+        Expire documents a number of seconds after the timestamp in a field.
+        Expired documents are deleted lazily when the collection is next accessed,
+        at most batch_size at a time, with one save per batch.
+        field -- Top-level timestamp field: seconds since the epoch (time.time())
+            or an ISO 8601 string. Documents without a valid timestamp never expire.
+        expire_after -- Seconds after the timestamp at which a document expires.
+            Use 0 when the field holds the expiry time itself.
+        batch_size -- Maximum number of documents deleted per access.
+        """
+        if batch_size < 1:
+            raise ValueError("batch_size must be at least 1")
+        self.index_manager.create_ttl_index(field, expire_after)
+        self._ttl_batch = batch_size
+
+    def _expire(self, limit=None):
+        """
+        Delete expired documents, if the collection has a TTL index.
+        limit -- Maximum number of documents to delete, the batch size by default.
+        Returns the number of deleted documents.
+        """
+        if self._ttl_batch is None:
+            return 0
+        expired = self.index_manager.expired(time.time(), limit or self._ttl_batch)
+        if not expired:
+            return 0
+        for doc in expired:
+            self.index_manager.remove(doc)
+        doomed = {id(doc) for doc in expired}
+        self.documents[:] = [doc for doc in self.documents if id(doc) not in doomed]
+        self._save()
+        for doc in expired:
+            self._changes.publish("delete", doc)
+        return len(expired)
+
+    def expire(self):
+        """
+        Delete every expired document now, instead of on the next accesses.
+        Returns a dictionary with the count of expired documents.
+        """
+        if self._ttl_batch is None:
+            return {"expired": 0}
+        return {"expired": self._expire(len(self.documents) or 1)}
+
+    def create_text_index(self, fields):
+        """
+        Build a full-text index over the given fields, kept up to date on every write.
+        Only one text index exists per collection; creating another replaces it.
+        fields -- List of fields to index, can be dotted paths like "a.b".
+        """
+        self.index_manager.create_text_index(fields)
+
+    def search(self, text):
+        """
+        Start a query for documents matching a full-text query, ranked by BM25.
+        text -- The search query.
+        Returns a QueryBuilder instance to build the query.
+        """
+        self._expire()
+        return QueryBuilder(
+            self.documents,
+            all_collections=_collection_registry,
+            collection_name=self.name,
+        ).search(text)
+
+    def watch(self, filter=None, callback=None, resume_after=None, maxsize=1000):
+        """
+        Subscribe to the changes made to the collection from now on.
+        filter -- Optional function that takes a QueryBuilder and adds conditions,
+            like the conditions of match_all. Only events whose document matches
+            are delivered; for deletes, the deleted document is tested.
+        callback -- Optional function called with each event as it happens,
+            instead of buffering events for iteration.
+        resume_after -- Optional resume token (the "seq" of the last event seen);
+            recent events after it are replayed first.
+        maxsize -- Maximum number of undelivered events. A stream whose reader
+            falls further behind is closed and must be resumed.
+        Returns a ChangeStream, iterable with for or async for.
+        """
+        predicate = None
+        if filter is not None:
+            q = QueryBuilder([])
+            filter(q)
+            filters = q.filters
+
+            def predicate(doc):
+                return all(f(doc) for f in filters)
+
+        return self._changes.watch(predicate, callback, resume_after, maxsize)
+
     def where(self, field):
         """
         Start a query to filter documents based on a field.
         field -- The field to filter on.
         Returns a QueryBuilder instance to build the query.
         """
+        self._expire()
         return QueryBuilder(
             self.documents,
             all_collections=_collection_registry,
@@ -118,6 +392,7 @@ class CollectionManager:
         conditions -- Functions that take a QueryBuilder instance and modify its filters.
         Returns a QueryBuilder instance with the combined conditions.
         """
+        self._expire()
         q = QueryBuilder(
             self.documents,
             all_collections=_collection_registry,
@@ -131,6 +406,7 @@ class CollectionManager:
         conditions -- Functions that take a QueryBuilder instance and modify its filters.
         Returns a QueryBuilder instance with the combined conditions.
         """
+        self._expire()
         q = QueryBuilder(
             self.documents,
             all_collections=_collection_registry,
@@ -144,6 +420,7 @@ class CollectionManager:
         conditions -- Functions that take a QueryBuilder instance and modify its filters.
         Returns a QueryBuilder instance with the negated conditions.
         """
+        self._expire()
         q = QueryBuilder(
             self.documents,
             all_collections=_collection_registry,
@@ -158,6 +435,7 @@ class CollectionManager:
         kwargs -- Keyword arguments for the lookup.
         Returns a QueryBuilder instance with the lookup applied.
         """
+        self._expire()
         return QueryBuilder(
             self.documents,
             all_collections=_collection_registry,
@@ -171,6 +449,7 @@ class CollectionManager:
         kwargs -- Keyword arguments for the merge.
         Returns a QueryBuilder instance with the merge applied.
         """
+        self._expire()
         return QueryBuilder(
             self.documents,
             all_collections=_collection_registry,
@@ -183,6 +462,7 @@ class CollectionManager:
         field -- The field to sum.
         Returns the sum of the field values.
         """
+        self._expire()
         return QueryBuilder(self.documents).sum(field)
 
     def avg(self, field):
@@ -191,6 +471,7 @@ class CollectionManager:
         field -- The field to average.
         Returns the average of the field values.
         """
+        self._expire()
         return QueryBuilder(self.documents).avg(field)
 
     def min(self, field):
@@ -199,6 +480,7 @@ class CollectionManager:
         field -- The field to find the minimum.
         Returns the minimum of the field values.
         """
+        self._expire()
         return QueryBuilder(self.documents).min(field)
 
     def max(self, field):
@@ -207,6 +489,7 @@ class CollectionManager:
         field -- The field to find the maximum.
         Returns the maximum of the field values.
         """
+        self._expire()
         return QueryBuilder(self.documents).max(field)
 
     def count(self):
@@ -214,6 +497,7 @@ class CollectionManager:
         Count the number of documents in the collection.
         Returns the count of documents.
         """
+        self._expire()
         return QueryBuilder(self.documents).count()
 
     def distinct(self, field):
@@ -222,6 +506,7 @@ class CollectionManager:
         field -- The field to get distinct values for, can be a dotted path like "a.b.c".
         Returns a sorted list of unique values.
         """
+        self._expire()
         return QueryBuilder(self.documents).distinct(field)
 
     def first(self):
@@ -229,6 +514,7 @@ class CollectionManager:
         Get the first document in the collection.
         Returns the first document or None if the collection is empty.
         """
+        self._expire()
         return QueryBuilder(self.documents).first()
 
     def clear(self):
@@ -236,20 +522,27 @@ class CollectionManager:
         Clear all documents from the collection.
         Returns a dictionary with the count of cleared documents.
         """
-        count = len(self.documents)
-        self.documents = []
+        cleared = self.documents
+        self.documents = self._wrap([])
         self.index_manager.clear()
         self._save()
-        return {"cleared": count}
+        if self._changes.active:
+            for doc in cleared:
+                self._changes.publish("delete", doc)
+        return {"cleared": len(cleared)}
 
     def export(self, path):
         """
         Export the collection to a JSON file.
         path -- The file path to export the collection.
         """
-        if not path.endswith(".json"):
-            raise ValueError("Invalid file format. Please use a .json file.")
-        _atomic_save(self.documents, path)
+        self._expire()
+        if _file_format(path) is None:
+            raise ValueError(
+                "Invalid file format. Please use a .json, .json.gz, .json.zst "
+                "or .json.zf file."
+            )
+        _atomic_save(self._snapshot(), path)
 
     def import_(self, path):
         """
@@ -257,35 +550,50 @@ class CollectionManager:
         path -- The file path to import the collection from.
         If the file does not exist, it raises a FileNotFoundError.
         """
-        with open(path, "r", encoding="utf-8") as f:
-            self.documents = json.load(f)
+        previous = self.documents
+        self.documents = self._wrap(self._intern(_load_json(path)))
         self.index_manager.clear()
         for doc in self.documents:
             self.index_manager.index(doc)
         self._save()
+        if self._changes.active:
+            for doc in previous:
+                self._changes.publish("delete", doc)
+            for doc in self.documents:
+                self._changes.publish("insert", doc)
 
     def all(self):
         """
         Get all documents in the collection.
         Returns a list of all documents.
         """
+        self._expire()
+        if self._capped:
+            return list(self.documents)
         return self.documents
 
     def save(self, path: str):
         """
         Save the current state of the collection to a JSON file.
         path -- The file path to save the collection.
-        If the path does not end with .json, it raises a ValueError.
+        If the path does not end with a supported extension, it raises a ValueError.
         """
-        if not path.endswith(".json"):
-            raise ValueError("Invalid file format. Please use a .json file.")
-        _atomic_save(self.documents, path)
+        self._expire()
+        if _file_format(path) is None:
+            raise ValueError(
+                "Invalid file format. Please use a .json, .json.gz, .json.zst "
+                "or .json.zf file."
+            )
+        _atomic_save(self._snapshot(), path)
 
     def all_docs(self):
         """
         Get all documents in the collection.
         Returns a list of all documents.
         """
+        self._expire()
+        if self._capped:
+            return list(self.documents)
         return self.documents
 
     def remove_field(self, field):
@@ -294,6 +602,7 @@ class CollectionManager:
         field -- The field to remove, can be a dotted path like "a.b.c".
         Returns a dictionary with the count of documents actually modified.
         """
+        self._expire()
         return QueryBuilder(
             self.documents,
             all_collections=_collection_registry,
@@ -305,4 +614,5 @@ class CollectionManager:
         View the collection in a user-friendly HTML format.
         Opens the collection viewer in the default web browser.
         """
+        self._expire()
         _view_nosql_collection(self.documents, self.name)
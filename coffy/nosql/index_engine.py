@@ -1,7 +1,117 @@
 # coffy/nosql/index_engine.py
 # author: nsarathy
 
+from .memory import _postings_size
+from .schema import SchemaTracker
+from .text_index import TextIndex
+from bisect import bisect_left
 from collections import defaultdict
+from datetime import datetime
+import heapq
+import re
+import sys
+
+_SCALARS = (str, int, float, bool)
+_META = set(".^$*+?{}[]\\|()")
+_CLASS_ESCAPES = set("dDwWsSbBAZ0123456789")
+
+
+def _regex_prefix(pattern):
+    """
+    Get the literal prefix every match of an anchored pattern must start with.
+    pattern -- A compiled regular expression.
+    Returns the prefix, or None if the pattern is not anchored with "^".
+    """
+    src = pattern.pattern
+    if (
+        not isinstance(src, str)
+        or not src.startswith("^")
+        or pattern.flags & (re.IGNORECASE | re.MULTILINE | re.VERBOSE)
+        or "|" in src
+    ):
+        return None
+    prefix = []
+    i = 1
+    while i < len(src):
+        c = src[i]
+        if c == "\\":
+            if i + 1 >= len(src) or src[i + 1].isalnum():
+                break
+            c = src[i + 1]
+            i += 1
+        elif c in _META:
+            if c in "*?{" and prefix:
+                prefix.pop()  # the previous character is optional
+            break
+        prefix.append(c)
+        i += 1
+    return "".join(prefix) or None
+
+
+def _regex_literal(pattern):
+    """
+    Get the longest run of literal text every match of a pattern must contain.
+    pattern -- A compiled regular expression.
+    Returns the literal, or "" if none can be derived safely.
+    """
+    src = pattern.pattern
+    if (
+        not isinstance(src, str)
+        or pattern.flags & (re.IGNORECASE | re.VERBOSE)
+        or "|" in src
+        or "(" in src
+    ):
+        return ""
+    best, run = "", []
+    i = 0
+    while i < len(src):
+        c = src[i]
+        if c == "\\":
+            nxt = src[i + 1] if i + 1 < len(src) else ""
+            if not nxt or nxt in _CLASS_ESCAPES or nxt.isalpha():
+                best, run = max(best, "".join(run), key=len), []
+                i += 2
+                continue
+            run.append(nxt)
+            i += 2
+        elif c == "[":
+            best, run = max(best, "".join(run), key=len), []
+            end = src.find("]", i + 2)
+            if end == -1:
+                return ""
+            i = end + 1
+        elif c in "*?{":
+            if run:
+                run.pop()  # the previous character is optional
+            best, run = max(best, "".join(run), key=len), []
+            if c == "{":
+                end = src.find("}", i)
+                i = end + 1 if end != -1 else len(src)
+            else:
+                i += 1
+        elif c in _META:
+            best, run = max(best, "".join(run), key=len), []
+            i += 1
+        else:
+            run.append(c)
+            i += 1
+    return max(best, "".join(run), key=len)
+
+
+def _timestamp(value):
+    """
+    Convert a timestamp field value to seconds since the epoch.
+    value -- A number of seconds since the epoch, or an ISO 8601 string.
+    Returns the seconds, or None if the value is not a timestamp.
+    """
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    if isinstance(value, str):
+        try:
+            return datetime.fromisoformat(value).timestamp()
+        except ValueError:
+            return None
+    return None
 
 
 class IndexManager:
@@ -15,40 +125,120 @@ class IndexManager:
         """
         self.indexes = defaultdict(lambda: defaultdict(set))
         self.doc_map = {}  # doc_id -> doc
+        self.unindexed = defaultdict(int)  # field -> docs holding a non-scalar value
+        self.ngram_indexes = {}  # field -> (n, gram -> set of doc_ids)
+        self._sorted_keys = {}  # field -> sorted string keys or None, built lazily
+        self.text_index = None
+        self.schema = SchemaTracker()
+        self.ttl_field = None
+        self.ttl_expire_after = 0
+        self._ttl_heap = []  # (expires_at, doc_id), may hold stale entries
+        self._ttl_at = {}  # doc_id -> current expires_at
 
-    def index(self, doc):
+    def index(self, doc, fields=None):
         """
         Index a document by adding it to the document map and updating the indexes.
         doc -- The document to index, should be a dictionary.
+        fields -- Optional set of top-level fields to index, all fields if None.
         """
         doc_id = id(doc)  # Use object ID as fallback if no 'id' field
         self.doc_map[doc_id] = doc
 
-        for field, value in doc.items():
-            if isinstance(value, (str, int, float, bool)):
-                self.indexes[field][value].add(doc_id)
+        if fields is None:
+            items = doc.items()
+        else:
+            items = [(f, doc[f]) for f in fields if f in doc]
+        for field, value in items:
+            self.schema.add(field, value)
+            if isinstance(value, _SCALARS):
+                postings = self.indexes[field]
+                if value not in postings:
+                    self._sorted_keys.pop(field, None)
+                postings[value].add(doc_id)
+            elif value is not None:
+                self.unindexed[field] += 1
+            if field in self.ngram_indexes and value is not None:
+                n, grams = self.ngram_indexes[field]
+                for gram in self._grams(str(value), n):
+                    grams[gram].add(doc_id)
+        if self._text_affected(fields):
+            self.text_index.add(doc_id, doc)
+        if self.ttl_field is not None and (fields is None or self.ttl_field in fields):
+            self._index_ttl(doc_id, doc)
 
-    def remove(self, doc):
+    def remove(self, doc, fields=None):
         """
         Remove a document from the index.
         doc -- The document to remove, should be a dictionary.
+        fields -- Optional set of top-level fields to unindex, keeping the document
+            in the document map. All fields, and the document itself, if None.
         """
         doc_id = id(doc)
-        for field, value in doc.items():
-            if field in self.indexes and value in self.indexes[field]:
-                self.indexes[field][value].discard(doc_id)
-                if not self.indexes[field][value]:
-                    del self.indexes[field][value]
-        self.doc_map.pop(doc_id, None)
+        if fields is None:
+            self._unindex_values(doc_id, doc)
+            self.doc_map.pop(doc_id, None)
+        else:
+            self._unindex_values(doc_id, {f: doc[f] for f in fields if f in doc})
+        if self._text_affected(fields):
+            self.text_index.remove(doc_id)
+        if fields is None or self.ttl_field in fields:
+            self._ttl_at.pop(doc_id, None)
 
-    def reindex(self, old_doc, new_doc):
+    def _unindex_values(self, doc_id, values):
+        """
+        Remove the entries of some field values of a document.
+        doc_id -- The id the document was indexed with.
+        values -- Dictionary of top-level field -> the value that was indexed.
+        """
+        for field, value in values.items():
+            self.schema.remove(field, value)
+            if isinstance(value, _SCALARS):
+                if field in self.indexes and value in self.indexes[field]:
+                    self.indexes[field][value].discard(doc_id)
+                    if not self.indexes[field][value]:
+                        del self.indexes[field][value]
+                        self._sorted_keys.pop(field, None)
+            elif value is not None and self.unindexed.get(field):
+                self.unindexed[field] -= 1
+            if field in self.ngram_indexes and value is not None:
+                n, grams = self.ngram_indexes[field]
+                for gram in self._grams(str(value), n):
+                    if gram in grams:
+                        grams[gram].discard(doc_id)
+                        if not grams[gram]:
+                            del grams[gram]
+
+    def _text_affected(self, fields):
+        """
+        Check whether changing some top-level fields changes the text index.
+        fields -- Set of top-level fields, or None for the whole document.
+        """
+        if self.text_index is None:
+            return False
+        if fields is None:
+            return True
+        return any(f.split(".", 1)[0] in fields for f in self.text_index.fields)
+
+    def reindex(self, old_doc, new_doc, changed=None):
         """
         Reindex a document by removing the old document and adding the new one.
         old_doc -- The document to remove from the index.
         new_doc -- The document to add to the index.
+        changed -- Optional set of changed paths (e.g. {"a", "b.c"}) of a document
+            updated in place. new_doc is then the updated document and old_doc holds
+            the previous values of those fields (other fields may be omitted), and
+            only index entries of the changed fields are touched.
         """
-        self.remove(old_doc)
-        self.index(new_doc)
+        if changed is None:
+            self.remove(old_doc)
+            self.index(new_doc)
+            return
+        fields = {path.split(".", 1)[0] for path in changed}
+        doc_id = id(new_doc)
+        self._unindex_values(doc_id, {f: old_doc[f] for f in fields if f in old_doc})
+        if self._text_affected(fields):
+            self.text_index.remove(doc_id)
+        self.index(new_doc, fields)
 
     def query(self, field, value):
         """
@@ -72,9 +262,213 @@ class IndexManager:
             out.update(self.indexes.get(field, {}).get(val, set()))
         return [self.doc_map[i] for i in out]
 
+    def query_regex(self, field, pattern):
+        """
+        Narrow down the documents whose field can match a regular expression.
+        Anchored patterns ("^abc") use a sorted view of the field's values, and
+        patterns containing literal text use the field's n-gram index if one exists.
+        field -- The top-level field to query.
+        pattern -- A compiled regular expression.
+        Returns a set of candidate document ids (a superset of the matches),
+            or None if the indexes cannot narrow the search.
+        """
+        if "." in field:
+            return None
+        ids = None
+
+        prefix = _regex_prefix(pattern)
+        if prefix is not None and not self.unindexed.get(field):
+            ids = self._prefix_ids(field, prefix)
+
+        if field in self.ngram_indexes:
+            n, grams = self.ngram_indexes[field]
+            literal = _regex_literal(pattern)
+            if len(literal) >= n:
+                for gram in self._grams(literal, n):
+                    found = grams.get(gram, set())
+                    ids = set(found) if ids is None else ids & found
+                    if not ids:
+                        break
+
+        return ids
+
+    def _prefix_ids(self, field, prefix):
+        """
+        Find the documents whose scalar value for a field starts with a prefix.
+        Only fields holding nothing but strings are narrowed: equal numbers and
+        booleans (2 and 2.0, 1 and True) share one index entry, which cannot tell
+        which spelling each document stores.
+        field -- The field to query.
+        prefix -- The string prefix.
+        Returns a set of doc_ids, or None if the field cannot be narrowed.
+        """
+        postings = self.indexes.get(field, {})
+        if field not in self._sorted_keys:
+            if all(isinstance(key, str) for key in postings):
+                self._sorted_keys[field] = sorted(postings)
+            else:
+                self._sorted_keys[field] = None
+        strings = self._sorted_keys[field]
+        if strings is None:
+            return None
+        ids = set()
+        i = bisect_left(strings, prefix)
+        while i < len(strings) and strings[i].startswith(prefix):
+            ids.update(postings.get(strings[i], ()))
+            i += 1
+        return ids
+
+    def create_ttl_index(self, field, expire_after=0):
+        """
+        Track when documents expire, ordered by expiry time.
+        field -- Top-level timestamp field: seconds since the epoch or an ISO 8601
+            string. Documents without a valid timestamp never expire.
+        expire_after -- Seconds after the timestamp at which a document expires.
+        """
+        self.ttl_field = field
+        self.ttl_expire_after = expire_after
+        self._ttl_heap = []
+        self._ttl_at = {}
+        for doc_id, doc in self.doc_map.items():
+            self._index_ttl(doc_id, doc)
+
+    def _index_ttl(self, doc_id, doc):
+        """
+        Record, update or drop the expiry time of a document.
+        doc_id -- The id the document is indexed with.
+        doc -- The document.
+        """
+        ts = _timestamp(doc.get(self.ttl_field))
+        if ts is None:
+            self._ttl_at.pop(doc_id, None)
+            return
+        expires_at = ts + self.ttl_expire_after
+        if self._ttl_at.get(doc_id) == expires_at:
+            return
+        self._ttl_at[doc_id] = expires_at
+        heapq.heappush(self._ttl_heap, (expires_at, doc_id))
+        if len(self._ttl_heap) > 2 * len(self._ttl_at) + 64:
+            # Too many entries are stale, rebuild from the current expiry times.
+            self._ttl_heap = [(at, i) for i, at in self._ttl_at.items()]
+            heapq.heapify(self._ttl_heap)
+
+    def expired(self, now, limit=None):
+        """
+        Pop the documents that have expired, soonest first.
+        now -- The current time in seconds since the epoch.
+        limit -- Optional maximum number of documents to return.
+        Returns a list of expired documents, still indexed.
+        """
+        heap = self._ttl_heap
+        out = []
+        while heap and heap[0][0] <= now and (limit is None or len(out) < limit):
+            expires_at, doc_id = heapq.heappop(heap)
+            if self._ttl_at.get(doc_id) == expires_at:
+                del self._ttl_at[doc_id]
+                out.append(self.doc_map[doc_id])
+        return out
+
+    def create_ngram_index(self, field, n=3):
+        """
+        Maintain an n-gram index on a top-level field for substring regex searches.
+        field -- The field to index. Values are indexed by their string form.
+        n -- Length of the grams. Patterns need a literal of at least n characters.
+        """
+        if n < 1:
+            raise ValueError("n must be at least 1")
+        grams = defaultdict(set)
+        self.ngram_indexes[field] = (n, grams)
+        for doc_id, doc in self.doc_map.items():
+            value = doc.get(field)
+            if value is not None:
+                for gram in self._grams(str(value), n):
+                    grams[gram].add(doc_id)
+
+    def create_text_index(self, fields):
+        """
+        Maintain a full-text index over the given fields, replacing any previous one.
+        fields -- List of fields to index, can be dotted paths like "a.b".
+        """
+        self.text_index = TextIndex(fields)
+        for doc_id, doc in self.doc_map.items():
+            self.text_index.add(doc_id, doc)
+
+    def search(self, text):
+        """
+        Rank documents against a full-text query.
+        text -- The search query.
+        Returns a dictionary of doc_id -> BM25 score for documents containing any term.
+        """
+        if self.text_index is None:
+            raise RuntimeError("No text index. Call create_text_index(fields) first.")
+        return self.text_index.search(text)
+
+    def stats(self):
+        """
+        Estimate the memory used by each index.
+        Returns a dictionary with "fields" (field -> {"keys", "bytes"}),
+            "ngram" (field -> {"grams", "bytes"}), "text" and "other" bytes.
+        """
+        fields = {
+            field: {"keys": len(postings), "bytes": _postings_size(postings)}
+            for field, postings in self.indexes.items()
+        }
+        ngram = {
+            field: {"grams": len(grams), "bytes": _postings_size(grams)}
+            for field, (n, grams) in self.ngram_indexes.items()
+        }
+        text = 0
+        if self.text_index is not None:
+            ti = self.text_index
+            text = (
+                _postings_size(ti.postings)
+                + sys.getsizeof(ti.doc_terms)
+                + sum(sys.getsizeof(t) for t in ti.doc_terms.values())
+                + sys.getsizeof(ti.doc_lengths)
+            )
+        other = (
+            sys.getsizeof(self.doc_map)
+            + sys.getsizeof(self._ttl_at)
+            + sys.getsizeof(self._ttl_heap)
+            + sum(sys.getsizeof(entry) for entry in self._ttl_heap)
+            + sum(sys.getsizeof(h) for h in self.schema.paths.values())
+        )
+        return {"fields": fields, "ngram": ngram, "text": text, "other": other}
+
+    def rebuild(self, docs):
+        """
+        Rebuild every index from scratch, keeping index definitions.
+        Fresh dictionaries and sets release the space left by removed entries.
+        docs -- The documents to index.
+        """
+        self.clear()
+        self.indexes = defaultdict(lambda: defaultdict(set))
+        self.doc_map = {}
+        for doc in docs:
+            self.index(doc)
+
+    @staticmethod
+    def _grams(text, n):
+        """
+        Get the distinct n-grams of a string.
+        text -- The string to split.
+        n -- Length of the grams.
+        """
+        return {text[i : i + n] for i in range(len(text) - n + 1)}
+
     def clear(self):
         """
         Clear all indexes and the document map.
+        N-gram, text and TTL index definitions are kept, emptied.
         """
         self.indexes.clear()
         self.doc_map.clear()
+        self.unindexed.clear()
+        self._sorted_keys.clear()
+        self.schema.clear()
+        self._ttl_heap = []
+        self._ttl_at.clear()
+        for n, grams in self.ngram_indexes.values():
+            grams.clear()
+        if self.text_index is not None:
+            self.text_index.clear()
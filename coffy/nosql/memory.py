@@ -0,0 +1,143 @@
+# coffy/nosql/memory.py
+# author: nsarathy
+
+"""
+Memory accounting and string interning for NoSQL collections.
+Sizes are estimates from sys.getsizeof, counting every object once.
+"""
+
+import sys
+
+
+def _deep_size(roots):
+    """
+    Estimate the memory held by some objects and everything they reference.
+    roots -- Iterable of objects to measure.
+    Returns (total bytes, bytes of strings equal to a string already counted).
+    """
+    seen = set()
+    first = {}  # string value -> id of the first object seen with it
+    total = duplicate = 0
+    stack = list(roots)
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        size = sys.getsizeof(obj)
+        total += size
+        if isinstance(obj, str):
+            if first.setdefault(obj, id(obj)) != id(obj):
+                duplicate += size
+        elif isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            stack.extend(obj)
+    return total, duplicate
+
+
+def _postings_size(postings):
+    """
+    Estimate the memory of an inverted index: key -> set or dict of doc ids.
+    Keys are counted too, as they are not shared with the documents.
+    postings -- The index dictionary.
+    """
+    return sys.getsizeof(postings) + sum(
+        sys.getsizeof(key) + sys.getsizeof(ids) for key, ids in postings.items()
+    )
+
+
+class InternTable:
+    """
+    Share one copy of keys and repeated string values across documents.
+    Values are tracked per field, and a field stops adding values once it has
+    max_values distinct ones, so unique values (ids, free text) do not grow the
+    table: it ends up holding keys and low-cardinality values such as
+    "status": "active". Keys are bounded the same way, and values are only
+    tracked under keys in the table, so map-like documents keyed by ids or
+    timestamps do not grow it either.
+    """
+
+    def __init__(self, max_values=1024, max_length=64):
+        """
+        Initialize an empty table.
+        max_values -- Distinct keys kept, and distinct values kept per field, or
+            None for no limit.
+        max_length -- Longest key or value kept, or None for no limit.
+        """
+        self.max_values = max_values
+        self.max_length = max_length
+        self.keys = {}  # key -> its shared copy
+        self.values = {}  # field -> {value: its shared copy}
+
+    def intern(self, s, field=None):
+        """
+        Get the shared copy of a string value, adding it if there is room.
+        s -- The string.
+        field -- The key the value is stored under.
+        """
+        table = self.values.get(field)
+        if table is None:
+            if field is not None and field not in self.keys:
+                return s  # the key itself did not fit in the table
+            table = self.values[field] = {}
+        return self._share(s, table)
+
+    def intern_key(self, k):
+        """
+        Get the shared copy of a key, adding it if there is room.
+        k -- The key.
+        """
+        return self._share(k, self.keys)
+
+    def _share(self, s, table):
+        """
+        Get the shared copy of a string from a table, adding it if there is room.
+        s -- The string.
+        table -- The table, a dictionary of string -> its shared copy.
+        """
+        shared = table.get(s)
+        if shared is not None:
+            return shared
+        if (self.max_length is None or len(s) <= self.max_length) and (
+            self.max_values is None or len(table) < self.max_values
+        ):
+            table[s] = s
+        return s
+
+    def intern_value(self, value, field=None):
+        """
+        Replace the strings inside a value, keys included, by their shared copy.
+        Dictionaries and lists are updated in place, so their identity is kept.
+        value -- The value to intern.
+        field -- The key the value is stored under.
+        Returns (the value to store, number of strings replaced by a shared copy).
+        """
+        if isinstance(value, str):
+            shared = self.intern(value, field)
+            return shared, int(shared is not value)
+        replaced = 0
+        if isinstance(value, dict):
+            items = []
+            rebuild = False
+            for k, v in value.items():
+                if isinstance(k, str):
+                    shared = self.intern_key(k)
+                    if shared is not k:
+                        k = shared
+                        rebuild = True
+                        replaced += 1
+                v2, r = self.intern_value(v, k)
+                if v2 is not v:
+                    value[k] = v2  # same key, so the dict is not resized
+                items.append((k, v2))
+                replaced += r
+            if rebuild:
+                value.clear()
+                value.update(items)
+        elif isinstance(value, list):
+            for i, v in enumerate(value):
+                value[i], r = self.intern_value(v, field)
+                replaced += r
+        return value, replaced
@@ -0,0 +1,78 @@
+# coffy/nosql/parallel.py
+# author: nsarathy
+
+"""
+Parallel full-scan filtering for QueryBuilder.
+Worker processes are forked so they inherit the documents and the compiled filters
+instead of receiving them pickled; only (start, end) ranges go out and matching
+positions come back.
+Forking copies only the calling thread, and any lock another thread holds at that
+moment stays held in the workers. Scans therefore stay single-process while other
+threads run, as under AsyncCollectionManager or the "group" durability policy.
+"""
+
+import multiprocessing
+import os
+import threading
+
+# Documents and filters of the scan, set in each worker process by _init_worker.
+_scan_state = None
+
+
+def _init_worker(documents, filters):
+    """
+    Keep the documents and filters of a scan in a worker process.
+    documents -- The documents to scan.
+    filters -- Functions that take a document and return True if it matches.
+    """
+    global _scan_state
+    _scan_state = (documents, filters)
+
+
+def _match_range(bounds):
+    """
+    Evaluate the inherited filters over one chunk of documents.
+    bounds -- A (start, end) tuple of document positions.
+    Returns the positions of the matching documents.
+    """
+    documents, filters = _scan_state
+    start, end = bounds
+    return [i for i in range(start, end) if all(f(documents[i]) for f in filters)]
+
+
+def _can_fork():
+    """
+    Check whether worker processes can be forked safely: the platform supports
+    fork, and no other thread is running.
+    """
+    return (
+        "fork" in multiprocessing.get_all_start_methods()
+        and threading.active_count() == 1
+    )
+
+
+def _parallel_scan(documents, filters, processes=None):
+    """
+    Filter documents across several processes, keeping their original order.
+    documents -- The documents to scan.
+    filters -- Functions that take a document and return True if it matches.
+    processes -- Number of worker processes. Defaults to the number of CPUs.
+    Returns a list of matching documents.
+        Falls back to a single-process scan where fork is unavailable, or while
+        other threads are running.
+    """
+    processes = processes or os.cpu_count() or 1
+    n = len(documents)
+    if processes < 2 or n < 2 or not _can_fork():
+        return [doc for doc in documents if all(f(doc) for f in filters)]
+
+    # A few chunks per worker keeps them busy when match costs are uneven.
+    chunk = max(1, -(-n // (processes * 4)))
+    bounds = [(start, min(start + chunk, n)) for start in range(0, n, chunk)]
+
+    # Forked workers inherit the initializer's arguments, so they are not pickled.
+    with multiprocessing.get_context("fork").Pool(
+        processes, initializer=_init_worker, initargs=(documents, filters)
+    ) as pool:
+        matched = pool.map(_match_range, bounds)
+    return [documents[i] for positions in matched for i in positions]
@@ -1,8 +1,53 @@
 # coffy/nosql/query_builder.py
 # author: nsarathy
 
+import itertools
+import operator
 import re
 from coffy.nosql.doclist import DocList
+from coffy.nosql.parallel import _parallel_scan
+
+_INDEXABLE = (str, int, float, bool)
+# Schema type names of the values that pass isinstance(value, (int, float)).
+_NUMERIC = frozenset(("int", "float", "bool"))
+
+
+def _same(a, b):
+    """
+    Check whether writing scalar b over a would leave the document unchanged.
+    Values of different types are never the same, even if equal (1 and True),
+    and containers are always rewritten.
+    """
+    return type(a) is type(b) and (a is None or isinstance(a, _INDEXABLE)) and a == b
+
+
+def _getter(dotted_key):
+    """
+    Compile a dotted path into a function reading it from a document.
+    Behaves like QueryBuilder._get_nested, with the path split only once.
+    """
+    if "." not in dotted_key:
+        return lambda doc: doc.get(dotted_key)
+    keys = dotted_key.split(".")
+
+    def get(doc):
+        for k in keys:
+            if not isinstance(doc, dict) or k not in doc:
+                return None
+            doc = doc[k]
+        return doc
+
+    return get
+
+
+def _has_path(doc, dotted_key):
+    """
+    Check whether a dotted path exists in a document, even if it holds None.
+    """
+    keys = dotted_key.split(".")
+    for k in keys[:-1]:
+        doc = doc.get(k) if isinstance(doc, dict) else None
+    return isinstance(doc, dict) and keys[-1] in doc
 
 
 class QueryBuilder:
@@ -27,6 +72,9 @@ class QueryBuilder:
         self._offset = None
         self._sort_key = None
         self._sort_reverse = False
+        self._parallel = None
+        self._scores = None
+        self._index_eqs = {}  # field -> value of equality filters answered by the index
 
         self.collection_name = collection_name
         self.index_manager = None
@@ -89,23 +137,77 @@ class QueryBuilder:
         value -- The value to compare against.
         Returns self to allow method chaining.
         """
-        if self.index_manager:
-            docs = self.index_manager.query(self.current_field, value)
-            if docs:
-                self.documents = docs
-        return self._add_filter(
-            lambda d: QueryBuilder._get_nested(d, self.current_field) == value
+        field = self.current_field
+        if self._indexable(field, value):
+            self.documents = self.index_manager.query(field, value)
+            self._index_eqs[field] = value
+        get = _getter(field)
+        return self._add_filter(lambda d: get(d) == value)
+
+    def _indexable(self, field, value):
+        """
+        Check whether the index answers equality on a field exactly.
+        The index holds every scalar value of every top-level field.
+        field -- The field being compared.
+        value -- The value it is compared against.
+        """
+        return (
+            self.index_manager is not None
+            and not getattr(self, "_negate", False)
+            and "." not in field
+            and isinstance(value, _INDEXABLE)
+        )
+
+    def _uniform(self, field, types):
+        """
+        Check whether every document holds a value of one of some types at a path,
+        according to the collection's inferred schema.
+        field -- The dotted path.
+        types -- Set of schema type names, e.g. {"int", "float"}.
+        """
+        if self.index_manager is None:
+            return False
+        hist = self.index_manager.schema.types(field)
+        return (
+            bool(hist)
+            and hist.keys() <= types
+            and sum(hist.values()) == len(self.index_manager.doc_map)
         )
 
+    def _compare(self, op, value):
+        """
+        Add a numeric comparison filter on the current field.
+        When the schema says the field is numeric in every document the type check
+        is skipped; a document written since then falls back to the checked path.
+        op -- The comparison, e.g. operator.gt.
+        value -- The value to compare against.
+        Returns self to allow method chaining.
+        """
+        get = _getter(self.current_field)
+
+        def checked(d):
+            v = get(d)
+            return isinstance(v, (int, float)) and op(v, value)
+
+        if not self._uniform(self.current_field, _NUMERIC):
+            return self._add_filter(checked)
+
+        def unchecked(d):
+            try:
+                return op(get(d), value)
+            except TypeError:
+                return checked(d)
+
+        return self._add_filter(unchecked)
+
     def ne(self, value):
         """
         Filter documents where the current field does not equal the given value.
         value -- The value to compare against.
         Returns self to allow method chaining.
         """
-        return self._add_filter(
-            lambda d: QueryBuilder._get_nested(d, self.current_field) != value
-        )
+        get = _getter(self.current_field)
+        return self._add_filter(lambda d: get(d) != value)
 
     def gt(self, value):
         """
@@ -113,12 +215,7 @@ class QueryBuilder:
         value -- The value to compare against.
         Returns self to allow method chaining.
         """
-        return self._add_filter(
-            lambda d: isinstance(
-                QueryBuilder._get_nested(d, self.current_field), (int, float)
-            )
-            and QueryBuilder._get_nested(d, self.current_field) > value
-        )
+        return self._compare(operator.gt, value)
 
     def gte(self, value):
         """
@@ -126,12 +223,7 @@ class QueryBuilder:
         value -- The value to compare against.
         Returns self to allow method chaining.
         """
-        return self._add_filter(
-            lambda d: isinstance(
-                QueryBuilder._get_nested(d, self.current_field), (int, float)
-            )
-            and QueryBuilder._get_nested(d, self.current_field) >= value
-        )
+        return self._compare(operator.ge, value)
 
     def lt(self, value):
         """
@@ -139,12 +231,7 @@ class QueryBuilder:
         value -- The value to compare against.
         Returns self to allow method chaining.
         """
-        return self._add_filter(
-            lambda d: isinstance(
-                QueryBuilder._get_nested(d, self.current_field), (int, float)
-            )
-            and QueryBuilder._get_nested(d, self.current_field) < value
-        )
+        return self._compare(operator.lt, value)
 
     def lte(self, value):
         """
@@ -152,12 +239,7 @@ class QueryBuilder:
         value -- The value to compare against.
         Returns self to allow method chaining.
         """
-        return self._add_filter(
-            lambda d: isinstance(
-                QueryBuilder._get_nested(d, self.current_field), (int, float)
-            )
-            and QueryBuilder._get_nested(d, self.current_field) <= value
-        )
+        return self._compare(operator.le, value)
 
     def between(self, a, b):
         """
@@ -175,13 +257,11 @@ class QueryBuilder:
         values -- The list of values to compare against.
         Returns self to allow method chaining.
         """
-        if self.index_manager:
-            docs = self.index_manager.query_in(self.current_field, values)
-            if docs:
-                self.documents = docs
-        return self._add_filter(
-            lambda d: QueryBuilder._get_nested(d, self.current_field) in values
-        )
+        field = self.current_field
+        if all(self._indexable(field, v) for v in values):
+            self.documents = self.index_manager.query_in(field, values)
+        get = _getter(field)
+        return self._add_filter(lambda d: get(d) in values)
 
     def nin(self, values):
         """
@@ -189,30 +269,62 @@ class QueryBuilder:
         values -- The list of values to compare against.
         Returns self to allow method chaining.
         """
-        return self._add_filter(
-            lambda d: QueryBuilder._get_nested(d, self.current_field) not in values
-        )
+        get = _getter(self.current_field)
+        return self._add_filter(lambda d: get(d) not in values)
 
     def matches(self, regex):
         """
         Filter documents where the current field matches the given regular expression.
-        regex -- The regular expression to match against.
+        regex -- The regular expression (string or compiled pattern) to match against.
+            Non-string values are matched by their string form; missing fields never match.
         Returns self to allow method chaining.
         """
-        return self._add_filter(
-            lambda d: re.search(
-                regex, str(QueryBuilder._get_nested(d, self.current_field))
-            )
-        )
+        pattern = re.compile(regex)
+        field = self.current_field
+        if self.index_manager:
+            ids = self.index_manager.query_regex(field, pattern)
+            if ids is not None:
+                # Keep collection order, so pages and first() match a full scan
+                self.documents = [d for d in self.documents if id(d) in ids]
+
+        get = _getter(field)
+
+        def match(d):
+            value = get(d)
+            if value is None:
+                return False
+            if not isinstance(value, str):
+                value = str(value)
+            return pattern.search(value) is not None
+
+        return self._add_filter(match)
+
+    def search(self, text):
+        """
+        Filter documents matching a full-text query on the collection's text index.
+        Unless sort() is used, results are ranked by BM25 relevance.
+        text -- The search query. Documents containing any of its terms match.
+        Returns self to allow method chaining.
+        """
+        if not self.index_manager:
+            raise RuntimeError("Cannot search without CollectionManager.")
+        scores = self.index_manager.search(text)
+        if self._scores is not None:
+            scores = {
+                i: s + self._scores[i] for i, s in scores.items() if i in self._scores
+            }
+        self._scores = scores
+        doc_map = self.index_manager.doc_map
+        self.documents = [doc_map[i] for i in scores]
+        return self._add_filter(lambda d: id(d) in scores)
 
     def exists(self):
         """
         Filter documents where the current field exists.
         Returns self to allow method chaining.
         """
-        return self._add_filter(
-            lambda d: QueryBuilder._get_nested(d, self.current_field) is not None
-        )
+        get = _getter(self.current_field)
+        return self._add_filter(lambda d: get(d) is not None)
 
     def sort(self, key: str, reverse: bool = False):
         """
@@ -227,6 +339,19 @@ class QueryBuilder:
         self._sort_reverse = reverse
         return self
 
+    def parallel(self, processes=None, threshold=50000):
+        """
+        Evaluate the filters of this query across several processes.
+        Useful for unindexed predicates like matches() over large collections.
+        The scan stays single-process while other threads are running, such as
+        the worker of an AsyncCollectionManager.
+        processes -- Number of worker processes. Defaults to the number of CPUs.
+        threshold -- Scans of fewer documents than this stay single-process.
+        Returns self to allow method chaining.
+        """
+        self._parallel = (processes, threshold)
+        return self
+
     # Logic grouping
     def _and(self, *fns):
         """
@@ -235,7 +360,9 @@ class QueryBuilder:
         Returns self to allow method chaining.
         """
         for fn in fns:
-            sub = QueryBuilder(self.documents, self.all_collections)
+            sub = QueryBuilder(
+                self.documents, self.all_collections, self.collection_name
+            )
             fn(sub)
             self.filters.append(lambda d, fs=sub.filters: all(f(d) for f in fs))
         return self
@@ -247,7 +374,9 @@ class QueryBuilder:
         Returns self to allow method chaining.
         """
         for fn in fns:
-            sub = QueryBuilder(self.documents, self.all_collections)
+            sub = QueryBuilder(
+                self.documents, self.all_collections, self.collection_name
+            )
             fn(sub)
             self.filters.append(lambda d, fs=sub.filters: not all(f(d) for f in fs))
         return self
@@ -260,7 +389,9 @@ class QueryBuilder:
         """
         chains = []
         for fn in fns:
-            sub = QueryBuilder(self.documents, self.all_collections)
+            sub = QueryBuilder(
+                self.documents, self.all_collections, self.collection_name
+            )
             fn(sub)
             chains.append(sub.filters)
         self.filters.append(lambda d: any(all(f(d) for f in chain) for chain in chains))
@@ -279,15 +410,52 @@ class QueryBuilder:
         return self
 
     # Core execution
-    def run(self, fields=None):
+    @staticmethod
+    def _compile_projection(fields):
         """
-        Execute the query and return the results.
-        fields -- Optional list of fields to project in the results.
-            If provided, only these fields will be included in the returned documents.
-            Otherwise, the full documents will be returned.
-        Returns a DocList containing the matching documents.
+        Parse projection fields once into (name, keys) pairs.
+        fields -- List of fields to project, can be dotted paths like "a.b.c".
+        """
+        return [(f, f.split(".")) for f in fields]
+
+    @staticmethod
+    def _project(doc, projection):
+        """
+        Project a document using a compiled projection.
+        doc -- The document to project.
+        projection -- The result of _compile_projection.
+        Returns a new dictionary with one entry per projected field.
+        """
+        out = {}
+        for name, keys in projection:
+            value = doc
+            for k in keys:
+                if not isinstance(value, dict) or k not in value:
+                    value = None
+                    break
+                value = value[k]
+            out[name] = value
+        return out
+
+    def _scan(self):
         """
-        results = [doc for doc in self.documents if all(f(doc) for f in self.filters)]
+        Find the documents that pass every filter, in collection order.
+        Returns an iterable of documents, lazy unless the scan runs in parallel.
+        """
+        if self._parallel and len(self.documents) >= self._parallel[1]:
+            return _parallel_scan(self.documents, self.filters, self._parallel[0])
+        return (doc for doc in self.documents if all(f(doc) for f in self.filters))
+
+    def _ordered_matches(self):
+        """
+        Find the matching documents after ranking, sorting, offset and limit.
+        Returns an iterator, which stays lazy when no ordering is requested.
+        """
+        results = self._scan()
+
+        if self._scores is not None and not self._sort_key:
+            scores = self._scores
+            results = sorted(results, key=lambda doc: scores[id(doc)], reverse=True)
 
         if self._sort_key:
 
@@ -302,28 +470,101 @@ class QueryBuilder:
                 else:
                     return (2, str(val))
 
-            results.sort(key=sort_key_func, reverse=self._sort_reverse)
+            results = sorted(results, key=sort_key_func, reverse=self._sort_reverse)
+
+        start = self._offset or 0
+        stop = None if self._limit is None else start + self._limit
+        return itertools.islice(results, start, stop)
+
+    def _covered_count(self):
+        """
+        Count the matching documents from the index alone, without touching them.
+        Possible when every filter is an equality the index answers exactly.
+        Returns the count after offset and limit, or None if the query is not covered.
+        """
+        if (
+            not self._index_eqs
+            or len(self._index_eqs) != len(self.filters)
+            or self._lookup_done
+            or self._scores is not None
+        ):
+            return None
+        ids = None
+        for field, value in self._index_eqs.items():
+            found = self.index_manager.indexes.get(field, {}).get(value, set())
+            ids = set(found) if ids is None else ids & found
+        n = max(0, len(ids) - (self._offset or 0))
+        return n if self._limit is None else min(n, self._limit)
+
+    def _covered_row(self, fields):
+        """
+        Build the projection shared by every result of a covered query.
+        fields -- The projected fields.
+        Returns the row, or None unless every field is fixed by an equality filter
+            on a string or None. Equal numbers and booleans (2 and 2.0, 1 and True)
+            share an index entry, so the stored value may not be the query's.
+        """
+        row = {}
+        for f in fields:
+            if f not in self._index_eqs:
+                return None
+            value = self._index_eqs[f]
+            if value is not None and not isinstance(value, str):
+                return None
+            row[f] = value
+        return row
+
+    # Core execution
+    def stream(self, fields=None):
+        """
+        Execute the query lazily, yielding one result at a time.
+        Documents are filtered and projected as they are consumed, so stopping
+        early skips the rest of the scan (unless sort() or search() ranks results).
+        Queries filtering only by indexed equalities on the projected fields are
+        answered from the index without reading the documents.
+        fields -- Optional list of fields to project in the results.
+        Yields matching documents, or their projections if fields is given.
+        """
+        if fields is not None and not self._lookup_done:
+            row = self._covered_row(fields)
+            n = self._covered_count() if row is not None else None
+            if n is not None:
+                for _ in range(n):
+                    yield dict(row)
+                return
 
-        if self._offset:
-            results = results[self._offset :]
-        if self._limit is not None:
-            results = results[: self._limit]
         if self._lookup_done:
-            results = self._lookup_results.copy()
+            results = iter(self._lookup_results.copy())
             self._lookup_done = False
             self._lookup_results = None
-
-        if fields is not None:
-            projected = []
+        else:
+            results = self._ordered_matches()
+        if fields is None:
+            yield from results
+        else:
+            projection = self._compile_projection(fields)
             for doc in results:
-                proj = {}
-                for f in fields:
-                    value = QueryBuilder._get_nested(doc, f)
-                    proj[f] = value
-                projected.append(proj)
-            return DocList(projected)
+                yield self._project(doc, projection)
+
+    def run(self, fields=None):
+        """
+        Execute the query and return the results.
+        fields -- Optional list of fields to project in the results.
+            If provided, only these fields will be included in the returned documents.
+            Otherwise, the full documents will be returned.
+        Returns a DocList containing the matching documents.
+        """
+        return DocList(list(self.stream(fields)))
 
-        return DocList(results)
+    def _matched_for_write(self):
+        """
+        Find the documents a mutation applies to.
+        Uses the same index-narrowed candidates as run(), ignoring sort, limit and offset.
+        Returns a list of the matching documents.
+        """
+        if not self.filters:
+            return list(self.documents)
+        return list(self._scan())
 
     def update(self, changes):
         """
@@ -334,16 +575,24 @@ class QueryBuilder:
         if not self.collection:
             raise RuntimeError("Cannot propagate update without CollectionManager.")
 
-        count = 0
-        for doc in self.collection.documents:
-            if all(f(doc) for f in self.filters):
-                self.index_manager.remove(doc)
-                doc.update(changes)
-                self.index_manager.index(doc)
-                count += 1
-
-        self.collection._save()
-        return {"updated": count}
+        matched = self._matched_for_write()
+        modified = []
+        for doc in matched:
+            changed = {
+                k for k, v in changes.items() if k not in doc or not _same(doc[k], v)
+            }
+            if not changed:
+                continue  # nothing to write or reindex
+            previous = {k: doc[k] for k in changed if k in doc}
+            doc.update(changes)
+            self.index_manager.reindex(previous, doc, changed)
+            modified.append((doc, changed))
+
+        if modified:
+            self.collection._save()
+            for doc, changed in modified:
+                self.collection._changes.publish("update", doc, changed)
+        return {"updated": len(matched)}
 
     def delete(self):
         """
@@ -353,22 +602,22 @@ class QueryBuilder:
         if not self.collection:
             raise RuntimeError("Cannot propagate delete without CollectionManager.")
 
-        before = len(self.collection.documents)
-        to_delete = [
-            doc
-            for doc in self.collection.documents
-            if all(f(doc) for f in self.filters)
-        ]
+        to_delete = self._matched_for_write()
+        if not to_delete:
+            return {"deleted": 0}
 
         for doc in to_delete:
             self.index_manager.remove(doc)
 
+        doomed = {id(doc) for doc in to_delete}
         self.collection.documents[:] = [
-            doc for doc in self.collection.documents if doc not in to_delete
+            doc for doc in self.collection.documents if id(doc) not in doomed
         ]
         self.collection._save()
+        for doc in to_delete:
+            self.collection._changes.publish("delete", doc)
 
-        return {"deleted": before - len(self.collection.documents)}
+        return {"deleted": len(doomed)}
 
     def replace(self, new_doc):
         """
@@ -379,15 +628,32 @@ class QueryBuilder:
         if not self.collection:
             raise RuntimeError("Cannot propagate replace without CollectionManager.")
 
-        replaced = 0
-        for i, doc in enumerate(self.collection.documents):
-            if all(f(doc) for f in self.filters):
-                self.index_manager.reindex(doc, new_doc)
-                self.collection.documents[i] = new_doc
-                replaced += 1
+        matched = self._matched_for_write()
+        if not matched:
+            return {"replaced": 0}
+
+        if self.collection._capped:
+            # Capped collections measure a document when it is stored in a slot
+            targets = {id(doc) for doc in matched}
+            documents = self.collection.documents
+            for i, doc in enumerate(documents):
+                if id(doc) in targets:
+                    self.index_manager.reindex(doc, new_doc)
+                    documents[i] = new_doc
+            replaced = [new_doc] * len(matched)
+        else:
+            # Rewrite each document in place, so its position need not be searched
+            for doc in matched:
+                self.index_manager.remove(doc)
+                doc.clear()
+                doc.update(new_doc)
+                self.index_manager.index(doc)
+            replaced = matched
 
         self.collection._save()
-        return {"replaced": replaced}
+        for doc in replaced:
+            self.collection._changes.publish("replace", doc)
+        return {"replaced": len(matched)}
 
     def remove_field(self, field):
         """
@@ -400,27 +666,35 @@ class QueryBuilder:
                 "Cannot propagate remove_field without CollectionManager."
             )
 
-        removed_count = 0
-        for doc in self.collection.documents:
-            if all(f(doc) for f in self.filters):
-                # Remove old index before modifying the document
-                self.index_manager.remove(doc)
+        removed = []
+        for doc in self._matched_for_write():
+            if not _has_path(doc, field):
+                continue
+            # Only the top-level field holding the path changes
+            root = field.split(".", 1)[0]
+            self.index_manager.remove(doc, {root})
 
-                # Remove the field and check if it was actually removed
-                if QueryBuilder._remove_nested(doc, field):
-                    removed_count += 1
+            # Remove the field and check if it was actually removed
+            if QueryBuilder._remove_nested(doc, field):
+                removed.append(doc)
 
-                # Re-index the modified document
-                self.index_manager.index(doc)
+            # Re-index the modified field
+            self.index_manager.index(doc, {root})
 
-        self.collection._save()
-        return {"removed": removed_count}
+        if removed:
+            self.collection._save()
+            for doc in removed:
+                self.collection._changes.publish("update", doc, {field})
+        return {"removed": len(removed)}
 
     def count(self):
         """
         Count the number of documents that match the current filters.
         Returns the count of matching documents.
         """
+        n = self._covered_count()
+        if n is not None:
+            return n
         return len(self.run())
 
     def first(self):
@@ -428,7 +702,7 @@ class QueryBuilder:
         Get the first document that matches the current filters.
         Returns the first matching document, or None if no documents match.
         """
-        return next(iter(self.run()), None)
+        return next(self.stream(), None)
 
     # Aggregates
     def sum(self, field):
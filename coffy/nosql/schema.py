@@ -0,0 +1,86 @@
+# coffy/nosql/schema.py
+# author: nsarathy
+
+"""
+Incremental schema inference for NoSQL collections.
+"""
+
+from collections import Counter, defaultdict
+
+_TYPE_NAMES = {
+    str: "string",
+    int: "int",
+    float: "float",
+    bool: "bool",
+    type(None): "null",
+    dict: "object",
+    list: "array",
+}
+
+
+class SchemaTracker:
+    """
+    Keep a histogram of value types for every path of a collection's documents.
+    Nested objects are described with dotted paths ("a.b"); arrays are not entered.
+    """
+
+    def __init__(self):
+        """
+        Initialize an empty schema.
+        """
+        self.paths = defaultdict(Counter)  # path -> type name -> number of documents
+
+    def add(self, field, value):
+        """
+        Count the value of a top-level field of a document.
+        field -- The top-level field.
+        value -- Its value.
+        """
+        self._walk(field, value, 1)
+
+    def remove(self, field, value):
+        """
+        Stop counting the value of a top-level field of a document.
+        field -- The top-level field.
+        value -- The value that was counted.
+        """
+        self._walk(field, value, -1)
+
+    def _walk(self, path, value, delta):
+        """
+        Adjust the histograms of a value and of everything nested in it.
+        path -- The path of the value.
+        value -- The value.
+        delta -- 1 to count the value, -1 to uncount it.
+        """
+        name = _TYPE_NAMES.get(type(value), "other")
+        hist = self.paths[path]
+        hist[name] += delta
+        if hist[name] <= 0:
+            del hist[name]
+            if not hist:
+                del self.paths[path]
+        if name == "object":
+            for k, v in value.items():
+                self._walk(f"{path}.{k}", v, delta)
+
+    def types(self, path):
+        """
+        Get the type histogram of a path.
+        path -- The dotted path.
+        Returns a Counter of type name -> number of documents, empty if unseen.
+        """
+        return self.paths.get(path, Counter())
+
+    def snapshot(self):
+        """
+        Get the whole schema.
+        Returns a dictionary of path -> {type name: number of documents}, by path.
+        """
+        return {path: dict(self.paths[path]) for path in sorted(self.paths)}
+
+    def clear(self):
+        """
+        Forget every path.
+        """
+        self.paths.clear()
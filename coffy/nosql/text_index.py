@@ -0,0 +1,117 @@
+# coffy/nosql/text_index.py
+# author: nsarathy
+
+"""
+A full-text inverted index with BM25 ranking for NoSQL collections.
+"""
+
+from collections import Counter, defaultdict
+import math
+import re
+
+_TOKEN_RE = re.compile(r"\w+")
+
+
+def _tokenize(text):
+    """
+    Split text into lowercase word tokens.
+    text -- The string to split.
+    Returns a list of tokens.
+    """
+    return _TOKEN_RE.findall(text.lower())
+
+
+class TextIndex:
+    """
+    Maintain a tokenized inverted index over one or more document fields.
+    """
+
+    def __init__(self, fields, k1=1.2, b=0.75):
+        """
+        Initialize an empty text index.
+        fields -- List of fields to index, can be dotted paths like "a.b".
+        k1 -- BM25 term frequency saturation.
+        b -- BM25 document length normalization.
+        """
+        self.fields = list(fields)
+        self.k1 = k1
+        self.b = b
+        self.postings = defaultdict(dict)  # term -> {doc_id: term frequency}
+        self.doc_terms = {}  # doc_id -> terms of the document
+        self.doc_lengths = {}  # doc_id -> number of tokens
+        self.total_length = 0
+
+    def _tokens(self, doc):
+        """
+        Get the tokens of the indexed fields of a document.
+        doc -- The document to tokenize.
+        """
+        tokens = []
+        for field in self.fields:
+            value = doc
+            for key in field.split("."):
+                value = value.get(key) if isinstance(value, dict) else None
+            if isinstance(value, list):
+                value = " ".join(str(v) for v in value if not isinstance(v, dict))
+            if value is not None and not isinstance(value, dict):
+                tokens.extend(_tokenize(str(value)))
+        return tokens
+
+    def add(self, doc_id, doc):
+        """
+        Add a document to the index.
+        doc_id -- The id the document is known by.
+        doc -- The document to add.
+        """
+        tokens = self._tokens(doc)
+        if not tokens:
+            return
+        counts = Counter(tokens)
+        for term, tf in counts.items():
+            self.postings[term][doc_id] = tf
+        self.doc_terms[doc_id] = tuple(counts)
+        self.doc_lengths[doc_id] = len(tokens)
+        self.total_length += len(tokens)
+
+    def remove(self, doc_id):
+        """
+        Remove a document from the index.
+        doc_id -- The id the document was added with.
+        """
+        for term in self.doc_terms.pop(doc_id, ()):
+            docs = self.postings.get(term)
+            if docs is not None:
+                docs.pop(doc_id, None)
+                if not docs:
+                    del self.postings[term]
+        self.total_length -= self.doc_lengths.pop(doc_id, 0)
+
+    def search(self, text):
+        """
+        Score the documents containing any of the terms in a query.
+        text -- The search query, tokenized like the indexed fields.
+        Returns a dictionary of doc_id -> BM25 score.
+        """
+        n = len(self.doc_lengths)
+        if not n:
+            return {}
+        avg_length = self.total_length / n
+        scores = defaultdict(float)
+        for term in set(_tokenize(text)):
+            docs = self.postings.get(term)
+            if not docs:
+                continue
+            idf = math.log(1 + (n - len(docs) + 0.5) / (len(docs) + 0.5))
+            for doc_id, tf in docs.items():
+                norm = 1 - self.b + self.b * self.doc_lengths[doc_id] / avg_length
+                scores[doc_id] += idf * tf * (self.k1 + 1) / (tf + self.k1 * norm)
+        return dict(scores)
+
+    def clear(self):
+        """
+        Remove every document from the index, keeping its configuration.
+        """
+        self.postings.clear()
+        self.doc_terms.clear()
+        self.doc_lengths.clear()
+        self.total_length = 0
@@ -1,7 +1,9 @@
 # coffy/graph/graph_tests.py
 # author: nsarathy
 
-from coffy.graph import GraphDB
+from coffy.graph import GraphDB, graphdb_nx
+from coffy.graph.pattern import CompiledPattern
+from unittest import mock
 import json
 import os
 import tempfile
@@ -307,6 +309,460 @@ class TestGraphDB(unittest.TestCase):
         self.assertEqual(self.db.count_nodes(), 0)
         self.assertEqual(self.db.count_relationships(), 0)
 
+    def test_durability_never_defers_writes(self):
+        path = self.temp_path.replace(".json", "_never.json")
+        db = GraphDB(path=path, durability="never")
+        db.add_node("X", name="Xavier")
+        with open(path) as f:
+            self.assertEqual(json.load(f)["nodes"], [])
+        db.flush()
+        with open(path) as f:
+            self.assertEqual(json.load(f)["nodes"][0]["id"], "X")
+        os.remove(path)
+
+    def test_compressed_graph_file(self):
+        path = self.temp_path.replace(".json", ".json.gz")
+        db = GraphDB(path=path)
+        db.add_node("A", labels="Person", name="Alice")
+        db.add_node("B", labels="Person", name="Bob")
+        db.add_relationship("A", "B", rel_type="KNOWS", since=2020)
+        reopened = GraphDB(path=path)
+        self.assertEqual(reopened.to_dict(), db.to_dict())
+        os.remove(path)
+
+    def test_label_index_follows_mutations(self):
+        db = self.db
+        db.add_node("R", labels=["Robot", "Person"], name="Robo")
+        self.assertEqual(db.count_nodes_by_label("Robot"), 1)
+        db.update_node("R", _labels=["Robot"])
+        self.assertEqual(db.count_nodes_by_label("Person"), 3)
+        db.set_node("A", _labels=["Person", "Admin"])
+        self.assertEqual([n["id"] for n in db.find_by_label("Admin")], ["A"])
+        db.remove_node("A")
+        self.assertEqual(db.count_nodes_by_label("Admin"), 0)
+        db.remove_nodes_by_label("Robot")
+        self.assertEqual(db.find_nodes(label="Robot").as_list(), [])
+        self.assertEqual(
+            [n["id"] for n in db.find_nodes(label="Person", age={"gt": 30})], ["C"]
+        )
+
+        reopened = GraphDB(path=self.temp_path)
+        self.assertEqual(
+            [n["id"] for n in reopened.find_by_label("Person")], ["B", "C"]
+        )
+        reopened.clear()
+        self.assertEqual(reopened.count_nodes_by_label("Person"), 0)
+
+    def test_relationship_type_index_follows_mutations(self):
+        db = self.db
+        db.add_relationship("A", "C", rel_type="LIKES")
+        self.assertEqual(db.count_relationships_by_type("LIKES"), 1)
+        db.add_relationship("C", "A", rel_type="KNOWS")  # same undirected edge
+        self.assertEqual(db.count_relationships_by_type("LIKES"), 0)
+        self.assertEqual(db.count_relationships_by_type("KNOWS"), 3)
+        db.update_relationship("A", "B", _type="WORKS_WITH")
+        self.assertEqual(
+            db.find_relationships(rel_type="WORKS_WITH", fields=["since"]).as_list(),
+            [{"since": 2010}],
+        )
+        db.remove_relationship("C", "B")
+        self.assertEqual(
+            [(r["source"], r["target"]) for r in db.find_by_relationship_type("KNOWS")],
+            [("C", "A")],
+        )
+        db.remove_node("A")
+        self.assertEqual(db.count_relationships_by_type("KNOWS"), 0)
+        self.assertEqual(db.count_relationships_by_type("WORKS_WITH"), 0)
+
+        reopened = GraphDB(path=self.temp_path)
+        self.assertEqual(reopened.count_relationships_by_type("KNOWS"), 0)
+        reopened.add_relationship("B", "C", rel_type="KNOWS")
+        reopened.remove_relationships_by_type("KNOWS")
+        self.assertFalse(reopened.has_relationship("B", "C"))
+
+    def test_typed_path_matching_uses_direction(self):
+        db = self.directed_db
+        db.add_node("D")
+        db.add_relationship("D", "B", _type="LIKES")
+        paths = db.match_node_path(
+            {}, [{"rel_type": "KNOWS"}], return_nodes=False, direction="in"
+        )
+        self.assertEqual(sorted(paths), [("B", "A"), ("C", "B")])
+        paths = db.match_node_path(
+            {}, [{"rel_type": "LIKES"}], return_nodes=False, direction="any"
+        )
+        self.assertEqual(sorted(paths), [("B", "D"), ("D", "B")])
+
+    def test_property_indexes(self):
+        db = self.db
+        db.add_node("D", labels="Robot", name="Dee", age=30)
+        db.create_node_index("Person", "name")
+        db.create_node_index("Person", "age", kind="sorted")
+        db.create_rel_index("KNOWS", "since", kind="sorted")
+
+        def ids(result):
+            return sorted(n["id"] for n in result)
+
+        self.assertEqual(ids(db.find_nodes(label="Person", name="Bob")), ["B"])
+        self.assertEqual(
+            ids(db.find_nodes(label="Person", age={"gte": 30})), ["A", "C"]
+        )
+        self.assertEqual(ids(db.find_nodes(age=30)), ["A", "D"])  # not indexed
+        db.update_node("B", age=50)
+        db.add_node("E", labels="Person", name="Eve", age=35)
+        self.assertEqual(
+            ids(db.find_nodes(label="Person", age={"gt": 30, "lt": 45})), ["C", "E"]
+        )
+        db.update_node("E", _labels=["Robot"])
+        db.remove_node("C")
+        self.assertEqual(ids(db.find_nodes(label="Person", age={"gt": 30})), ["B"])
+        self.assertEqual(
+            db.match_node_path({"label": "Person", "name": "Alice"}, [], False),
+            [("A",)],
+        )
+
+        db.add_relationship("A", "D", rel_type="KNOWS", since=2020)
+        rels = db.find_relationships(rel_type="KNOWS", since={"gt": 2009})
+        self.assertEqual(
+            sorted((r["source"], r["target"]) for r in rels), [("A", "B"), ("A", "D")]
+        )
+        db.update_relationship("B", "A", since=2001)
+        self.assertEqual(
+            len(db.find_relationships(rel_type="KNOWS", since={"gt": 2009})), 1
+        )
+        with self.assertRaises(ValueError):
+            db.create_node_index("Person", "age", kind="btree")
+
+    def test_property_index_keeps_scan_order(self):
+        db = GraphDB(path=None)
+        for i, age in enumerate([9, 1, 8, 5, 7, 2, 6]):
+            db.add_node(i, labels="P", age=age)
+        for i in range(6, 0, -1):
+            db.add_relationship(i, i - 1, rel_type="R", w=i % 3)
+
+        def nodes(**kwargs):
+            return [n["id"] for n in db.find_nodes(label="P", **kwargs)]
+
+        def rels(**kwargs):
+            found = db.find_relationships(rel_type="R", **kwargs)
+            return [(r["source"], r["target"]) for r in found]
+
+        queries = [{"age": {"gt": 4}}, {"age": {"lte": 8}, "limit": 2, "offset": 1}]
+        scanned = [nodes(**q) for q in queries]
+        rel_query = {"w": {"gte": 1}, "limit": 3}
+        rels_scanned = rels(**rel_query)
+        pattern = [{"rel_type": "R"}, {"rel_type": "R", "node": {"age": {"lt": 7}}}]
+        paths = db.match_node_path({"label": "P"}, pattern, False, direction="any")
+        db.create_node_index(None, "age", kind="sorted")
+        db.create_rel_index("R", "w", kind="sorted")
+        self.assertEqual([nodes(**q) for q in queries], scanned)
+        self.assertEqual(scanned[0], [0, 2, 3, 4, 6])
+        self.assertEqual(rels(**rel_query), rels_scanned)
+        self.assertEqual(
+            db.match_node_path({"label": "P"}, pattern, False, direction="any"), paths
+        )
+        self.assertEqual(
+            db.match_node_path(
+                {"label": "P"}, pattern, False, direction="any", limit=2, offset=3
+            ),
+            paths[3:5],
+        )
+
+    def test_batch_saves_once(self):
+        db = self.db
+        with mock.patch.object(db._writer, "save", wraps=db._writer.save) as save:
+            with db.batch():
+                db.add_node("D", labels="Person", name="Dan")
+                with db.batch():
+                    db.add_relationship("C", "D", rel_type="KNOWS")
+                db.update_node("D", age=20)
+                self.assertEqual(save.call_count, 0)
+            self.assertEqual(save.call_count, 1)
+            db.add_nodes([{"id": "E"}, {"id": "F"}, {"id": "G"}])
+            db.add_relationships([{"source": "E", "target": "F", "type": "KNOWS"}])
+            self.assertEqual(save.call_count, 3)
+            with self.assertRaises(KeyError):
+                with db.batch():
+                    db.add_node("H")
+                    db.add_node("H")
+            self.assertEqual(save.call_count, 4)
+        with open(self.temp_path) as f:
+            self.assertIn("H", [n["id"] for n in json.load(f)["nodes"]])
+
+    def test_load_does_not_write(self):
+        with mock.patch("coffy.graph.atomicity._atomic_save") as save:
+            reopened = GraphDB(path=self.temp_path)
+        save.assert_not_called()
+        self.assertEqual(reopened.to_dict(), self.db.to_dict())
+        self.assertEqual(reopened.count_nodes_by_label("Person"), 3)
+
+    def test_journal_appends_and_replays(self):
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, "g.json")
+            db = GraphDB(path=path, journal=True, compact_ratio=100)
+            snapshot = os.path.getsize(path)
+            with db.batch():
+                db.add_node("A", labels="Person", name="Alice")
+                db.add_node("B", labels="Person", name="Bob")
+                db.add_relationship("A", "B", rel_type="KNOWS", since=2010)
+            db.update_node("B", age=25)
+            db.update_relationship("A", "B", since=2011)
+            db.add_node("C", labels="Robot")
+            db.remove_node("C")
+            self.assertEqual(os.path.getsize(path), snapshot)  # only the log grew
+            with open(path + ".log", "ab") as f:
+                f.write(b'["del_node","A"')  # torn append
+            db.close()
+
+            reopened = GraphDB(path=path, journal=True, compact_ratio=100)
+            self.assertEqual(reopened.to_dict(), db.to_dict())
+            self.assertEqual(reopened.count_nodes_by_label("Person"), 2)
+            self.assertEqual(reopened.count_nodes_by_label("Robot"), 0)
+            reopened.remove_relationship("A", "B")
+            reopened.close()
+            self.assertEqual(
+                GraphDB(path=path, journal=True).count_relationships_by_type("KNOWS"),
+                0,
+            )
+
+    def test_journal_compacts(self):
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, "g.json")
+            db = GraphDB(path=path, journal=True, compact_ratio=2)
+            for i in range(50):
+                db.add_node(i, value=i)
+            self.assertLess(os.path.getsize(path + ".log"), 2 * os.path.getsize(path))
+            with open(path) as f:
+                self.assertGreater(len(json.load(f)["nodes"]), 0)
+            db.compact()
+            self.assertEqual(os.path.getsize(path + ".log"), 0)
+            self.assertEqual(GraphDB(path=path, journal=True).count_nodes(), 50)
+
+            never = GraphDB(path=path, journal=True, durability="never")
+            never.add_node("X")
+            self.assertEqual(os.path.getsize(path + ".log"), 0)
+            never.flush()
+            self.assertEqual(GraphDB(path=path).count_nodes(), 50)  # snapshot only
+            self.assertEqual(GraphDB(path=path, journal=True).count_nodes(), 51)
+
+    def test_pattern_anchored_at_indexed_end(self):
+        db = GraphDB(directed=True)
+        for i in range(20):
+            db.add_node(i, labels="Person", rank=i)
+        for i in range(19):
+            db.add_relationship(i, i + 1, rel_type="NEXT")
+        db.add_relationship(19, 0, rel_type="NEXT")  # a cycle
+        pattern = [{"rel_type": "NEXT"}, {"rel_type": "NEXT", "node": {"rank": 5}}]
+        forward = db.match_full_path({"label": "Person"}, pattern)
+        db.create_node_index(None, "rank")
+        with mock.patch.object(db, "find_nodes", side_effect=AssertionError):
+            backward = db.match_full_path({"label": "Person"}, pattern)
+        self.assertEqual(backward, forward)
+        self.assertEqual([n["id"] for n in backward[0]["nodes"]], [3, 4, 5])
+        self.assertEqual(
+            db.match_node_path({"rank": 18}, pattern * 2, return_nodes=False), []
+        )
+
+    def test_pattern_relationships_follow_direction(self):
+        db = self.directed_db
+        result = db.match_path_structured(
+            {}, [{"rel_type": "KNOWS", "node": {}}], direction="in"
+        )
+        rels = sorted(
+            (
+                p["path"][1]["relationship"]["source"],
+                p["path"][1]["relationship"]["target"],
+            )
+            for p in result
+        )
+        self.assertEqual(rels, [("A", "B"), ("B", "C")])
+
+    def test_variable_length_pattern(self):
+        for i in range(5):
+            self.directed_db.add_node(i, labels="Step", n=i)
+        for i in range(4):
+            self.directed_db.add_relationship(i, i + 1, _type="NEXT")
+        self.directed_db.add_relationship(0, 2, _type="OTHER")
+        paths = self.directed_db.match_node_path(
+            {"n": 0},
+            [{"rel_type": "NEXT", "min": 2, "max": 3}],
+            return_nodes=False,
+        )
+        self.assertEqual(paths, [(0, 1, 2), (0, 1, 2, 3)])
+        paths = self.directed_db.match_node_path(
+            {"n": 0}, [{"rel_type": "NEXT", "max": 9}], return_nodes=False
+        )
+        self.assertEqual([p[-1] for p in paths], [1, 2, 3, 4])
+        paths = self.directed_db.match_node_path(
+            {"n": 4},
+            [{"rel_type": "NEXT", "min": 0, "node": {"n": {"gte": 3}}}],
+            return_nodes=False,
+            direction="in",
+        )
+        self.assertEqual(paths, [(4,), (4, 3)])
+
+    def test_variable_length_pattern_with_indexed_end(self):
+        for i in range(30):
+            self.db.add_node(i, labels="Step", n=i)
+            if i:
+                self.db.add_relationship(i - 1, i, rel_type="NEXT")
+        self.db.create_node_index(None, "n")
+        with mock.patch.object(CompiledPattern, "_reach", side_effect=AssertionError):
+            result = self.db.match_full_path(
+                {"n": 3},
+                [{"rel_type": "NEXT", "min": 1, "max": 10, "node": {"n": 13}}],
+            )
+        self.assertEqual(len(result), 1)
+        self.assertEqual([n["n"] for n in result[0]["nodes"]], list(range(3, 14)))
+        rels = [(r["source"], r["target"]) for r in result[0]["relationships"]]
+        self.assertEqual(rels, [(i, i + 1) for i in range(3, 13)])
+        result = self.db.match_full_path(
+            {"n": 3},
+            [{"rel_type": "NEXT", "max": 5, "node": {"n": 20}}],
+        )
+        self.assertEqual(result, [])
+
+    def test_variable_length_pattern_bounds(self):
+        for step in ({"min": -1}, {"min": 3, "max": 2}, {"max": "2"}):
+            with self.assertRaises(ValueError):
+                self.db.match_node_path({}, [step])
+
+    def test_find_projects_only_the_page(self):
+        for i in range(100):
+            self.db.add_node(i, labels="Item", n=i)
+        with mock.patch(
+            "coffy.graph.graphdb_nx._project", wraps=graphdb_nx._project
+        ) as project:
+            result = self.db.find_nodes(label="Item", offset=10, limit=5)
+            self.assertEqual(project.call_count, 0)
+            self.assertEqual(result.first()["n"], 10)
+            self.assertEqual(project.call_count, 1)
+            self.assertEqual([n["n"] for n in result], list(range(10, 15)))
+            self.assertEqual(len(result), 5)
+            self.assertEqual(project.call_count, 5)
+        self.assertEqual(self.db.find_nodes(label="Item", limit=2)[1]["n"], 1)
+        self.assertEqual(
+            [
+                r["target"]
+                for r in self.db.find_relationships(rel_type="KNOWS", offset=1)
+            ],
+            ["C"],
+        )
+
+    def test_find_result_survives_graph_changes(self):
+        result = self.db.find_nodes(label="Person")
+        for node in result:
+            self.db.remove_node(node["id"])
+        self.assertEqual(self.db.count_nodes(), 0)
+        result = self.directed_db.find_relationships(rel_type="KNOWS")
+        self.directed_db.remove_relationship("B", "C")
+        self.assertEqual([r["source"] for r in result], ["A"])
+
+    def test_match_limit_offset(self):
+        pattern = [{"rel_type": "KNOWS", "node": {}}]
+        paths = self.db.match_node_path({}, pattern, return_nodes=False)
+        self.assertEqual(len(paths), 4)
+        page = self.db.match_node_path(
+            {}, pattern, return_nodes=False, limit=2, offset=1
+        )
+        self.assertEqual(page, paths[1:3])
+        full = self.db.match_full_path({}, pattern, limit=1)
+        self.assertEqual(len(full), 1)
+
+    def test_shortest_path(self):
+        db = GraphDB(directed=True)
+        for n in "ABCDE":
+            db.add_node(n, labels="City")
+        db.add_relationship("A", "B", rel_type="ROAD", km=10)
+        db.add_relationship("B", "E", rel_type="ROAD", km=10)
+        db.add_relationship("A", "C", rel_type="ROAD", km=2)
+        db.add_relationship("C", "D", rel_type="ROAD", km=3)
+        db.add_relationship("D", "E", rel_type="ROAD", km=4)
+        db.add_relationship("A", "E", rel_type="FLIGHT", km=1)
+        ids = lambda result: [n["id"] for n in result]
+        self.assertEqual(ids(db.shortest_path("A", "E")), ["A", "E"])
+        self.assertEqual(
+            ids(db.shortest_path("A", "E", rel_types="ROAD")), ["A", "B", "E"]
+        )
+        self.assertEqual(
+            ids(db.shortest_path("A", "E", rel_types=["ROAD"], weight="km")),
+            ["A", "C", "D", "E"],
+        )
+        self.assertEqual(ids(db.shortest_path("E", "A")), [])
+        self.assertEqual(
+            ids(db.shortest_path("E", "A", rel_types="ROAD", direction="in")),
+            ["E", "B", "A"],
+        )
+        self.assertEqual(ids(db.shortest_path("A", "Z")), [])
+        self.assertEqual(
+            db.shortest_path("A", "A", fields=["id"]).as_list(), [{"id": "A"}]
+        )
+        db.add_relationship("A", "D", rel_type="ROAD", km=-1)
+        with self.assertRaises(ValueError):
+            db.shortest_path("A", "E", rel_types="ROAD", weight="km")
+
+    def test_reachable_and_k_hop_neighbors(self):
+        db = GraphDB(directed=True)
+        for i in range(6):
+            db.add_node(i)
+        for i in range(4):
+            db.add_relationship(i, i + 1, rel_type="NEXT")
+        db.add_relationship(0, 5, rel_type="SKIP")
+        ids = lambda result: [n["id"] for n in result]
+        self.assertEqual(ids(db.reachable(0)), [1, 5, 2, 3, 4])
+        self.assertEqual(ids(db.reachable(0, max_depth=2, rel_types="NEXT")), [1, 2])
+        self.assertEqual(ids(db.reachable(3, direction="in")), [2, 1, 0])
+        self.assertEqual(db.reachable(0, rel_types="NEXT").first()["id"], 1)
+        self.assertEqual(ids(db.k_hop_neighbors(0, 1)), [1, 5])
+        self.assertEqual(ids(db.k_hop_neighbors(0, 3, rel_types="NEXT")), [3])
+        self.assertEqual(ids(db.k_hop_neighbors(4, 2, direction="any")), [2])
+        self.assertEqual(ids(db.k_hop_neighbors(0, 0)), [0])
+
+    def test_analytics_on_filtered_views(self):
+        db = GraphDB(directed=True)
+        for i in range(6):
+            db.add_node(i, labels="Page" if i < 5 else "Ad")
+        for i in range(3):
+            db.add_relationship(i, (i + 1) % 3, rel_type="LINK")
+        db.add_relationship(3, 4, rel_type="LINK")
+        db.add_relationship(0, 3, rel_type="AD")
+        db.add_relationship(4, 5, rel_type="LINK")
+        scores = db.pagerank(label="Page", rel_types="LINK")
+        self.assertEqual(sorted(scores), [0, 1, 2, 3, 4])
+        self.assertAlmostEqual(sum(scores.values()), 1.0)
+        self.assertAlmostEqual(scores[0], scores[1])
+        self.assertGreater(scores[4], scores[3])
+        self.assertEqual(
+            db.connected_components(label="Page", rel_types="LINK"),
+            [[0, 1, 2], [3, 4]],
+        )
+        self.assertEqual(db.connected_components(), [[0, 1, 2, 3, 4, 5]])
+        self.assertEqual(db.triangle_count(rel_types="LINK")[0], 1)
+        self.assertEqual(db.triangle_count(rel_types="LINK")[3], 0)
+        self.assertEqual(
+            db.betweenness(rel_types="LINK")[4],
+            db.betweenness(k=9, rel_types="LINK")[4],
+        )
+        self.assertEqual(len(db.betweenness(k=2, seed=1)), 6)
+        communities = db.community_detection(label="Page", rel_types="LINK", seed=1)
+        self.assertEqual(communities, [[0, 1, 2], [3, 4]])
+        with self.assertRaises(ValueError):
+            db.community_detection(method="unknown")
+
+    def test_analytics_write_back_in_one_save(self):
+        self.db.add_node("D", labels="Person", name="Dan")
+        with mock.patch.object(
+            self.db._writer, "save", wraps=self.db._writer.save
+        ) as save:
+            self.db.connected_components(write="component")
+            self.db.pagerank(write="rank")
+        self.assertEqual(save.call_count, 2)
+        self.assertEqual(self.db.get_node("A")["component"], 0)
+        self.assertEqual(self.db.get_node("D")["component"], 1)
+        self.assertAlmostEqual(
+            sum(n["rank"] for n in self.db.find_nodes(label="Person")), 1.0
+        )
+
 
 print("Graph tests:")
 unittest.TextTestRunner().run(unittest.TestLoader().loadTestsFromTestCase(TestGraphDB))
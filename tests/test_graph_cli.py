@@ -439,6 +439,25 @@ class TestGraphCli(unittest.TestCase):
         structured = json.loads(out)
         self.assertGreaterEqual(len(structured), 1)
 
+    def test_match_node_path_limit(self):
+        self._seed_small_graph()
+        code, out, err = self._run(
+            [
+                "--path",
+                self.graph_path,
+                "match-node-path",
+                "--start",
+                "{}",
+                "--pattern",
+                '[{"rel_type":"KNOWS"}]',
+                "--return-ids",
+                "--limit",
+                "1",
+            ]
+        )
+        self.assertEqual(code, 0, msg=err)
+        self.assertEqual(len(json.loads(out)), 1)
+
     # ---------- export / clear / remove ----------
 
     def test_export_nodes_relationships_graph_and_clear(self):
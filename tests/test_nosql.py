@@ -2,9 +2,19 @@
 # author: nsarathy
 
 from coffy.nosql import db
+from coffy.nosql.atomicity import (
+    _atomic_save,
+    _iter_json_items,
+    _load_json,
+    _read_frame,
+)
+from unittest import mock
 import json
+import multiprocessing
 import os
 import tempfile
+import threading
+import time
 import unittest
 
 
@@ -262,6 +272,24 @@ class TestCollectionManager(unittest.TestCase):
         all_docs = self.col.all()
         self.assertTrue(all(isinstance(d, dict) and not d for d in all_docs))
 
+    def test_replace_only_visits_indexed_candidates(self):
+        class NoScan(list):
+            def __iter__(self):
+                raise AssertionError("the whole collection was scanned")
+
+        col = db("replace_candidates")
+        col.clear()
+        col.add_many(
+            [{"id": i, "kind": "odd" if i % 2 else "even"} for i in range(100)]
+        )
+        col.documents = NoScan(col.documents)
+        q = col.where("id").in_([3, 4])
+        self.assertEqual(q.replace({"id": -1, "kind": "gone"}), {"replaced": 2})
+        self.assertEqual(col.where("kind").eq("gone").count(), 2)
+        self.assertEqual(col.where("id").eq(3).count(), 0)
+        col.documents = list(col.documents[:])
+        self.assertEqual([d["id"] for d in col.documents[2:6]], [2, -1, -1, 5])
+
     def test_limit_only(self):
         result = self.col.where("age").gte(0).limit(2).run(fields=["name"])
         self.assertEqual(len(result), 2)
@@ -620,6 +648,527 @@ class TestCollectionManager(unittest.TestCase):
         distinct_cities = users.where("age").gt(24).distinct("city")
         self.assertEqual(distinct_cities, ["Austin", "Seattle"])
 
+    def test_durability_policies(self):
+        with tempfile.TemporaryDirectory() as d:
+            for level in ("always", "group", "os"):
+                path = os.path.join(d, f"{level}.json")
+                col = db(f"durable_{level}", path=path, durability=level)
+                col.add({"name": "Alice"})
+                with open(path) as f:
+                    self.assertEqual(json.load(f), [{"name": "Alice"}])
+                col.close()
+
+            path = os.path.join(d, "never.json")
+            col = db("durable_never", path=path, durability="never")
+            col.add({"name": "Alice"})
+            self.assertFalse(os.path.exists(path))
+            col.flush()
+            with open(path) as f:
+                self.assertEqual(json.load(f), [{"name": "Alice"}])
+
+    def test_group_durability_coalesces_fsyncs(self):
+        with tempfile.TemporaryDirectory() as d:
+            col = db(
+                "durable_grouped",
+                path=os.path.join(d, "grouped.json"),
+                durability="group",
+                group_window=60,
+            )
+            with mock.patch("coffy.nosql.atomicity._fsync_path") as fsync:
+                for i in range(20):
+                    col.add({"i": i})
+                self.assertEqual(fsync.call_count, 1)
+                col.close()
+                self.assertEqual(fsync.call_count, 2)
+
+    def test_always_durability_syncs_the_rename(self):
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, "always.json")
+            col = db("durable_always", path=path)
+            with mock.patch("coffy.nosql.atomicity._fsync_dir") as fsync_dir:
+                col.add({"i": 1})
+                col.add({"i": 2})
+            self.assertEqual([c.args for c in fsync_dir.call_args_list], [(path,)] * 2)
+            col = db("durable_os", path=os.path.join(d, "os.json"), durability="os")
+            with mock.patch("coffy.nosql.atomicity._fsync_dir") as fsync_dir:
+                col.add({"i": 1})
+            fsync_dir.assert_not_called()
+
+    def test_invalid_durability(self):
+        with self.assertRaises(ValueError):
+            db("durable_invalid", durability="sometimes")
+
+    def test_parallel_scan_keeps_order(self):
+        col = db("parallel_scan")
+        col.clear()
+        col.add_many([{"id": i, "code": f"c{i % 7}"} for i in range(500)])
+        serial = col.where("code").matches("^c[13]$").run().as_list()
+        query = col.where("code").matches("^c[13]$").parallel(processes=2, threshold=0)
+        fork = multiprocessing.get_context
+        with mock.patch("multiprocessing.get_context", wraps=fork) as get_context:
+            parallel = query.run().as_list()
+        self.assertEqual(parallel, serial)
+        self.assertEqual(len(parallel), 143)
+        if (
+            "fork" in multiprocessing.get_all_start_methods()
+            and threading.active_count() == 1
+        ):
+            get_context.assert_called_once_with("fork")
+
+    def test_parallel_scan_stays_serial_beside_other_threads(self):
+        col = db("parallel_threads")
+        col.clear()
+        col.add_many([{"id": i, "code": f"c{i % 7}"} for i in range(100)])
+        release = threading.Event()
+        other = threading.Thread(target=release.wait)
+        other.start()
+        try:
+            with mock.patch("multiprocessing.get_context") as get_context:
+                found = (
+                    col.where("code")
+                    .matches("^c1$")
+                    .parallel(processes=2, threshold=0)
+                    .run()
+                    .as_list()
+                )
+        finally:
+            release.set()
+            other.join()
+        get_context.assert_not_called()
+        self.assertEqual([d["id"] for d in found], list(range(1, 100, 7)))
+
+    def test_parallel_below_threshold_stays_serial(self):
+        with mock.patch("coffy.nosql.query_builder._parallel_scan") as scan:
+            self.col.where("age").gt(0).parallel(threshold=100).run()
+        scan.assert_not_called()
+
+    def test_matches_prefix_uses_index(self):
+        col = db("regex_prefix")
+        col.clear()
+        col.add_many(
+            [{"name": n, "zip": z} for n, z in [("Alice", 46201), ("Alan", 78701)]]
+            + [{"name": f"user{i}", "zip": 10000 + i} for i in range(50)]
+            + [{"other": "Alfred"}]
+        )
+        q = col.where("name").matches("^Al")
+        self.assertEqual(len(q.documents), 2)
+        self.assertEqual(sorted(d["name"] for d in q.run()), ["Alan", "Alice"])
+        self.assertEqual(col.where("zip").matches("^46").first()["name"], "Alice")
+        self.assertEqual(col.where("missing").matches("None").count(), 0)
+
+    def test_matches_prefix_on_equal_numbers(self):
+        col = db("regex_numbers")
+        col.clear()
+        col.add_many([{"a": 2}, {"a": 2.0}, {"a": True}, {"a": 1}])
+        self.assertEqual(col.where("a").matches(r"^2\.0").run().as_list(), [{"a": 2.0}])
+        self.assertEqual(col.where("a").matches("^2$").run().as_list(), [{"a": 2}])
+        self.assertEqual(col.where("a").matches("^True").run().as_list(), [{"a": True}])
+
+    def test_matches_narrowed_keeps_collection_order(self):
+        col = db("regex_order")
+        col.clear()
+        col.create_ngram_index("name")
+        names = [f"{c}{i}" for i in range(100) for c in "AB"]
+        col.add_many([{"id": i, "name": n} for i, n in enumerate(names)])
+        expected = [i for i, n in enumerate(names) if n.startswith("A")]
+        q = col.where("name").matches("^A")
+        self.assertEqual(len(q.documents), 100)
+        self.assertEqual([d["id"] for d in q.run()], expected)
+        page = col.where("name").matches("^A").offset(10).limit(5).run()
+        self.assertEqual([d["id"] for d in page], expected[10:15])
+        self.assertEqual(col.where("name").matches("^A").first()["id"], 0)
+        ids = [d["id"] for d in col.where("name").matches("A1").run()]
+        self.assertEqual(ids, [i for i, n in enumerate(names) if "A1" in n])
+
+    def test_covered_projection_keeps_stored_numbers(self):
+        col = db("covered_numbers")
+        col.clear()
+        col.add_many([{"a": 2}, {"a": 2.0}, {"a": True}, {"a": 1.0}])
+        rows = col.where("a").eq(2).run(fields=["a"]).as_list()
+        self.assertEqual([type(r["a"]) for r in rows], [int, float])
+        rows = col.where("a").eq(2.0).run(fields=["a"]).as_list()
+        self.assertEqual([type(r["a"]) for r in rows], [int, float])
+        rows = col.where("a").eq(1).run(fields=["a"]).as_list()
+        self.assertEqual([type(r["a"]) for r in rows], [bool, float])
+
+    def test_matches_ngram_index(self):
+        col = db("regex_ngram")
+        col.clear()
+        col.create_ngram_index("bio")
+        col.add_many(
+            [
+                {"name": "A", "bio": "senior engineer"},
+                {"name": "B", "bio": "Engineering manager"},
+                {"name": "C", "bio": "designer"},
+                {"name": "D", "bio": 12345},
+            ]
+        )
+        q = col.where("bio").matches("engineer")
+        self.assertEqual(len(q.documents), 1)
+        self.assertEqual(q.first()["name"], "A")
+        self.assertEqual(col.where("bio").matches("ngineer.*").count(), 2)
+        self.assertEqual(col.where("bio").matches("234").first()["name"], "D")
+        col.where("name").eq("A").delete()
+        self.assertEqual(col.where("bio").matches("engineer").count(), 0)
+
+    def test_regex_literal_extraction(self):
+        import re
+        from coffy.nosql.index_engine import _regex_literal, _regex_prefix
+
+        self.assertEqual(_regex_prefix(re.compile(r"^ab\.c+d?")), "ab.c")
+        self.assertIsNone(_regex_prefix(re.compile("^(ab)")))
+        self.assertIsNone(_regex_prefix(re.compile("^a|b")))
+        self.assertEqual(_regex_literal(re.compile(r"x.*hello\d+wo?")), "hello")
+        self.assertEqual(_regex_literal(re.compile("(abc)")), "")
+
+    def test_text_search_ranked_and_composable(self):
+        col = db("text_search")
+        col.clear()
+        col.create_text_index(["title", "body"])
+        col.add_many(
+            [
+                {"id": 1, "title": "Wireless mouse", "body": "A mouse.", "price": 20},
+                {
+                    "id": 2,
+                    "title": "Keyboard",
+                    "body": "Pairs with any mouse",
+                    "price": 50,
+                },
+                {
+                    "id": 3,
+                    "title": "Wireless mouse pad",
+                    "body": "mouse mouse",
+                    "price": 10,
+                },
+                {"id": 4, "title": "Monitor", "body": "4k", "price": 300},
+            ]
+        )
+        ids = [d["id"] for d in col.search("mouse").run()]
+        self.assertEqual(ids[0], 3)
+        self.assertEqual(sorted(ids), [1, 2, 3])
+
+        cheap = col.search("wireless mouse").where("price").lt(15).run()
+        self.assertEqual([d["id"] for d in cheap], [3])
+
+        sorted_ids = [d["id"] for d in col.search("mouse").sort("price").run()]
+        self.assertEqual(sorted_ids, [3, 1, 2])
+
+        either = col.match_any(
+            lambda q: q.search("monitor"), lambda q: q.where("id").eq(1)
+        )
+        self.assertEqual(either.count(), 2)
+
+    def test_text_index_follows_writes(self):
+        col = db("text_updates")
+        col.clear()
+        col.create_text_index(["desc"])
+        col.add({"id": 1, "desc": "red apple"})
+        col.where("id").eq(1).update({"desc": "green pear"})
+        self.assertEqual(col.search("apple").count(), 0)
+        self.assertEqual(col.search("pear").count(), 1)
+        col.where("id").eq(1).delete()
+        self.assertEqual(col.search("pear").count(), 0)
+
+    def test_search_without_text_index(self):
+        with self.assertRaises(RuntimeError):
+            self.col.search("alice")
+
+    def test_stream_is_lazy_and_projects(self):
+        seen = []
+        q = self.col.where("age").gt(0)
+        original = q._scan
+
+        def tracked():
+            for doc in original():
+                seen.append(doc["name"])
+                yield doc
+
+        q._scan = tracked
+        rows = q.stream(fields=["name", "nested.score"])
+        self.assertEqual(next(rows), {"name": "Alice", "nested.score": None})
+        self.assertEqual(seen, ["Alice"])
+
+    def test_covered_query_skips_documents(self):
+        q = self.col.where("name").eq("Bob")
+        q.documents = None  # covered queries must not read documents
+        self.assertEqual(q.count(), 1)
+        q = self.col.where("name").eq("Bob")
+        q.documents = None
+        self.assertEqual(q.run(fields=["name"]).as_list(), [{"name": "Bob"}])
+
+    def test_eq_missing_value_uses_index(self):
+        self.assertEqual(self.col.where("name").eq("Nobody").count(), 0)
+        self.assertEqual(self.col.where("name").in_(["Bob", "Zed"]).count(), 1)
+
+    def test_update_uses_index_candidates(self):
+        seen = []
+        q = self.col.where("name").eq("Bob")
+        q.filters.append(lambda d: seen.append(d["name"]) or True)
+        with mock.patch.object(self.col, "_save") as save:
+            self.assertEqual(q.update({"age": 26}), {"updated": 1})
+        self.assertEqual(seen, ["Bob"])
+        save.assert_called_once()
+        self.assertEqual(self.col.where("age").eq(26).first()["name"], "Bob")
+
+    def test_noop_mutations_skip_save(self):
+        with mock.patch.object(self.col, "_save") as save:
+            self.assertEqual(
+                self.col.where("name").eq("Bob").update({"age": 25}), {"updated": 1}
+            )
+            self.assertEqual(self.col.where("name").eq("Zed").delete(), {"deleted": 0})
+            self.assertEqual(
+                self.col.where("name").eq("Bob").remove_field("nested"), {"removed": 0}
+            )
+        save.assert_not_called()
+
+    def test_delete_keeps_equal_unmatched_documents(self):
+        self.col.add({"name": "Bob", "age": 25, "tags": ["y", "z"]})
+        q = self.col.where("name").eq("Bob")
+        q.documents = q.documents[:1]
+        self.assertEqual(q.delete(), {"deleted": 1})
+        self.assertEqual(self.col.where("name").eq("Bob").count(), 1)
+
+    def test_update_reindexes_only_changed_fields(self):
+        col = db("delta_reindex")
+        col.clear()
+        col.create_ngram_index("title", n=3)
+        col.create_text_index(["body"])
+        col.add({"id": 1, "title": "alpha", "body": "red", "meta": {"k": 1}})
+        im = col.index_manager
+        with mock.patch.object(
+            im, "_unindex_values", wraps=im._unindex_values
+        ) as unindex:
+            col.where("id").eq(1).update({"title": "omega", "body": "red"})
+        self.assertEqual(list(unindex.call_args[0][1]), ["title"])
+        self.assertEqual(col.where("title").matches("meg").count(), 1)
+        self.assertEqual(col.where("title").matches("lph").count(), 0)
+        self.assertEqual(col.search("red").count(), 1)
+        self.assertEqual(col.where("id").eq(1).count(), 1)
+
+        col.where("id").eq(1).remove_field("meta.k")
+        self.assertEqual(col.where("id").eq(1).first()["meta"], {})
+        self.assertEqual(im.unindexed["meta"], 1)
+
+    def test_watch_delivers_filtered_events(self):
+        stream = self.col.watch(filter=lambda q: q.where("age").gte(30))
+        self.col.add({"name": "Dave", "age": 35})
+        self.col.add({"name": "Eve", "age": 20})
+        self.col.where("name").eq("Dave").update({"age": 36})
+        self.col.where("name").eq("Alice").delete()
+        events = list(iter(stream.try_next, None))
+        self.assertEqual([e["op"] for e in events], ["insert", "update", "delete"])
+        self.assertEqual(events[2]["document"]["name"], "Alice")
+        self.assertEqual([e["seq"] for e in events], sorted(e["seq"] for e in events))
+        stream.close()
+        self.assertEqual(list(stream), [])
+
+    def test_watch_resume_and_overflow(self):
+        stream = self.col.watch(maxsize=2)
+        self.col.add({"name": "A"})
+        token = stream.try_next()["seq"]
+        for name in ("B", "C", "D"):
+            self.col.add({"name": name})
+        with self.assertRaises(RuntimeError):
+            stream.try_next()
+        resumed = self.col.watch(resume_after=token)
+        names = [e["document"]["name"] for e in iter(resumed.try_next, None)]
+        self.assertEqual(names, ["B", "C", "D"])
+        with self.assertRaises(ValueError):
+            self.col.watch(resume_after=token + 100)
+
+    def test_watch_callback(self):
+        seen = []
+        stream = self.col.watch(callback=seen.append)
+        self.col.where("name").eq("Bob").remove_field("tags")
+        stream.close()
+        self.col.add({"name": "Zed"})
+        self.assertEqual([(e["op"], e["fields"]) for e in seen], [("update", ["tags"])])
+
+    def test_ttl_index_expires_lazily_in_batches(self):
+        col = db("ttl_cache")
+        col.clear()
+        now = time.time()
+        col.add_many([{"key": i, "expires": now - 10} for i in range(5)])
+        col.add({"key": "fresh", "expires": now + 3600})
+        col.add({"key": "iso", "expires": "2000-01-01T00:00:00+00:00"})
+        col.add({"key": "none"})
+        col.create_ttl_index("expires", batch_size=4)
+        with mock.patch.object(col, "_save") as save:
+            self.assertEqual(col.count(), 4)
+        save.assert_called_once()
+        self.assertEqual(col.expire(), {"expired": 2})
+        self.assertEqual(col.distinct("key"), ["fresh", "none"])
+
+    def test_ttl_follows_updates(self):
+        col = db("ttl_updates")
+        col.clear()
+        col.create_ttl_index("seen", expire_after=60)
+        col.add({"key": 1, "seen": time.time()})
+        col.add({"key": 2, "seen": time.time()})
+        col.where("key").eq(1).update({"seen": time.time() - 120})
+        col.where("key").eq(2).remove_field("seen")
+        self.assertEqual(col.distinct("key"), ["2"])
+        self.assertEqual(col.expire(), {"expired": 0})
+
+    def test_capped_collection_evicts_oldest(self):
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, "logs.json")
+            col = db("capped_logs", path=path, max_docs=3)
+            for i in range(5):
+                col.add({"seq": i, "level": "info" if i % 2 else "error"})
+            self.assertEqual([doc["seq"] for doc in col.all_docs()], [2, 3, 4])
+            self.assertEqual(col.where("seq").eq(0).count(), 0)
+            self.assertEqual(col.where("level").eq("error").count(), 2)
+            col.add_many([{"seq": 5}, {"seq": 6}])
+            self.assertEqual(col.first()["seq"], 4)
+
+            col.where("seq").eq(5).delete()
+            col.where("seq").eq(6).update({"level": "warn"})
+            with open(path, "r", encoding="utf-8") as f:
+                self.assertEqual(
+                    json.load(f),
+                    [{"seq": 4, "level": "error"}, {"seq": 6, "level": "warn"}],
+                )
+            reopened = db("capped_logs", path=path, max_docs=1)
+            self.assertEqual(reopened.all_docs()[0], {"seq": 6, "level": "warn"})
+
+    def test_capped_collection_by_bytes(self):
+        col = db("capped_bytes", max_bytes=60)
+        for i in range(10):
+            col.add({"n": i, "pad": "x" * 10})
+        self.assertEqual([doc["n"] for doc in col.all_docs()], [8, 9])
+        self.assertLessEqual(col.documents.nbytes, 60)
+        with self.assertRaises(ValueError):
+            db("capped_bad", max_docs=0)
+
+    def test_capped_collection_all_is_a_list(self):
+        col = db("capped_list", max_docs=2)
+        col.add_many([{"n": 1}, {"n": 2}, {"n": 3}])
+        for docs in (col.all(), col.all_docs()):
+            self.assertIsInstance(docs, list)
+            self.assertEqual(docs, [{"n": 2}, {"n": 3}])
+            self.assertEqual(json.loads(json.dumps(docs)), [{"n": 2}, {"n": 3}])
+        col.all().clear()
+        self.assertEqual(col.count(), 2)
+
+    def test_schema_inference(self):
+        self.assertEqual(
+            self.col.schema(),
+            {
+                "age": {"int": 3},
+                "name": {"string": 3},
+                "nested": {"object": 1},
+                "nested.score": {"int": 1},
+                "tags": {"array": 2},
+            },
+        )
+        self.col.where("name").eq("Carol").update({"nested": None})
+        self.col.where("name").eq("Bob").remove_field("tags")
+        schema = self.col.schema()
+        self.assertEqual(schema["nested"], {"null": 1})
+        self.assertNotIn("nested.score", schema)
+        self.assertEqual(schema["tags"], {"array": 1})
+
+    def test_uniform_numeric_fast_path(self):
+        q = self.col.where("age")
+        self.assertTrue(q._uniform("age", {"int", "float", "bool"}))
+        q = q.gt(26)
+        self.col.add({"name": "Dave", "age": "old"})  # written after compiling
+        self.assertEqual(sorted(d["name"] for d in q.run()), ["Alice", "Carol"])
+        self.assertFalse(self.col.where("age")._uniform("age", {"int", "float"}))
+        self.assertEqual(self.col.where("age").lt(35).count(), 2)
+
+    def test_stats_and_compact(self):
+        col = db("stats_compact")
+        col.clear()
+        # Values longer than 64 characters skip the automatic intern table
+        col.add_many([{"status": " ".join(["active"] * 20), "n": i} for i in range(50)])
+        stats = col.stats()
+        self.assertEqual(stats["documents"], 50)
+        self.assertEqual(stats["indexes"]["status"]["keys"], 1)
+        self.assertEqual(stats["indexes"]["n"]["keys"], 50)
+        self.assertGreater(stats["duplicate_string_bytes"], 0)
+        self.assertGreater(stats["index_bytes"], 0)
+
+        docs = list(col.all_docs())
+        self.assertEqual(col.compact(), {"interned": 49})
+        after = col.stats()
+        self.assertEqual(after["duplicate_string_bytes"], 0)
+        self.assertLess(after["document_bytes"], stats["document_bytes"])
+        self.assertTrue(all(a is b for a, b in zip(docs, col.all_docs())))
+        self.assertEqual(col.where("status").eq(" ".join(["active"] * 20)).count(), 50)
+
+    def test_added_documents_share_strings(self):
+        docs = [json.loads('{"status": "active", "id": %d}' % i) for i in range(3)]
+        self.col.add_many(docs)
+        self.col.add(json.loads('{"status": "active", "id": 3}'))
+        statuses = [d["status"] for d in self.col.where("status").exists().run()]
+        self.assertEqual(len({id(s) for s in statuses}), 1)
+        keys = {id(k) for d in self.col.all_docs() for k in d if k == "status"}
+        self.assertEqual(len(keys), 1)
+
+    def test_intern_table_bounds_keys(self):
+        col = db("intern_map_keys")
+        col.clear()
+        col.add_many(
+            [
+                {"scores": {f"user{i}-{j}": "high" for j in range(10)}}
+                for i in range(300)
+            ]
+        )
+        table = col._strings
+        self.assertEqual(len(table.keys), 1024)
+        self.assertLessEqual(set(table.values), set(table.keys) | {None})
+        self.assertEqual(col.where("scores.user299-9").eq("high").count(), 1)
+
+    def test_compressed_collection_files(self):
+        docs = [
+            {"id": i, "status": "active" if i % 3 else "banned"} for i in range(2500)
+        ]
+        with tempfile.TemporaryDirectory() as d:
+            for ext in (".json.gz", ".json.zf"):
+                path = os.path.join(d, "users" + ext)
+                col = db("compressed_users", path=path)
+                col.add_many(docs)
+                reopened = db("compressed_users", path=path)
+                self.assertEqual(reopened.all_docs(), docs)
+                self.assertEqual(reopened.where("status").eq("banned").count(), 834)
+                plain = os.path.join(d, "users.json")
+                reopened.save(plain)
+                self.assertLess(os.path.getsize(path), os.path.getsize(plain))
+            with self.assertRaises(ValueError):
+                db("compressed_users", path=os.path.join(d, "users.gz"))
+
+    def test_framed_file_reads_only_needed_frames(self):
+        docs = [{"id": i} for i in range(2500)]
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, "docs.json.zf")
+            _atomic_save(docs, path)
+            self.assertEqual(_load_json(path), docs)
+            with mock.patch(
+                "coffy.nosql.atomicity._read_frame", wraps=_read_frame
+            ) as read:
+                items = list(_iter_json_items(path, start=1990, stop=2010))
+            self.assertEqual(items, docs[1990:2010])
+            self.assertEqual(read.call_count, 2)
+
+            _atomic_save({"nodes": docs, "version": 2}, path)
+            self.assertEqual(_load_json(path), {"nodes": docs, "version": 2})
+            self.assertEqual(list(_iter_json_items(path, "nodes", 2499)), docs[2499:])
+
+    def test_zstd_collection_file(self):
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, "users.json.zst")
+            try:
+                import zstandard  # noqa: F401
+            except ImportError:
+                with self.assertRaises(ImportError):
+                    _atomic_save([{"a": 1}], path)
+                return
+            col = db("zstd_users", path=path)
+            col.add({"a": 1})
+            self.assertEqual(db("zstd_users", path=path).all_docs(), [{"a": 1}])
+
 
 print("NoSQL tests:")
 
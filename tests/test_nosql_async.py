@@ -0,0 +1,118 @@
+# tests/test_nosql_async.py
+# author: nsarathy
+
+from coffy.nosql import adb
+from unittest import mock
+import asyncio
+import json
+import os
+import tempfile
+import time
+import unittest
+
+
+class TestAsyncCollectionManager(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.temp_dir.name, "users.json")
+        self.col = adb("async_users", path=self.path)
+        await self.col.add_many(
+            [
+                {"name": "Alice", "age": 30},
+                {"name": "Bob", "age": 25},
+                {"name": "Carol", "age": 40},
+            ]
+        )
+
+    async def asyncTearDown(self):
+        await self.col.close()
+        self.temp_dir.cleanup()
+
+    def _read_file(self):
+        with open(self.path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    async def test_add_is_persisted_when_awaited(self):
+        res = await self.col.add({"name": "Dave", "age": 35})
+        self.assertEqual(res, {"inserted": 1})
+        self.assertEqual(len(self._read_file()), 4)
+
+    async def test_query_run_and_count(self):
+        result = await self.col.where("age").gt(26).sort("age").run(fields=["name"])
+        self.assertEqual(result.as_list(), [{"name": "Alice"}, {"name": "Carol"}])
+        self.assertEqual(await self.col.where("name").eq("Bob").count(), 1)
+        self.assertEqual(await self.col.count(), 3)
+        self.assertEqual(await self.col.sum("age"), 95)
+
+    async def test_query_stream(self):
+        q = self.col.where("age").gt(26).sort("age")
+        names = [d["name"] async for d in q.stream(fields=["name"])]
+        self.assertEqual(names, ["Alice", "Carol"])
+        self.assertEqual([d async for d in self.col.where("age").gt(99).stream()], [])
+
+    async def test_match_any(self):
+        q = self.col.match_any(
+            lambda q: q.where("name").eq("Alice"), lambda q: q.where("age").eq(40)
+        )
+        self.assertEqual(await q.count(), 2)
+
+    async def test_mutators(self):
+        await self.col.where("name").eq("Alice").update({"vip": True})
+        await self.col.where("name").eq("Bob").delete()
+        await self.col.where("name").eq("Carol").remove_field("age")
+        on_disk = self._read_file()
+        self.assertEqual([d["name"] for d in on_disk], ["Alice", "Carol"])
+        self.assertTrue(on_disk[0]["vip"])
+        self.assertNotIn("age", on_disk[1])
+
+    async def test_concurrent_adds_share_saves(self):
+        writer = self.col._collection._writer
+        with mock.patch.object(writer, "save", wraps=writer.save) as save:
+            await asyncio.gather(
+                *(self.col.add({"name": f"user{i}", "age": i}) for i in range(50))
+            )
+        self.assertLess(save.call_count, 50)
+        self.assertEqual(len(self._read_file()), 53)
+
+    async def test_unknown_chain_method(self):
+        with self.assertRaises(AttributeError):
+            self.col.where("age").nope(1)
+
+    async def test_closed_manager_rejects_calls(self):
+        await self.col.close()
+        with self.assertRaises(RuntimeError):
+            await self.col.count()
+
+    async def test_ttl_expiry_on_read_is_saved(self):
+        await self.col.add({"name": "Old", "expires": time.time() - 10})
+        await self.col.create_ttl_index("expires")
+        self.assertEqual(await self.col.count(), 3)  # deletes the expired one
+        self.assertEqual(len(self._read_file()), 4)  # reads do not wait for disk
+        await self.col.flush()
+        self.assertEqual(
+            [d["name"] for d in self._read_file()], ["Alice", "Bob", "Carol"]
+        )
+        await self.col.add({"name": "Gone", "expires": time.time() - 10})
+        self.assertEqual(await self.col.expire(), {"expired": 1})
+        self.assertEqual(len(self._read_file()), 3)
+
+    async def test_watch_async_iteration(self):
+        stream = self.col.watch(filter=lambda q: q.where("age").gt(30))
+
+        async def consume():
+            return [event async for event in stream]
+
+        task = asyncio.create_task(consume())
+        await self.col.add({"name": "Young", "age": 20})
+        await self.col.add({"name": "Old", "age": 60})
+        await self.col.where("name").eq("Old").update({"age": 61})
+        stream.close()
+        events = await asyncio.wait_for(task, 1)
+        self.assertEqual([e["op"] for e in events], ["insert", "update"])
+        self.assertEqual(events[1]["document"]["age"], 61)
+        self.assertEqual(events[1]["fields"], ["age"])
+
+
+if __name__ == "__main__":
+    unittest.main()
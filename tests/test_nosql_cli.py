@@ -9,9 +9,11 @@ import json
 import tempfile
 import unittest
 from contextlib import redirect_stdout, redirect_stderr
+from unittest import mock
 
 # Under test
 from coffy.cli.nosql_cli import main as cli_main
+from coffy.nosql.atomicity import _read_frame
 
 
 class TestNoSQLCli(unittest.TestCase):
@@ -346,6 +348,78 @@ class TestNoSQLCli(unittest.TestCase):
         self.assertTrue(len(out_pretty) > len(out_compact))
         self.assertIn("\n", out_pretty)
 
+    def test_query_streams_valid_json_arrays(self):
+        self._seed()
+        for value, expected in (("25", [1, 2, 3]), ("99", [])):
+            for flags in ([], ["--pretty"]):
+                code, out, err = self._run(
+                    [
+                        "--collection",
+                        self.collection,
+                        "--path",
+                        self.db_path,
+                        "query",
+                        "--field",
+                        "age",
+                        "--op",
+                        "gte",
+                        "--value",
+                        value,
+                        *flags,
+                    ]
+                )
+                self.assertEqual(code, 0, msg=err)
+                data = json.loads(out)
+                self.assertIsInstance(data, list)
+                self.assertEqual(sorted(d["id"] for d in data), sorted(expected))
+        out_file = os.path.join(self.tmpdir.name, "empty.json")
+        code, out, err = self._run(
+            [
+                "--collection",
+                self.collection,
+                "--path",
+                self.db_path,
+                "query",
+                "--field",
+                "age",
+                "--op",
+                "gt",
+                "--value",
+                "99",
+                "--out",
+                out_file,
+            ]
+        )
+        self.assertEqual(code, 0, msg=err)
+        with open(out_file, "r", encoding="utf-8") as f:
+            self.assertEqual(json.load(f), [])
+
+    def test_read_range_of_framed_file(self):
+        path = os.path.join(self.tmpdir.name, "events.json.zf")
+        docs = [{"id": i} for i in range(2500)]
+        code, _, err = self._run(
+            [
+                "--collection",
+                "events",
+                "--path",
+                path,
+                "add-many",
+                json.dumps(docs),
+            ]
+        )
+        self.assertEqual(code, 0, msg=err)
+        argv = ["--collection", "events", "--path", path, "read"]
+        with mock.patch("coffy.nosql.atomicity._read_frame", wraps=_read_frame) as read:
+            code, out, err = self._run(argv + ["--offset", "1995", "--limit", "10"])
+        self.assertEqual(code, 0, msg=err)
+        self.assertEqual(json.loads(out), docs[1995:2005])
+        self.assertEqual(read.call_count, 2)
+        code, out, err = self._run(argv + ["--offset", "2498"])
+        self.assertEqual(json.loads(out), docs[2498:])
+        code, out, err = self._run(argv + ["--limit", "-1"], expect_exit=True)
+        self.assertNotEqual(code, 0)
+        self.assertIn("must not be negative", err)
+
     # ---------- agg and clear ----------
 
     def test_agg_count_sum_avg_min_max(self):